@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from .models import StreamingService
+        from .registry import invalidate_registry
+        post_save.connect(invalidate_registry, sender=StreamingService)
+        post_delete.connect(invalidate_registry, sender=StreamingService)
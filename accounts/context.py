@@ -0,0 +1,154 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import DEFAULT_REGION
+from .registry import get_registry
+
+
+class UserContext:
+    """The per-user data needed to decorate TMDb results.
+
+    Holds the user's subscribed provider IDs and the (media_type, tmdb_id)
+    keys of their watchlist as frozensets, so membership checks are O(1),
+    and the region whose watch providers they see.
+    """
+    __slots__ = ('service_ids', 'watchlist_keys', 'region')
+
+    def __init__(self, service_ids=frozenset(), watchlist_keys=frozenset(), region=DEFAULT_REGION):
+        self.service_ids = frozenset(service_ids)
+        self.watchlist_keys = frozenset(watchlist_keys)
+        self.region = region
+
+    def in_watchlist(self, media_type, tmdb_id):
+        return (media_type, tmdb_id) in self.watchlist_keys
+
+    def available_services(self, providers, registry=None):
+        """Get the names of the user's services that stream a title, as
+        named in the provider registry. Async callers pass the registry
+        from aget_registry()."""
+        if not providers or not self.service_ids:
+            return []
+        if registry is None:
+            registry = get_registry()
+        return [
+            registry.name(provider['provider_id'], provider['provider_name'])
+            for provider in providers.get('flatrate', [])
+            if provider['provider_id'] in self.service_ids
+        ]
+
+
+ANONYMOUS_CONTEXT = UserContext()
+
+# Cached contexts are keyed by two versions, both replaced whenever the
+# user's services, region or watchlist change. The per-user version, kept
+# in the cache under _version_key(), invalidates every session of the user
+# sharing that cache. The per-process default cache isn't shared by the
+# workers, so the session also holds a token: sessions are shared by every
+# worker, so the session that made the change sees it at once everywhere.
+VERSION_SESSION_KEY = 'user_context_version'
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def _version_key(user):
+    return f"user_context_version_{user.pk}"
+
+
+def _cache_key(user, user_version, session_version):
+    return f"user_context_{user.pk}_{user_version}_{session_version}"
+
+
+def load_user_context(user):
+    """Build a UserContext for a user from the database"""
+    return UserContext(
+        service_ids=user.streaming_services.values_list('provider_id', flat=True),
+        watchlist_keys=user.watchlist_items.values_list('media_type', 'tmdb_id'),
+        region=user.region,
+    )
+
+
+async def aload_user_context(user):
+    """Async version of load_user_context()"""
+    return UserContext(
+        service_ids=[
+            provider_id async for provider_id
+            in user.streaming_services.values_list('provider_id', flat=True)
+        ],
+        watchlist_keys=[
+            key async for key
+            in user.watchlist_items.values_list('media_type', 'tmdb_id')
+        ],
+        region=user.region,
+    )
+
+
+def get_user_context(request):
+    """Get the UserContext for request.user, built at most once per request"""
+    if not hasattr(request, '_user_context'):
+        request._user_context = _get_cached_context(request)
+    return request._user_context
+
+
+def _get_cached_context(request):
+    user = request.user
+    if not user.is_authenticated:
+        return ANONYMOUS_CONTEXT
+
+    session_version = request.session.get(VERSION_SESSION_KEY)
+    if session_version is None:
+        session_version = request.session[VERSION_SESSION_KEY] = _new_version()
+    user_version = cache.get_or_set(_version_key(user), _new_version, None)
+    cache_key = _cache_key(user, user_version, session_version)
+    context = cache.get(cache_key)
+    if context is None:
+        context = load_user_context(user)
+        cache.set(cache_key, context, settings.USER_CONTEXT_CACHE_TTL)
+    return context
+
+
+async def aget_user_context(request):
+    """Async version of get_user_context()"""
+    if not hasattr(request, '_user_context'):
+        request._user_context = await _aget_cached_context(request)
+    return request._user_context
+
+
+async def _aget_cached_context(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return ANONYMOUS_CONTEXT
+
+    session_version = await request.session.aget(VERSION_SESSION_KEY)
+    if session_version is None:
+        session_version = _new_version()
+        await request.session.aset(VERSION_SESSION_KEY, session_version)
+    user_version = await cache.aget_or_set(_version_key(user), _new_version, None)
+    cache_key = _cache_key(user, user_version, session_version)
+    context = await cache.aget(cache_key)
+    if context is None:
+        context = await aload_user_context(user)
+        await cache.aset(cache_key, context, settings.USER_CONTEXT_CACHE_TTL)
+    return context
+
+
+def invalidate_user_contexts(user):
+    """Drop the cached UserContexts of every session of a user sharing this
+    cache"""
+    cache.set(_version_key(user), _new_version(), None)
+
+
+def invalidate_user_context(request):
+    """Drop the cached UserContext after the user's services, region or
+    watchlist change"""
+    session_version = request.session.get(VERSION_SESSION_KEY)
+    user_version = cache.get(_version_key(request.user))
+    if session_version is not None and user_version is not None:
+        cache.delete(_cache_key(request.user, user_version, session_version))
+    invalidate_user_contexts(request.user)
+    request.session[VERSION_SESSION_KEY] = _new_version()
+    if hasattr(request, '_user_context'):
+        del request._user_context
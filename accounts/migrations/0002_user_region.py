@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='region',
+            field=models.CharField(choices=[('US', 'United States'), ('CA', 'Canada'), ('GB', 'United Kingdom'), ('IE', 'Ireland'), ('AU', 'Australia'), ('NZ', 'New Zealand'), ('DE', 'Germany'), ('FR', 'France'), ('ES', 'Spain'), ('IT', 'Italy'), ('NL', 'Netherlands'), ('SE', 'Sweden'), ('BR', 'Brazil'), ('MX', 'Mexico'), ('IN', 'India'), ('JP', 'Japan')], default='US', max_length=2),
+        ),
+    ]
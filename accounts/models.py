@@ -14,12 +14,35 @@ class StreamingService(models.Model):
         ordering = ['name']
 
 
+# Regions whose streaming availability users can pick (TMDb watch regions)
+REGION_CHOICES = [
+    ('US', 'United States'),
+    ('CA', 'Canada'),
+    ('GB', 'United Kingdom'),
+    ('IE', 'Ireland'),
+    ('AU', 'Australia'),
+    ('NZ', 'New Zealand'),
+    ('DE', 'Germany'),
+    ('FR', 'France'),
+    ('ES', 'Spain'),
+    ('IT', 'Italy'),
+    ('NL', 'Netherlands'),
+    ('SE', 'Sweden'),
+    ('BR', 'Brazil'),
+    ('MX', 'Mexico'),
+    ('IN', 'India'),
+    ('JP', 'Japan'),
+]
+DEFAULT_REGION = 'US'
+
+
 class User(AbstractUser):
     streaming_services = models.ManyToManyField(
         StreamingService,
         related_name='users',
         blank=True
     )
+    region = models.CharField(max_length=2, choices=REGION_CHOICES, default=DEFAULT_REGION)
     
     def has_service(self, provider_id):
         return self.streaming_services.filter(provider_id=provider_id).exists()
@@ -0,0 +1,98 @@
+import threading
+import time
+import uuid
+from collections import namedtuple
+from types import MappingProxyType
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+# Cache key holding a token for the current version of the StreamingService
+# table. It is replaced whenever a service is saved or deleted, which makes
+# every worker reload its registry on the next lookup.
+REGISTRY_VERSION_KEY = 'streaming_registry_version'
+
+Provider = namedtuple('Provider', 'pk provider_id name logo_path')
+
+
+class ProviderRegistry:
+    """An immutable snapshot of the StreamingService table.
+
+    Maps TMDb provider IDs to Provider records and iterates them by name,
+    like StreamingService's default ordering.
+    """
+    __slots__ = ('version', 'providers', 'loaded_at')
+
+    def __init__(self, providers=(), version=None):
+        self.version = version
+        self.providers = MappingProxyType({provider.provider_id: provider for provider in providers})
+        self.loaded_at = time.monotonic()
+
+    def __iter__(self):
+        return iter(sorted(self.providers.values(), key=lambda provider: provider.name))
+
+    def __len__(self):
+        return len(self.providers)
+
+    def __contains__(self, provider_id):
+        return provider_id in self.providers
+
+    def get(self, provider_id):
+        return self.providers.get(provider_id)
+
+    def name(self, provider_id, default=None):
+        provider = self.providers.get(provider_id)
+        return provider.name if provider else default
+
+
+_registry = ProviderRegistry()
+_lock = threading.Lock()
+
+
+def get_registry():
+    """Get this worker's ProviderRegistry, reloading it if the table changed.
+
+    A per-process cache backend only sees the version changes made by its
+    own worker, so the registry is also reloaded after
+    PROVIDER_REGISTRY_TTL seconds.
+    """
+    global _registry
+    version = cache.get(REGISTRY_VERSION_KEY)
+    registry = _registry
+    if version is not None and version == registry.version and not _expired(registry):
+        return registry
+
+    with _lock:
+        if _registry is registry:
+            if version is None:
+                cache.add(REGISTRY_VERSION_KEY, uuid.uuid4().hex, None)
+                version = cache.get(REGISTRY_VERSION_KEY)
+            _registry = ProviderRegistry(_load_providers(), version)
+        return _registry
+
+
+async def aget_registry():
+    """Async version of get_registry()"""
+    version = await cache.aget(REGISTRY_VERSION_KEY)
+    registry = _registry
+    if version is not None and version == registry.version and not _expired(registry):
+        return registry
+    return await sync_to_async(get_registry)()
+
+
+def _expired(registry):
+    return time.monotonic() - registry.loaded_at > settings.PROVIDER_REGISTRY_TTL
+
+
+def _load_providers():
+    from .models import StreamingService
+    return [
+        Provider(*row) for row in
+        StreamingService.objects.values_list('pk', 'provider_id', 'name', 'logo_path')
+    ]
+
+
+def invalidate_registry(**kwargs):
+    """Signal receiver replacing the registry version after a write"""
+    cache.set(REGISTRY_VERSION_KEY, uuid.uuid4().hex, None)
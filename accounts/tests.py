@@ -1,3 +1,128 @@
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .context import ANONYMOUS_CONTEXT, get_user_context, invalidate_user_context
+from .models import StreamingService, User
+from .registry import get_registry
+
+
+class ProviderRegistryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.netflix = StreamingService.objects.create(provider_id=8, name='Netflix')
+        cls.hulu = StreamingService.objects.create(provider_id=15, name='Hulu')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_registry_is_loaded_once(self):
+        registry = get_registry()
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_registry(), registry)
+        self.assertEqual([provider.name for provider in registry], ['Hulu', 'Netflix'])
+        self.assertEqual(registry.name(8), 'Netflix')
+
+    def test_writes_reload_the_registry(self):
+        get_registry()
+
+        self.netflix.name = 'Netflix Standard'
+        self.netflix.save()
+        StreamingService.objects.create(provider_id=337, name='Disney Plus')
+
+        registry = get_registry()
+        self.assertEqual(registry.name(8), 'Netflix Standard')
+        self.assertIn(337, registry)
+
+
+class UserContextTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='secret', region='GB')
+        cls.user.streaming_services.add(StreamingService.objects.create(provider_id=8, name='Netflix'))
+        cls.user.watchlist_items.create(tmdb_id=7, media_type='movie', title='Movie 7')
+
+    def setUp(self):
+        cache.clear()
+
+    def request(self, session=None, user=None):
+        request = RequestFactory().get('/')
+        request.user = user or self.user
+        request.session = session if session is not None else SessionStore()
+        return request
+
+    def test_context_is_loaded_from_the_database(self):
+        context = get_user_context(self.request())
+
+        self.assertEqual(context.service_ids, {8})
+        self.assertTrue(context.in_watchlist('movie', 7))
+        self.assertFalse(context.in_watchlist('tv', 7))
+        self.assertEqual(context.region, 'GB')
+        self.assertIs(get_user_context(self.request(user=AnonymousUser())), ANONYMOUS_CONTEXT)
+
+    def test_context_is_cached_across_requests(self):
+        session = SessionStore()
+        get_user_context(self.request(session))
+
+        with self.assertNumQueries(0):
+            context = get_user_context(self.request(session))
+        self.assertTrue(context.in_watchlist('movie', 7))
+
+    def test_changes_invalidate_every_session_of_the_user(self):
+        request, other_session = self.request(), SessionStore()
+        get_user_context(request)
+        get_user_context(self.request(other_session))
+
+        self.user.watchlist_items.create(tmdb_id=9, media_type='tv', title='Show 9')
+        invalidate_user_context(request)
+
+        self.assertTrue(get_user_context(request).in_watchlist('tv', 9))
+        self.assertTrue(get_user_context(self.request(other_session)).in_watchlist('tv', 9))
+
+
+class ProfileTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.services = [
+            StreamingService.objects.create(provider_id=provider_id, name=name)
+            for provider_id, name in [(8, 'Netflix'), (9, 'Amazon Prime Video'), (15, 'Hulu')]
+        ]
+        cls.user = User.objects.create_user('viewer', password='secret')
+        cls.user.streaming_services.set(cls.services[:2])
+
+    def setUp(self):
+        cache.clear()
+        get_registry()
+        self.client.force_login(self.user)
+
+    def test_services_are_updated_by_difference(self):
+        # Session, user, current services, one delete and one insert in a
+        # savepoint, and the session save in another
+        with self.assertNumQueries(10):
+            self.client.post(reverse('profile'), {'services': ['9', '15', '404', 'x']})
+
+        self.assertEqual(
+            set(self.user.streaming_services.values_list('provider_id', flat=True)), {9, 15}
+        )
+
+    def test_profile_lists_services_from_the_registry(self):
+        # Session, user and the user's services
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('profile'))
+
+        self.assertEqual([service.name for service in response.context['all_services']],
+                         ['Amazon Prime Video', 'Hulu', 'Netflix'])
+        self.assertEqual(response.context['user_service_ids'], {8, 9})
+
+    def test_region_is_updated(self):
+        self.client.post(reverse('profile'), {'services': ['8'], 'region': 'GB'})
+        self.client.post(reverse('profile'), {'services': ['8'], 'region': 'XX'})
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.region, 'GB')
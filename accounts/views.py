@@ -2,7 +2,10 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import StreamingService
+from django.db import transaction
+from .context import invalidate_user_context
+from .models import REGION_CHOICES, StreamingService, User
+from .registry import get_registry
 from .forms import CustomUserCreationForm
 from tmdb.client import TMDbClient
 
@@ -25,23 +28,27 @@ def signup(request):
 
 @login_required
 def profile(request):
+    registry = get_registry()
     if request.method == 'POST':
         # Handle updating streaming services
-        service_ids = request.POST.getlist('services')
-        request.user.streaming_services.clear()
-        for service_id in service_ids:
-            try:
-                service = StreamingService.objects.get(provider_id=service_id)
-                request.user.streaming_services.add(service)
-            except StreamingService.DoesNotExist:
-                pass
+        selected = set()
+        for service_id in request.POST.getlist('services'):
+            provider = registry.get(int(service_id)) if service_id.isdigit() else None
+            if provider:
+                selected.add(provider.pk)
+        _set_streaming_services(request.user, selected)
+        region = request.POST.get('region')
+        if region in dict(REGION_CHOICES) and region != request.user.region:
+            request.user.region = region
+            request.user.save(update_fields=['region'])
+        invalidate_user_context(request)
         messages.success(request, 'Your streaming services have been updated!')
         return redirect('profile')
     
     # Load available streaming services from TMDb if not already in database
-    if StreamingService.objects.count() == 0:
+    if not registry:
         client = TMDbClient()
-        providers_data = client.get_providers_list()
+        providers_data = client.get_providers_list(watch_region=request.user.region)
         if providers_data and 'results' in providers_data:
             # Add popular streaming services
             popular_providers = {
@@ -67,11 +74,25 @@ def profile(request):
                             'logo_path': provider_data.get('logo_path', '')
                         }
                     )
+            registry = get_registry()
     
-    all_services = StreamingService.objects.all()
-    user_services = request.user.streaming_services.all()
+    user_service_ids = set(request.user.streaming_services.values_list('provider_id', flat=True))
     
     return render(request, 'accounts/profile.html', {
-        'all_services': all_services,
-        'user_services': user_services,
+        'all_services': registry,
+        'user_service_ids': user_service_ids,
+        'regions': REGION_CHOICES,
     })
+
+
+def _set_streaming_services(user, service_pks):
+    """Replace a user's streaming services, writing only the difference"""
+    Membership = User.streaming_services.through
+    current = set(Membership.objects.filter(user=user).values_list('streamingservice_id', flat=True))
+    with transaction.atomic():
+        if current - service_pks:
+            Membership.objects.filter(user=user, streamingservice_id__in=current - service_pks).delete()
+        if service_pks - current:
+            Membership.objects.bulk_create([
+                Membership(user=user, streamingservice_id=pk) for pk in service_pks - current
+            ], ignore_conflicts=True)
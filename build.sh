@@ -19,4 +19,7 @@ if not User.objects.filter(username='admin').exists():
 EOF
 
 # Populate streaming services
-python manage.py populate_services || true
\ No newline at end of file
+python manage.py populate_services || true
+
+# Warm the TMDb catalog with trending and most watchlisted titles
+python manage.py warm_tmdb_cache || true
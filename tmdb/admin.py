@@ -1,3 +1,30 @@
 from django.contrib import admin
+from .models import Title, Person, Credit, Availability
 
-# Register your models here.
+
+@admin.register(Title)
+class TitleAdmin(admin.ModelAdmin):
+    list_display = ['title', 'media_type', 'tmdb_id', 'release_date', 'details_updated', 'providers_updated']
+    list_filter = ['media_type']
+    search_fields = ['title', 'tmdb_id']
+
+
+@admin.register(Person)
+class PersonAdmin(admin.ModelAdmin):
+    list_display = ['name', 'tmdb_id', 'known_for_department', 'credits_updated']
+    search_fields = ['name', 'tmdb_id']
+
+
+@admin.register(Credit)
+class CreditAdmin(admin.ModelAdmin):
+    list_display = ['person', 'title', 'credit_type', 'character', 'job']
+    list_filter = ['credit_type']
+    raw_id_fields = ['title', 'person']
+
+
+@admin.register(Availability)
+class AvailabilityAdmin(admin.ModelAdmin):
+    list_display = ['title', 'region', 'provider_name', 'offer_type']
+    list_filter = ['region', 'offer_type']
+    search_fields = ['title__title', 'provider_name']
+    raw_id_fields = ['title']
@@ -0,0 +1,103 @@
+"""
+An on-disk archive of TMDb responses for record/replay runs.
+
+With TMDB_TRANSPORT_MODE = 'record' both TMDb clients save every response
+they get, with its status and latency, to TMDB_TRANSPORT_ARCHIVE; with
+'replay' they answer from the archive without touching the network,
+sleeping for the recorded latency if TMDB_REPLAY_LATENCY is set. Requests
+are keyed by endpoint and params, leaving out the API key, and each is a
+gzipped JSON file so several workers can record at once.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+LIVE = 'live'
+RECORD = 'record'
+REPLAY = 'replay'
+MODES = (LIVE, RECORD, REPLAY)
+
+# A recorded response; payload is None for error responses
+Recording = namedtuple('Recording', 'status payload seconds')
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+class Archive:
+    """The recorded responses in the directory at ``path``"""
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        # Recordings read in replay mode, as JSON text so every replay
+        # returns a fresh payload, parsed like a live response
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def record(self, endpoint, params, status, payload, seconds):
+        """Save a response, replacing any earlier one for the request"""
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(endpoint, params)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with gzip.open(temp_path, 'wt') as f:
+            json.dump({
+                'endpoint': endpoint,
+                'params': _request_params(params),
+                'status': status,
+                'seconds': seconds,
+                'payload': payload,
+            }, f)
+        os.replace(temp_path, path)
+
+    def replay(self, endpoint, params):
+        """Get the Recording for a request, or None if it wasn't recorded"""
+        path = self._file(endpoint, params)
+        text = self._loaded.get(path)
+        if text is None:
+            try:
+                with gzip.open(path, 'rt') as f:
+                    text = f.read()
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                self._loaded[path] = text
+        data = json.loads(text)
+        return Recording(data['status'], data['payload'], data['seconds'])
+
+    def _file(self, endpoint, params):
+        key = json.dumps([endpoint, _request_params(params)])
+        return os.path.join(self.path, f'{hashlib.sha1(key.encode()).hexdigest()}.json.gz')
+
+
+def _request_params(params):
+    """The params identifying a request, as sent, without the API key"""
+    return sorted(
+        (name, str(value)) for name, value in (params or {}).items()
+        if name != 'api_key'
+    )
+
+
+def get_archive():
+    """Get the Archive for the current settings, or None in live mode"""
+    mode = settings.TMDB_TRANSPORT_MODE
+    if mode == LIVE:
+        return None
+    if mode not in MODES:
+        raise ImproperlyConfigured(f"TMDB_TRANSPORT_MODE must be one of {', '.join(MODES)}, not {mode!r}")
+    key = (str(settings.TMDB_TRANSPORT_ARCHIVE), mode)
+    archive = _archives.get(key)
+    if archive is None:
+        with _archives_lock:
+            archive = _archives.setdefault(key, Archive(*key))
+    return archive
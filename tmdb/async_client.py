@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from . import catalog, metrics
+from .archive import get_archive
+from .client import (
+    BaseTMDbClient, _credit_downloads, _in_background, _search_items, _unwrap, cache_key,
+    normalize_query,
+)
+from .ratelimit import get_limiter
+from .transport import RETRY_STATUSES, get_async_session, retry_delay
+
+logger = logging.getLogger(__name__)
+
+# Upstream fetches currently running, per event loop, keyed by cache key
+_in_flight = weakref.WeakKeyDictionary()
+
+# Background refreshes, referenced so they aren't garbage collected early
+_background_tasks = set()
+
+
+async def _single_flight(key, fetch):
+    """Await fetch() once per key, sharing its result with concurrent callers"""
+    flights = _in_flight.setdefault(asyncio.get_running_loop(), {})
+    task = flights.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        flights[key] = task
+        task.add_done_callback(lambda _: flights.pop(key, None))
+    # Shielded so one cancelled caller doesn't cancel the shared fetch
+    return await asyncio.shield(task)
+
+
+def _start_task(coroutine):
+    task = asyncio.ensure_future(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+class AsyncTMDbClient(BaseTMDbClient):
+    """Asyncio version of TMDbClient for the async views.
+
+    The ``a``-prefixed methods mirror their synchronous namesakes. Lookups,
+    cache entries and records come from BaseTMDbClient, so both clients
+    read and warm the same cache and local catalog.
+    """
+
+    async def _arequest(self, endpoint, params=None):
+        """Make a request to the TMDb API, or replay it from the archive,
+        taking a rate limiter token per attempt"""
+        archive = get_archive()
+        if archive and archive.replaying:
+            recording = self._replay(archive, endpoint, params)
+            if recording is None:
+                return None
+            if settings.TMDB_REPLAY_LATENCY:
+                await asyncio.sleep(recording.seconds)
+            return recording.payload
+
+        if not self.api_key:
+            logger.error("TMDb API key not configured")
+            return None
+
+        url = f"{self.base_url}{endpoint}"
+        params = dict(params or {})
+        params['api_key'] = self.api_key
+
+        session = get_async_session()
+        limiter = get_limiter()
+        retries = settings.TMDB_HTTP_RETRIES
+        for attempt in range(retries + 1):
+            if limiter and not await limiter.aacquire(self._request_priority()):
+                logger.error(f"TMDb API request to {endpoint} rejected by the rate limiter")
+                return None
+
+            response = None
+            started = time.perf_counter()
+            try:
+                response = await session.get(url, params=params)
+            except httpx.TransportError as e:
+                error = e
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    try:
+                        response.raise_for_status()
+                        result = response.json()
+                    except (httpx.HTTPStatusError, ValueError) as e:
+                        seconds = time.perf_counter() - started
+                        metrics.record_request(endpoint, seconds, ok=False)
+                        if archive:
+                            archive.record(endpoint, params, response.status_code, None, seconds)
+                        logger.error(f"TMDb API request failed: {e}")
+                        return None
+                    seconds = time.perf_counter() - started
+                    metrics.record_request(endpoint, seconds, ok=True)
+                    if archive:
+                        archive.record(endpoint, params, response.status_code, result, seconds)
+                    return result
+                error = f"{response.status_code} response from {endpoint}"
+
+            seconds = time.perf_counter() - started
+            metrics.record_request(endpoint, seconds, ok=False)
+            if attempt < retries:
+                await asyncio.sleep(retry_delay(attempt, response))
+
+        if archive and response is not None:
+            archive.record(endpoint, params, response.status_code, None, seconds)
+        logger.error(f"TMDb API request failed: {error}")
+        return None
+
+    async def _acached(self, name, cache_key, fetch, empty=None):
+        """Async version of TMDbClient._cached(); fetch is a coroutine function"""
+        entry = await cache.aget(cache_key)
+        if entry is not None:
+            return self._read_entry(name, cache_key, entry, fetch, empty)
+        metrics.record_lookup(name, 'miss')
+        return await _single_flight(
+            cache_key, lambda: self._afetch_and_store(name, cache_key, fetch, empty=empty)
+        )
+
+    async def _afetch_and_store(self, name, cache_key, fetch, force=False, empty=None):
+        if not force:
+            # Another caller may have filled the key while we were waiting
+            entry = await cache.aget(cache_key)
+            if entry is not None:
+                return _unwrap(entry[1], empty)
+
+        result = await fetch()
+        if result is None:
+            return None
+
+        record = await self._astore(name, cache_key, result)
+        return record if record is not None else empty
+
+    async def _astore(self, name, cache_key, result):
+        record, entries = self._cache_entries(name, cache_key, result)
+        for key, value, timeout in entries:
+            await cache.aset(key, value, timeout)
+        return record
+
+    def _refresh_in_background(self, name, cache_key, fetch):
+        """Refresh a stale entry in a background task, at most once at a time"""
+        async def refresh():
+            _in_background.set(True)
+            lock_key = f"{cache_key}_refreshing"
+            if not await cache.aadd(lock_key, True, 60):
+                return
+            try:
+                await _single_flight(
+                    cache_key,
+                    lambda: self._afetch_and_store(name, cache_key, fetch, force=True)
+                )
+            except Exception:
+                logger.exception(f"Background refresh of {cache_key} failed")
+            finally:
+                await cache.adelete(lock_key)
+
+        _start_task(refresh())
+
+    async def _alookup(self, lookup):
+        """Async version of TMDbClient._lookup()"""
+        return await self._acached(
+            lookup.name, lookup.cache_key, lambda: self._afetch(lookup), empty=lookup.empty
+        )
+
+    async def _afetch(self, lookup):
+        """Async version of TMDbClient._fetch()"""
+        if settings.TMDB_CATALOG_ENABLED and lookup.read is not None:
+            try:
+                record = await sync_to_async(lookup.read)()
+            except DatabaseError:
+                logger.exception("TMDb catalog read failed")
+                record = None
+            if record is not None:
+                return record
+
+        result = self._lookup_result(lookup, await self._arequest(lookup.endpoint, lookup.params))
+        if result is None:
+            return None
+        for name, key, value in self._sub_resources(lookup, result):
+            await self._astore(name, key, value)
+        self._write_through(lookup, result)
+        return result
+
+    async def asearch_multi(self, query, page=1):
+        """Search for movies and TV shows"""
+        return await self._alookup(self._search_lookup(query, page))
+
+    async def asearch_rows(self, query, page=1, country='US'):
+        """Async version of TMDbClient.search_rows()"""
+        query = normalize_query(query)
+        return await self._acached(
+            'search_rows',
+            cache_key('search_rows', query, page, country),
+            lambda: self._abuild_search_page(query, page, country)
+        )
+
+    async def _abuild_search_page(self, query, page, country):
+        search_results = await self.asearch_multi(query, page)
+        if search_results is None:
+            return None
+        items = _search_items(search_results)
+        all_providers = await self.aget_watch_providers_many(
+            ((item['media_type'], item['id']) for item in items), country
+        )
+        return self._search_page(items, all_providers, search_results.get('total_pages', 1))
+
+    async def aget_trending(self, media_type='all', time_window='week'):
+        """Get trending content"""
+        return await self._alookup(self._trending_lookup(media_type, time_window))
+
+    async def aget_movie_details(self, movie_id):
+        """Get detailed information about a movie"""
+        return await self._alookup(self._details_lookup('movie', movie_id))
+
+    async def aget_tv_details(self, tv_id):
+        """Get detailed information about a TV show"""
+        return await self._alookup(self._details_lookup('tv', tv_id))
+
+    async def aget_all_watch_providers(self, media_type, media_id):
+        """Get watch providers for a movie or TV show in every region"""
+        return await self._alookup(self._providers_lookup(media_type, media_id))
+
+    async def _afetch_all_watch_providers(self, media_type, media_id, read_catalog=True):
+        return await self._afetch(self._providers_lookup(media_type, media_id, read_catalog))
+
+    async def aget_watch_providers_many(self, items, country='US'):
+        """Get watch providers for many (media_type, media_id) pairs at once"""
+        return [
+            (providers or {}).get(country)
+            for providers in await self.aget_all_watch_providers_many(items)
+        ]
+
+    async def aget_all_watch_providers_many(self, items):
+        """Get watch providers in every region for many (media_type, media_id)
+        pairs at once, looking up every cache miss concurrently"""
+        items = list(items)
+        cached = await cache.aget_many([cache_key('providers', *item) for item in items])
+        found, missing = self._split_cached(items, cached, self._afetch_all_watch_providers)
+        found = dict(found)
+
+        if missing and settings.TMDB_CATALOG_ENABLED:
+            try:
+                stored = await sync_to_async(catalog.read_providers_many)(missing)
+            except DatabaseError:
+                logger.exception("TMDb catalog read failed")
+                stored = {}
+            for item, results in stored.items():
+                metrics.record_lookup('providers', 'miss')
+                found[item] = await self._astore('providers', cache_key('providers', *item), results) or {}
+            missing = [item for item in missing if item not in stored]
+
+        if missing:
+            lookups = await asyncio.gather(*(
+                self._alookup(self._providers_lookup(*item, read_catalog=False))
+                for item in missing
+            ))
+            found.update(zip(missing, lookups))
+
+        return [found.get(item) for item in items]
+
+    async def asearch_person(self, query):
+        """Search for people (actors, directors, etc.)"""
+        return await self._alookup(self._search_person_lookup(query))
+
+    async def aget_person_credits(self, person_id):
+        """Get movie and TV credits for a person"""
+        return await self._alookup(self._person_credits_lookup(person_id))
+
+    async def aestimate_credit_downloads(self, person_ids):
+        """Async version of TMDbClient.estimate_credit_downloads()"""
+        person_ids = list(person_ids)
+        cached = await cache.aget_many([cache_key('person_credits', person_id) for person_id in person_ids])
+        counts = {}
+        if settings.TMDB_CATALOG_ENABLED:
+            try:
+                counts = await sync_to_async(catalog.count_person_credits)(person_ids)
+            except DatabaseError:
+                logger.exception("TMDb catalog read failed")
+        return _credit_downloads(person_ids, cached, counts)
+
+    async def adiscover_movies(self, with_cast=None, with_crew=None, page=1, sort_by='popularity.desc'):
+        """Discover movies with ALL of the given cast and crew members"""
+        return await self._alookup(self._discover_movies_lookup(with_cast, with_crew, page, sort_by))
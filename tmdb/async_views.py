@@ -0,0 +1,134 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render
+
+from accounts.context import aget_user_context
+from accounts.registry import aget_registry
+from .async_client import AsyncTMDbClient
+from .records import project_title
+from .views import (
+    SORT_OPTIONS, _credit_records, _credits_needed, _next_page, _detail_result,
+    _discover_people, _discovered_movies, _found_person, _intersect_credits,
+    _needs_details, _parse_people, _prefer_discover, _search_result,
+    _trending_items,
+)
+
+
+async def search(request):
+    query = request.GET.get('q', '')
+    results = []
+    next_cursor = None
+
+    if query:
+        # The result set is shared by every user; only the overlay is per user
+        client = AsyncTMDbClient()
+        # The rows depend on the user's region
+        user_context, registry = await asyncio.gather(aget_user_context(request), aget_registry())
+        search_page = await client.asearch_rows(query, country=user_context.region)
+        if search_page:
+            results = [_search_result(row, user_context, registry) for row in search_page.rows]
+            next_cursor = _next_page(1, search_page.total_pages)
+
+    return await sync_to_async(render)(request, 'tmdb/search.html', {
+        'query': query,
+        'results': results,
+        'next_cursor': next_cursor,
+    })
+
+
+async def home(request):
+    client = AsyncTMDbClient()
+    trending = await client.aget_trending('all', 'week')
+
+    return await sync_to_async(render)(request, 'tmdb/home.html', {
+        'trending_items': _trending_items(client, trending),
+    })
+
+
+async def advanced_search(request):
+    """Search for movies/TV shows by actors or directors"""
+    people_query = request.GET.get('people', '')
+    search_type = request.GET.get('type', 'both')  # movie, tv, or both
+    sort = request.GET.get('sort', 'rating')
+    if sort not in SORT_OPTIONS:
+        sort = 'rating'
+    sort_by, sort_field = SORT_OPTIONS[sort]
+    results = []
+    people_found = []
+
+    if people_query:
+        client = AsyncTMDbClient()
+
+        user_context, registry, *person_results = await asyncio.gather(
+            aget_user_context(request),
+            aget_registry(),
+            *(client.asearch_person(name) for name in _parse_people(people_query)),
+        )
+        for person_result in person_results:
+            person = _found_person(client, person_result)
+            if person:
+                people_found.append(person)
+        person_ids = [person['id'] for person in people_found]
+
+        # Get movies/TV shows with ALL specified people
+        if person_ids:
+            credit_downloads = await client.aestimate_credit_downloads(person_ids)
+            discover = _prefer_discover(search_type, credit_downloads)
+            needed = _credits_needed(search_type, discover, people_found)
+            fetch_credits = asyncio.gather(*(client.aget_person_credits(person['id']) for person in needed))
+            if discover:
+                with_cast, with_crew = _discover_people(people_found)
+                discovered, credits = await asyncio.gather(
+                    client.adiscover_movies(with_cast, with_crew, sort_by=sort_by), fetch_credits
+                )
+            else:
+                discovered, credits = None, await fetch_credits
+            all_credits = {person['id']: person_credits for person, person_credits in zip(needed, credits)}
+            records = {}
+            titles = []
+
+            if discover:
+                # TMDb intersects and sorts; one page is the 20 movies we show
+                for movie in _discovered_movies(discovered, people_found, all_credits):
+                    records[('movie', movie['id'])] = project_title('movie', movie)
+                    titles.append(('movie', movie['id']))
+
+            incomplete = []
+            if search_type != 'movie' or not discover:
+                all_movies, all_tv_shows = _intersect_credits(people_found, all_credits)
+                credit_titles = []
+                if search_type in ['movie', 'both'] and not discover:
+                    credit_titles += [('movie', movie_id) for movie_id in list(all_movies)[:20]]
+                if search_type in ['tv', 'both']:
+                    credit_titles += [('tv', tv_id) for tv_id in list(all_tv_shows)[:20]]
+
+                # The credit records already carry what the rows show; only
+                # fetch details for titles whose records are incomplete
+                records.update(_credit_records(all_credits.values()))
+                incomplete = [title for title in credit_titles if _needs_details(records.get(title))]
+                titles += credit_titles
+
+            all_details, all_providers = await asyncio.gather(
+                asyncio.gather(*(
+                    client.aget_movie_details(media_id) if media_type == 'movie'
+                    else client.aget_tv_details(media_id)
+                    for media_type, media_id in incomplete
+                )),
+                client.aget_watch_providers_many(titles, user_context.region),
+            )
+            records.update(zip(incomplete, all_details))
+
+            for title, providers in zip(titles, all_providers):
+                if records.get(title):
+                    results.append(_detail_result(client, records[title], providers, user_context, registry))
+
+            results.sort(key=lambda x: x.get(sort_field) or 0, reverse=True)
+
+    return await sync_to_async(render)(request, 'tmdb/advanced_search.html', {
+        'people_query': people_query,
+        'search_type': search_type,
+        'sort': sort,
+        'results': results,
+        'people_found': people_found,
+    })
@@ -0,0 +1,143 @@
+"""
+Load benchmark for the views, driven against FakeTMDbServer.
+
+Each view is requested a set number of times at each concurrency level by
+signed-in clients, starting from a cold cache and an empty catalog. Latency percentiles,
+throughput and the TMDb calls the requests cost are reported per view and
+level (see manage.py benchmark_views).
+"""
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from accounts.models import StreamingService, User
+from watchlist.models import WatchlistItem
+from . import catalog
+from .fake_server import PROVIDERS
+from .models import Person, Title
+
+VIEWS = ('home', 'search', 'advanced_search', 'watchlist', 'profile')
+
+# Query strings cycled through by the search views, so later requests mix
+# cache hits with misses
+SEARCH_QUERIES = ('matrix', 'alien', 'heat', 'up', 'jaws', 'fargo', 'brazil', 'vertigo', 'rocky', 'psycho')
+PEOPLE_QUERIES = ('ann and bob', 'cy and dee', 'eve and fay', 'gus and hal', 'ivy and jo')
+
+Result = namedtuple(
+    'Result', 'view concurrency requests errors p50 p95 p99 throughput tmdb_calls tmdb_errors'
+)
+
+
+def seed_user(username='benchmark', watchlist_size=100):
+    """Create a user with three streaming services and a watchlist"""
+    StreamingService.objects.bulk_create([
+        StreamingService(provider_id=provider_id, name=name, logo_path=logo_path)
+        for provider_id, name, logo_path in PROVIDERS
+    ], ignore_conflicts=True)
+    user = User.objects.create_user(username, password='benchmark')
+    user.streaming_services.set(StreamingService.objects.filter(
+        provider_id__in=[provider_id for provider_id, _, _ in PROVIDERS[:3]]
+    ))
+    WatchlistItem.objects.bulk_create([
+        WatchlistItem(
+            user=user, tmdb_id=tmdb_id, media_type='movie' if tmdb_id % 2 else 'tv',
+            title=f'Title {tmdb_id}', status=WatchlistItem.STATUS_CHOICES[tmdb_id % 3][0],
+        )
+        for tmdb_id in range(1, watchlist_size + 1)
+    ])
+    return user
+
+
+def view_requests(view, count):
+    """Get ``count`` (path, params) requests for a view"""
+    path = reverse(view)
+    if view == 'search':
+        return [(path, {'q': SEARCH_QUERIES[i % len(SEARCH_QUERIES)]}) for i in range(count)]
+    if view == 'advanced_search':
+        return [(path, {'people': PEOPLE_QUERIES[i % len(PEOPLE_QUERIES)]}) for i in range(count)]
+    return [(path, None)] * count
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def measure(server, user, view, concurrency, count):
+    """Make ``count`` requests to a view from ``concurrency`` clients on a
+    cold cache and catalog, returning a Result with latencies in milliseconds"""
+    # Writes queued by the last run would refill the catalog
+    catalog.flush_writes()
+    Title.objects.all().delete()
+    Person.objects.all().delete()
+    cache.clear()
+    server.reset()
+    pending = queue.Queue()
+    for request in view_requests(view, count):
+        pending.put(request)
+    latencies = []
+    errors = []
+
+    def worker(client):
+        try:
+            while True:
+                try:
+                    path, params = pending.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                try:
+                    response = client.get(path, params)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    failed = response.status_code >= 400
+                except Exception:
+                    failed = True
+                latencies.append(time.perf_counter() - started)
+                if failed:
+                    errors.append(path)
+        finally:
+            connections.close_all()
+
+    # Signed in up front so logins aren't timed
+    clients = [Client() for _ in range(concurrency)]
+    for client in clients:
+        client.force_login(user)
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(round(latency * 1000, 2) for latency in latencies)
+    return Result(
+        view=view,
+        concurrency=concurrency,
+        requests=len(latencies),
+        errors=len(errors),
+        p50=percentile(latencies, 0.5),
+        p95=percentile(latencies, 0.95),
+        p99=percentile(latencies, 0.99),
+        throughput=round(len(latencies) / elapsed, 2) if elapsed else None,
+        tmdb_calls=server.total_calls,
+        tmdb_errors=server.errors,
+    )
+
+
+def run(server, user, views=VIEWS, concurrency_levels=(1, 4, 16), count=100):
+    """Measure every view at every concurrency level"""
+    return [
+        measure(server, user, view, concurrency, count)
+        for view in views
+        for concurrency in concurrency_levels
+    ]
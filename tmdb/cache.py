@@ -0,0 +1,85 @@
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Pickled bytes held per cache, and by key, keyed by cache name like
+# LocMemCache's own storage
+_sizes = {}
+_usage = {}
+
+
+class BoundedLocMemCache(LocMemCache):
+    """A LocMemCache capped at OPTIONS['MAX_BYTES'] of pickled values.
+
+    Least recently used entries are evicted first to make room, on top of
+    LocMemCache's MAX_ENTRIES cull. Values larger than the cap aren't
+    cached at all.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        self._sizes = _sizes.setdefault(name, {})
+        self._usage = _usage.setdefault(name, [0])
+
+    @property
+    def used_bytes(self):
+        return self._usage[0]
+
+    def _set(self, key, value, timeout=None):
+        self._forget(key)
+        if len(value) > self._max_bytes:
+            self._cache.pop(key, None)
+            self._expire_info.pop(key, None)
+            return
+        while self._cache and self._usage[0] + len(value) > self._max_bytes:
+            self._evict()
+        super()._set(key, value, timeout)
+        self._sizes[key] = len(value)
+        self._usage[0] += len(value)
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version)
+        key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if key in self._cache:
+                self._forget(key)
+                self._sizes[key] = len(self._cache[key])
+                self._usage[0] += self._sizes[key]
+        return value
+
+    def _evict(self):
+        """Drop the least recently used entry"""
+        key, _ = self._cache.popitem()
+        self._expire_info.pop(key, None)
+        self._forget(key)
+
+    def _forget(self, key):
+        self._usage[0] -= self._sizes.pop(key, 0)
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._sizes.clear()
+            self._usage[0] = 0
+        else:
+            for _ in range(len(self._cache) // self._cull_frequency):
+                self._evict()
+
+    def _delete(self, key):
+        self._forget(key)
+        return super()._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._sizes.clear()
+            self._usage[0] = 0
+
+
+def is_shared(cache):
+    """Whether a cache is shared between processes, so entries stored by a
+    management command reach the web workers"""
+    return not isinstance(cache, (LocMemCache, DummyCache))
@@ -0,0 +1,392 @@
+"""
+Local TMDb catalog.
+
+Titles, people, credits and per-region availability are written through by
+the TMDb clients whenever they fetch them from TMDb, and read back before
+going upstream. Each record carries the time it was last written so stale
+rows are ignored and refetched.
+
+Writes are queued with queue_write() and run one at a time on a writer
+thread, off the request path; a write finding its rows already fresh
+does nothing.
+"""
+import logging
+import os
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Title, Person, Credit, Availability
+
+
+logger = logging.getLogger(__name__)
+
+OFFER_TYPES = [offer_type for offer_type, _ in Availability.OFFER_TYPES]
+
+# Queued writes, the keys of those not yet done, and the thread running
+# them, rebuilt after a fork
+_writes = queue.Queue()
+_pending = set()
+_pending_lock = threading.Lock()
+_writer = None
+_writer_pid = None
+
+
+def queue_write(key, write, *args):
+    """Queue write(*args) to run on the writer thread, unless a write for
+    the same key is already waiting"""
+    global _writes, _writer, _writer_pid
+    with _pending_lock:
+        if _writer_pid != os.getpid():
+            _writes = queue.Queue()
+            _pending.clear()
+            _writer = None
+            _writer_pid = os.getpid()
+        if key in _pending:
+            return
+        _pending.add(key)
+        if _writer is None:
+            _writer = threading.Thread(target=_run_writes, args=(_writes,), daemon=True)
+            _writer.start()
+    _writes.put((key, write, args))
+
+
+def flush_writes():
+    """Wait for every queued write to finish"""
+    _writes.join()
+
+
+def _run_writes(writes):
+    while True:
+        key, write, args = writes.get()
+        try:
+            write(*args)
+        except DatabaseError:
+            logger.exception("TMDb catalog write failed")
+        except Exception:
+            logger.exception(f"TMDb catalog write for {key} failed")
+        finally:
+            with _pending_lock:
+                _pending.discard(key)
+            if writes.empty():
+                connections.close_all()
+            writes.task_done()
+
+
+def _cutoff(kind):
+    return timezone.now() - timedelta(seconds=settings.TMDB_CATALOG_MAX_AGE[kind])
+
+
+def _is_fresh(updated, kind):
+    return updated is not None and updated >= _cutoff(kind)
+
+
+def _title_fields(data):
+    """Get catalog fields from a TMDb detail, search or credit record"""
+    return {
+        'title': (data.get('title') or data.get('name') or '')[:300],
+        'poster_path': data.get('poster_path') or '',
+        'release_date': (data.get('release_date') or data.get('first_air_date') or '')[:20],
+        'overview': data.get('overview') or '',
+        'vote_average': data.get('vote_average') or 0,
+        'popularity': data.get('popularity') or 0,
+    }
+
+
+def title_payload(title):
+    """Rebuild the TMDb-shaped fields of a catalog title"""
+    if title.media_type == 'movie':
+        payload = {'title': title.title, 'release_date': title.release_date}
+    else:
+        payload = {'name': title.title, 'first_air_date': title.release_date}
+    payload.update({
+        'id': title.tmdb_id,
+        'media_type': title.media_type,
+        'poster_path': title.poster_path or None,
+        'overview': title.overview,
+        'vote_average': title.vote_average,
+        'popularity': title.popularity,
+    })
+    return payload
+
+
+def _get_title(media_type, tmdb_id):
+    title, _ = Title.objects.get_or_create(
+        tmdb_id=tmdb_id,
+        media_type=media_type,
+        defaults={'title': ''}
+    )
+    return title
+
+
+def _ensure_titles(records):
+    """Get or create the titles for (media_type, record) pairs in bulk"""
+    wanted = {}
+    for media_type, record in records:
+        wanted.setdefault((media_type, record['id']), record)
+
+    def existing():
+        titles = {}
+        for media_type in {media_type for media_type, _ in wanted}:
+            ids = [tmdb_id for (other, tmdb_id) in wanted if other == media_type]
+            for title in Title.objects.filter(media_type=media_type, tmdb_id__in=ids):
+                titles[(media_type, title.tmdb_id)] = title
+        return titles
+
+    titles = existing()
+    missing = [key for key in wanted if key not in titles]
+    if missing:
+        Title.objects.bulk_create(
+            [
+                Title(tmdb_id=tmdb_id, media_type=media_type, **_title_fields(wanted[(media_type, tmdb_id)]))
+                for media_type, tmdb_id in missing
+            ],
+            ignore_conflicts=True
+        )
+        titles = existing()
+    return titles
+
+
+def _ensure_people(records):
+    """Get or create people from TMDb person records in bulk, keyed by TMDb ID"""
+    people = Person.objects.in_bulk(list(records), field_name='tmdb_id')
+
+    missing = [
+        Person(
+            tmdb_id=tmdb_id,
+            name=(record.get('name') or '')[:200],
+            profile_path=record.get('profile_path') or '',
+            known_for_department=(record.get('known_for_department') or '')[:50],
+        )
+        for tmdb_id, record in records.items()
+        if tmdb_id not in people
+    ]
+    if missing:
+        Person.objects.bulk_create(missing, ignore_conflicts=True)
+        people = Person.objects.in_bulk(list(records), field_name='tmdb_id')
+    return people
+
+
+def _credit(title, person, credit_type, record):
+    return Credit(
+        title=title,
+        person=person,
+        credit_type=credit_type,
+        character=(record.get('character') or '')[:500],
+        job=(record.get('job') or '')[:100],
+        order=record.get('order'),
+    )
+
+
+def read_title(media_type, tmdb_id):
+    """Get the basic detail fields for a title, or None if missing or stale"""
+    title = Title.objects.filter(media_type=media_type, tmdb_id=tmdb_id).first()
+    if title is None or not _is_fresh(title.details_updated, 'details'):
+        return None
+    return title_payload(title)
+
+
+@transaction.atomic
+def write_title(media_type, details):
+    """Store a TMDb detail response, including any appended credits and providers"""
+    if not details or 'id' not in details:
+        return
+    title = Title.objects.filter(tmdb_id=details['id'], media_type=media_type).first()
+    if title is None or not _is_fresh(title.details_updated, 'details'):
+        title, _ = Title.objects.update_or_create(
+            tmdb_id=details['id'],
+            media_type=media_type,
+            defaults={**_title_fields(details), 'details_updated': timezone.now()}
+        )
+    if details.get('credits') and not _is_fresh(title.credits_updated, 'credits'):
+        _write_title_credits(title, details['credits'])
+    providers = details.get('watch/providers', {}).get('results')
+    if providers is not None and not _is_fresh(title.providers_updated, 'providers'):
+        _write_availability(title, providers)
+
+
+def read_credits(media_type, tmdb_id):
+    """Get the cast and crew of a title, or None if missing or stale"""
+    title = Title.objects.filter(media_type=media_type, tmdb_id=tmdb_id).first()
+    if title is None or not _is_fresh(title.credits_updated, 'credits'):
+        return None
+
+    credits = {'id': tmdb_id, 'cast': [], 'crew': []}
+    for credit in title.credits.select_related('person'):
+        record = {
+            'id': credit.person.tmdb_id,
+            'name': credit.person.name,
+            'profile_path': credit.person.profile_path or None,
+            'known_for_department': credit.person.known_for_department,
+        }
+        if credit.credit_type == 'cast':
+            record.update({'character': credit.character, 'order': credit.order})
+        else:
+            record['job'] = credit.job
+        credits[credit.credit_type].append(record)
+    return credits
+
+
+@transaction.atomic
+def write_credits(media_type, tmdb_id, credits):
+    """Store the cast and crew of a title"""
+    title = _get_title(media_type, tmdb_id)
+    if not _is_fresh(title.credits_updated, 'credits'):
+        _write_title_credits(title, credits)
+
+
+def _write_title_credits(title, credits):
+    records = [
+        (credit_type, record)
+        for credit_type in ('cast', 'crew')
+        for record in credits.get(credit_type, [])
+        if 'id' in record
+    ]
+    people = _ensure_people({record['id']: record for _, record in records})
+
+    # Only replace credits for people listed here; TV credits cover the
+    # latest season, so older credits written from a person's filmography
+    # must survive
+    Credit.objects.filter(title=title, person__in=people.values()).delete()
+    Credit.objects.bulk_create([
+        _credit(title, people[record['id']], credit_type, record)
+        for credit_type, record in records
+    ])
+    title.credits_updated = timezone.now()
+    title.save(update_fields=['credits_updated'])
+
+
+def read_person_credits(person_id):
+    """Get a person's combined credits, or None if missing or stale"""
+    person = Person.objects.filter(tmdb_id=person_id).first()
+    if person is None or not _is_fresh(person.credits_updated, 'credits'):
+        return None
+
+    credits = {'id': person_id, 'cast': [], 'crew': []}
+    for credit in person.credits.select_related('title'):
+        record = title_payload(credit.title)
+        if credit.credit_type == 'cast':
+            record.update({'character': credit.character, 'order': credit.order})
+        else:
+            record['job'] = credit.job
+        credits[credit.credit_type].append(record)
+    return credits
+
+
+def count_person_credits(person_ids):
+    """Get (credit count, fresh) for people whose filmography is stored, keyed by TMDb ID"""
+    people = (
+        Person.objects.filter(tmdb_id__in=person_ids, credits_updated__isnull=False)
+        .annotate(credit_count=Count('credits'))
+    )
+    return {
+        person.tmdb_id: (person.credit_count, _is_fresh(person.credits_updated, 'credits'))
+        for person in people
+    }
+
+
+@transaction.atomic
+def write_person_credits(person_id, credits):
+    """Store a person's combined credits"""
+    person, _ = Person.objects.get_or_create(tmdb_id=person_id)
+    if _is_fresh(person.credits_updated, 'credits'):
+        return
+    records = [
+        (credit_type, record)
+        for credit_type in ('cast', 'crew')
+        for record in credits.get(credit_type, [])
+        if 'id' in record and record.get('media_type') in ('movie', 'tv')
+    ]
+    titles = _ensure_titles((record['media_type'], record) for _, record in records)
+
+    Credit.objects.filter(person=person).delete()
+    Credit.objects.bulk_create([
+        _credit(titles[(record['media_type'], record['id'])], person, credit_type, record)
+        for credit_type, record in records
+    ])
+    person.credits_updated = timezone.now()
+    person.save(update_fields=['credits_updated'])
+
+
+def _availability_map(rows):
+    """Rebuild a TMDb watch/providers ``results`` map from availability rows"""
+    results = {}
+    for row in rows:
+        region = results.setdefault(row.region, {})
+        if row.link:
+            region['link'] = row.link
+        region.setdefault(row.offer_type, []).append({
+            'provider_id': row.provider_id,
+            'provider_name': row.provider_name,
+            'logo_path': row.logo_path or None,
+            'display_priority': row.display_priority,
+        })
+    return results
+
+
+def read_providers(media_type, tmdb_id):
+    """Get the watch providers of a title in every region, or None if missing or stale"""
+    title = Title.objects.filter(media_type=media_type, tmdb_id=tmdb_id).first()
+    if title is None or not _is_fresh(title.providers_updated, 'providers'):
+        return None
+    return _availability_map(title.availability.all())
+
+
+def read_providers_many(items):
+    """Get the watch providers of many (media_type, tmdb_id) pairs at once.
+
+    Returns a dict containing only the pairs with fresh catalog data.
+    """
+    if not items:
+        return {}
+
+    by_type = {}
+    for media_type, tmdb_id in items:
+        by_type.setdefault(media_type, []).append(tmdb_id)
+    match = Q()
+    for media_type, ids in by_type.items():
+        match |= Q(media_type=media_type, tmdb_id__in=ids)
+
+    titles = (
+        Title.objects.filter(match, providers_updated__gte=_cutoff('providers'))
+        .prefetch_related('availability')
+    )
+    return {
+        (title.media_type, title.tmdb_id): _availability_map(title.availability.all())
+        for title in titles
+    }
+
+
+@transaction.atomic
+def write_providers(media_type, tmdb_id, results):
+    """Store the watch providers of a title in every region"""
+    title = _get_title(media_type, tmdb_id)
+    if not _is_fresh(title.providers_updated, 'providers'):
+        _write_availability(title, results)
+
+
+def _write_availability(title, results):
+    rows = []
+    for region, data in results.items():
+        for offer_type in OFFER_TYPES:
+            for provider in data.get(offer_type, []):
+                rows.append(Availability(
+                    title=title,
+                    region=region[:2],
+                    offer_type=offer_type,
+                    provider_id=provider['provider_id'],
+                    provider_name=(provider.get('provider_name') or '')[:100],
+                    logo_path=provider.get('logo_path') or '',
+                    display_priority=provider.get('display_priority') or 0,
+                    link=(data.get('link') or '')[:500],
+                ))
+
+    title.availability.all().delete()
+    Availability.objects.bulk_create(rows)
+    title.providers_updated = timezone.now()
+    title.save(update_fields=['providers_updated'])
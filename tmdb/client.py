@@ -1,197 +1,824 @@
+import contextvars
+import functools
 import requests
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from django.conf import settings
 from django.core.cache import cache
+from django.db import DatabaseError, connections
+from . import catalog, metrics
+from .archive import get_archive
+from .ratelimit import BACKGROUND, INTERACTIVE, get_limiter
+from .records import pack, unpack
+from .transport import RETRY_STATUSES, get_session, get_timeout, retry_delay
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Cached in place of empty answers so "TMDb has no data" can be told apart
+# from a cache miss
+NO_DATA = '__tmdb_no_data__'
 
-class TMDbClient:
-    def __init__(self):
+# (soft TTL, hard TTL) in seconds per lookup, overridable per method through
+# settings.TMDB_CACHE_TTLS. Past the soft TTL the cached value is still
+# served while one background refresh runs; past the hard TTL it is gone.
+DEFAULT_CACHE_TTLS = {
+    'search': (3600, 3600),  # 1 hour
+    'search_rows': (900, 3600),
+    'movie': (86400, 86400),  # 24 hours
+    'tv': (86400, 86400),
+    'providers': (86400, 86400),
+    'credits': (86400, 86400),
+    'recommendations': (86400, 86400),
+    'trending': (3600, 3600),
+    'providers_list': (604800, 604800),  # 1 week
+    'search_person': (3600, 3600),
+    'person_credits': (86400, 86400),
+    'discover': (3600, 3600),
+}
+
+# A user-independent search result, with the watch providers of one region
+SearchRow = namedtuple(
+    'SearchRow', 'id media_type title poster_path release_date overview providers'
+)
+
+# One page of SearchRows and the number of pages TMDb has for the query
+SearchPage = namedtuple('SearchPage', 'rows total_pages')
+
+# A cached TMDb lookup: its name (see DEFAULT_CACHE_TTLS), cache key and
+# request, the catalog functions reading the result before going upstream
+# and writing it after, a function getting the result out of the response,
+# and the value returned when TMDb has no data
+Lookup = namedtuple(
+    'Lookup', 'name cache_key endpoint params read write extract empty',
+    defaults=(None, None, None, None, None)
+)
+
+# Changed whenever trending data is stored; keys the anonymous page cache
+TRENDING_VERSION_KEY = 'tmdb_trending_version'
+
+# Credit records assumed for a person whose filmography we've never fetched
+ESTIMATED_CREDIT_COUNT = 100
+
+# True while refreshing or prefetching, so the requests made take
+# BACKGROUND tokens whatever the priority of the client that started it
+_in_background = contextvars.ContextVar('tmdb_in_background', default=False)
+
+# Upstream fetches currently running in this process, keyed by cache key
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _claim_flight(key):
+    """Get (future, leader) for a fetch of key: a new future if no fetch is
+    running, which the leader must settle with _end_flight()"""
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future, False
+        future = _in_flight[key] = Future()
+        return future, True
+
+
+def _end_flight(key, future, result=None, error=None):
+    """Settle a claimed fetch, sharing its result or error with its callers"""
+    with _in_flight_lock:
+        _in_flight.pop(key, None)
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _single_flight(key, fetch):
+    """Run fetch() once per key, sharing its result with concurrent callers"""
+    future, leader = _claim_flight(key)
+    if not leader:
+        return future.result()
+
+    try:
+        result = fetch()
+    except BaseException as e:
+        _end_flight(key, future, error=e)
+        raise
+    _end_flight(key, future, result)
+    return result
+
+
+def _unwrap(value, empty=None):
+    return empty if value == NO_DATA else unpack(value)
+
+
+def _closing_connections(func):
+    """Wrap func so DB connections it opens in a worker thread are closed"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return wrapper
+
+
+def _credit_downloads(person_ids, cached_keys, counts):
+    """Estimate the credit records to download for people whose credits
+    aren't cached; counts maps person IDs to catalog (count, fresh) pairs"""
+    total = 0
+    for person_id in person_ids:
+        if cache_key('person_credits', person_id) in cached_keys:
+            continue
+        count, fresh = counts.get(person_id, (ESTIMATED_CREDIT_COUNT, False))
+        if not fresh:
+            total += count
+    return total
+
+
+def _search_items(search_results):
+    """Get the movie and TV items of a /search/multi response"""
+    return [
+        item for item in search_results.get('results', [])
+        if item.get('media_type') in ['movie', 'tv']
+    ]
+
+
+def normalize_query(query):
+    """Fold case and whitespace so equivalent searches share cache entries"""
+    return ' '.join(query.lower().split())
+
+
+def get_cache_ttls(name):
+    """Get the (soft, hard) cache TTLs for a lookup"""
+    ttls = getattr(settings, 'TMDB_CACHE_TTLS', {})
+    return ttls.get(name, DEFAULT_CACHE_TTLS[name])
+
+
+def cache_key(prefix, *parts):
+    """Get the cache key of a lookup, e.g. tmdb_providers_movie_550"""
+    return '_'.join(['tmdb', prefix, *map(str, parts)])
+
+
+def _id_list(ids):
+    return ','.join(map(str, ids)) if isinstance(ids, list) else str(ids)
+
+
+def _provider_results(response):
+    return response.get('results', {})
+
+
+class BaseTMDbClient(ABC):
+    """The parts of the TMDb clients that don't do I/O.
+
+    Every lookup is described here as a Lookup, and cache entries and
+    search rows are read and built here, so TMDbClient and AsyncTMDbClient
+    share cache keys, entry format and records. The subclasses make the
+    requests and the cache and catalog reads and writes.
+
+    ``priority`` is the rate limiter class of their requests: INTERACTIVE
+    for the views, BACKGROUND for batch jobs (see tmdb/ratelimit.py).
+    """
+
+    def __init__(self, priority=INTERACTIVE):
+        self.priority = priority
         self.api_key = settings.TMDB_API_KEY
         self.base_url = settings.TMDB_API_BASE_URL
         self.image_base_url = "https://image.tmdb.org/t/p/"
-        
+        self.max_workers = settings.TMDB_MAX_WORKERS
+
+    def _search_lookup(self, query, page):
+        return Lookup('search', cache_key('search', query, page), '/search/multi', {
+            'query': query,
+            'page': page
+        })
+
+    def _details_lookup(self, media_type, media_id):
+        return Lookup(
+            media_type,
+            cache_key(media_type, media_id),
+            f'/{media_type}/{media_id}',
+            {'append_to_response': 'watch/providers,credits,recommendations'},
+            read=lambda: catalog.read_title(media_type, media_id),
+            write=lambda details: catalog.write_title(media_type, details),
+        )
+
+    def _credits_lookup(self, media_type, media_id):
+        return Lookup(
+            'credits',
+            cache_key('credits', media_type, media_id),
+            f'/{media_type}/{media_id}/credits',
+            read=lambda: catalog.read_credits(media_type, media_id),
+            write=lambda credits: catalog.write_credits(media_type, media_id, credits),
+        )
+
+    def _recommendations_lookup(self, media_type, media_id):
+        return Lookup(
+            'recommendations',
+            cache_key('recommendations', media_type, media_id),
+            f'/{media_type}/{media_id}/recommendations'
+        )
+
+    def _providers_lookup(self, media_type, media_id, read_catalog=True):
+        return Lookup(
+            'providers',
+            cache_key('providers', media_type, media_id),
+            f'/{media_type}/{media_id}/watch/providers',
+            read=(lambda: catalog.read_providers(media_type, media_id)) if read_catalog else None,
+            write=lambda results: catalog.write_providers(media_type, media_id, results),
+            extract=_provider_results,
+            empty={},
+        )
+
+    def _trending_lookup(self, media_type, time_window):
+        return Lookup(
+            'trending',
+            cache_key('trending', media_type, time_window),
+            f'/trending/{media_type}/{time_window}'
+        )
+
+    def _providers_list_lookup(self, watch_region):
+        return Lookup('providers_list', cache_key('providers_list', watch_region), '/watch/providers/movie', {
+            'watch_region': watch_region
+        })
+
+    def _search_person_lookup(self, query):
+        return Lookup('search_person', cache_key('search_person', query), '/search/person', {
+            'query': query
+        })
+
+    def _person_credits_lookup(self, person_id):
+        return Lookup(
+            'person_credits',
+            cache_key('person_credits', person_id),
+            f'/person/{person_id}/combined_credits',
+            read=lambda: catalog.read_person_credits(person_id),
+            write=lambda credits: catalog.write_person_credits(person_id, credits),
+        )
+
+    def _discover_movies_lookup(self, with_cast, with_crew, page, sort_by):
+        """Comma-joined IDs match movies with ALL of the given people"""
+        params = {'page': page, 'sort_by': sort_by}
+        if with_cast:
+            params['with_cast'] = _id_list(with_cast)
+        if with_crew:
+            params['with_crew'] = _id_list(with_crew)
+        return Lookup(
+            'discover',
+            cache_key('discover_movies', with_cast, with_crew, sort_by, page),
+            '/discover/movie',
+            params
+        )
+
+    def _discover_tv_lookup(self, with_cast, with_crew, page, sort_by):
+        params = {'page': page, 'sort_by': sort_by}
+        if with_cast:
+            # TMDb uses 'with_people' for TV shows instead of 'with_cast'
+            params['with_people'] = _id_list(with_cast)
+        return Lookup(
+            'discover',
+            cache_key('discover_tv', with_cast, with_crew, sort_by, page),
+            '/discover/tv',
+            params
+        )
+
+    def _request_priority(self):
+        """Get the rate limiter priority of a request made now"""
+        return BACKGROUND if _in_background.get() else self.priority
+
+    def _lookup_result(self, lookup, response):
+        """Get the result of a lookup from its TMDb response"""
+        if response is None or lookup.extract is None:
+            return response
+        return lookup.extract(response)
+
+    def _sub_resources(self, lookup, result):
+        """Get the (name, cache key, value) of the provider, credits and
+        recommendation lookups answered by a detail response, so their
+        caches can be seeded from it"""
+        if lookup.name not in ('movie', 'tv') or not result or 'id' not in result:
+            return []
+        media_type, media_id = lookup.name, result['id']
+        sub_resources = (
+            ('providers', cache_key('providers', media_type, media_id),
+             result.get('watch/providers', {}).get('results')),
+            ('credits', cache_key('credits', media_type, media_id),
+             result.get('credits')),
+            ('recommendations', cache_key('recommendations', media_type, media_id),
+             result.get('recommendations')),
+        )
+        return [
+            (name, key, value) for name, key, value in sub_resources
+            if value is not None
+        ]
+
+    def _write_through(self, lookup, result):
+        """Queue the write of a result fetched from TMDb to the catalog"""
+        if settings.TMDB_CATALOG_ENABLED and lookup.write is not None:
+            catalog.queue_write(lookup.cache_key, lookup.write, result)
+
+    def _read_entry(self, name, cache_key, entry, fetch, empty=None):
+        """Get the value of a cache entry, refreshing it in the background
+        with fetch() if it is stale"""
+        fresh_until, value = entry
+        if time.time() >= fresh_until:
+            metrics.record_lookup(name, 'stale')
+            self._refresh_in_background(name, cache_key, fetch)
+        else:
+            metrics.record_lookup(name, 'hit')
+        return _unwrap(value, empty)
+
+    @abstractmethod
+    def _refresh_in_background(self, name, cache_key, fetch):
+        """Refetch a stale entry with fetch() without blocking the caller"""
+
+    def _cache_entries(self, name, cache_key, result):
+        """Get the record for a result fetched from TMDb (see
+        records.pack()), or None if it is empty, and the (key, value,
+        timeout) entries to cache for it.
+
+        Empty answers are cached as NO_DATA for TMDB_NEGATIVE_CACHE_TTL
+        seconds. Caching trending data changes TRENDING_VERSION_KEY.
+        """
+        now = time.time()
+        if not result:
+            timeout = settings.TMDB_NEGATIVE_CACHE_TTL
+            entries = [(cache_key, (now + timeout, NO_DATA), timeout)]
+            result = None
+        else:
+            result, value = pack(name, result)
+            soft_ttl, hard_ttl = get_cache_ttls(name)
+            entries = [(cache_key, (now + soft_ttl, value), hard_ttl)]
+
+        if name == 'trending':
+            entries.append((TRENDING_VERSION_KEY, time.time_ns(), None))
+        return result, entries
+
+    def _split_cached(self, items, cached, fetch_providers):
+        """Split (media_type, media_id) pairs into ((item, providers), ...)
+        for those whose providers are in ``cached``, a get_many() of their
+        cache keys, and the distinct pairs that are missing"""
+        found = []
+        missing = []
+        for item in items:
+            key = cache_key('providers', *item)
+            if key in cached:
+                found.append((item, self._read_entry(
+                    'providers', key, cached[key],
+                    lambda item=item: fetch_providers(*item),
+                    empty={}
+                )))
+            elif item not in missing:
+                missing.append(item)
+        return found, missing
+
+    def _replay(self, archive, endpoint, params):
+        """Get the recorded response to a request, or None if there is none"""
+        recording = archive.replay(endpoint, params)
+        if recording is None:
+            logger.error(f"No recorded TMDb response for {endpoint}")
+            return None
+        metrics.record_request(endpoint, recording.seconds, ok=recording.payload is not None)
+        if recording.payload is None:
+            logger.error(f"TMDb API request failed: recorded {recording.status} response from {endpoint}")
+        return recording
+
+    def _search_row(self, item, providers):
+        return SearchRow(
+            id=item['id'],
+            media_type=item['media_type'],
+            title=item.get('title') or item.get('name'),
+            poster_path=self.get_image_url(item.get('poster_path')),
+            release_date=item.get('release_date') or item.get('first_air_date'),
+            overview=item.get('overview'),
+            providers=providers,
+        )
+
+    def _search_page(self, items, all_providers, total_pages):
+        return SearchPage(
+            [self._search_row(item, providers) for item, providers in zip(items, all_providers)],
+            total_pages
+        )
+
+    def get_image_url(self, path, size='w500'):
+        """Get full image URL from path"""
+        if not path:
+            return None
+        return f"{self.image_base_url}{size}{path}"
+
+
+class TMDbClient(BaseTMDbClient):
+    """A caching TMDb client"""
+
+    def __init__(self, priority=INTERACTIVE):
+        super().__init__(priority)
+        self.session = get_session()
+        self.timeout = get_timeout()
+
     def _make_request(self, endpoint, params=None):
-        """Make a request to the TMDb API"""
+        """Make a request to the TMDb API, or replay it from the archive
+        (see tmdb/archive.py).
+
+        Failed attempts are retried up to TMDB_HTTP_RETRIES times, each
+        taking its own rate limiter token.
+        """
+        archive = get_archive()
+        if archive and archive.replaying:
+            recording = self._replay(archive, endpoint, params)
+            if recording is None:
+                return None
+            if settings.TMDB_REPLAY_LATENCY:
+                time.sleep(recording.seconds)
+            return recording.payload
+
         if not self.api_key:
             logger.error("TMDb API key not configured")
             return None
-            
+
         url = f"{self.base_url}{endpoint}"
-        if params is None:
-            params = {}
+        params = dict(params or {})
         params['api_key'] = self.api_key
-        
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"TMDb API request failed: {e}")
+
+        limiter = get_limiter()
+        retries = settings.TMDB_HTTP_RETRIES
+        for attempt in range(retries + 1):
+            if limiter and not limiter.acquire(self._request_priority()):
+                logger.error(f"TMDb API request to {endpoint} rejected by the rate limiter")
+                return None
+
+            response = None
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                error = e
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    try:
+                        response.raise_for_status()
+                        result = response.json()
+                    except (requests.exceptions.HTTPError, ValueError) as e:
+                        seconds = time.perf_counter() - started
+                        metrics.record_request(endpoint, seconds, ok=False)
+                        if archive:
+                            archive.record(endpoint, params, response.status_code, None, seconds)
+                        logger.error(f"TMDb API request failed: {e}")
+                        return None
+                    seconds = time.perf_counter() - started
+                    metrics.record_request(endpoint, seconds, ok=True)
+                    if archive:
+                        archive.record(endpoint, params, response.status_code, result, seconds)
+                    return result
+                error = f"{response.status_code} response from {endpoint}"
+
+            seconds = time.perf_counter() - started
+            metrics.record_request(endpoint, seconds, ok=False)
+            if attempt < retries:
+                time.sleep(retry_delay(attempt, response))
+
+        if archive and response is not None:
+            archive.record(endpoint, params, response.status_code, None, seconds)
+        logger.error(f"TMDb API request failed: {error}")
+        return None
+
+    def _cached(self, name, cache_key, fetch, empty=None):
+        """Return the cached value for cache_key, calling fetch() on a miss.
+
+        Entries are stored as (fresh_until, value) and expire at the hard
+        TTL for the lookup ``name``. A stale entry is returned immediately
+        and refreshed in the background. Concurrent misses for the same key
+        in this process share a single upstream call. ``empty`` is returned
+        when TMDb has no data, None when the lookup failed.
+        """
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return self._read_entry(name, cache_key, entry, fetch, empty)
+        metrics.record_lookup(name, 'miss')
+        return _single_flight(
+            cache_key, lambda: self._fetch_and_store(name, cache_key, fetch, empty=empty)
+        )
+
+    def _fetch_and_store(self, name, cache_key, fetch, force=False, empty=None):
+        """Fetch a value from TMDb and cache it.
+
+        Failed requests (None) are not cached so they are retried on the
+        next lookup.
+        """
+        if not force:
+            # Another caller may have filled the key while we were waiting
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return _unwrap(entry[1], empty)
+
+        result = fetch()
+        if result is None:
             return None
-    
+
+        record = self._store(name, cache_key, result)
+        return record if record is not None else empty
+
+    def _store(self, name, cache_key, result):
+        """Cache a result fetched from TMDb, returning its record (see
+        records.pack()), or None if it is empty"""
+        record, entries = self._cache_entries(name, cache_key, result)
+        for key, value, timeout in entries:
+            cache.set(key, value, timeout)
+        return record
+
+    def _refresh_in_background(self, name, cache_key, fetch):
+        """Refresh a stale entry in a daemon thread, at most once at a time"""
+        lock_key = f"{cache_key}_refreshing"
+        if not cache.add(lock_key, True, 60):
+            return
+
+        def refresh():
+            _in_background.set(True)
+            try:
+                _single_flight(
+                    cache_key,
+                    lambda: self._fetch_and_store(name, cache_key, fetch, force=True)
+                )
+            except Exception:
+                logger.exception(f"Background refresh of {cache_key} failed")
+            finally:
+                cache.delete(lock_key)
+
+        threading.Thread(target=_closing_connections(refresh), daemon=True).start()
+
+    def _lookup(self, lookup):
+        """Get the cached result of a lookup, fetching it on a miss"""
+        return self._cached(
+            lookup.name, lookup.cache_key, lambda: self._fetch(lookup), empty=lookup.empty
+        )
+
+    def _fetch(self, lookup):
+        """Fetch the result of a lookup from the local catalog, or from TMDb,
+        seeding the caches of its sub-resources and writing it through to
+        the catalog. Catalog errors are logged and never fail a lookup.
+        """
+        if settings.TMDB_CATALOG_ENABLED and lookup.read is not None:
+            try:
+                record = lookup.read()
+            except DatabaseError:
+                logger.exception("TMDb catalog read failed")
+                record = None
+            if record is not None:
+                return record
+
+        result = self._lookup_result(lookup, self._make_request(lookup.endpoint, lookup.params))
+        if result is None:
+            return None
+        for name, key, value in self._sub_resources(lookup, result):
+            self._store(name, key, value)
+        self._write_through(lookup, result)
+        return result
+
     def search_multi(self, query, page=1):
         """Search for movies and TV shows"""
-        cache_key = f"tmdb_search_{query}_{page}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request('/search/multi', {
-            'query': query,
-            'page': page
-        })
-        
-        if result:
-            cache.set(cache_key, result, 3600)  # Cache for 1 hour
-        return result
-    
+        return self._lookup(self._search_lookup(query, page))
+
+    def search_rows(self, query, page=1, country='US'):
+        """Get a page of the movie and TV results of a search with their
+        watch providers, built once per normalized query and cached as a
+        SearchPage"""
+        query = normalize_query(query)
+        return self._cached(
+            'search_rows',
+            cache_key('search_rows', query, page, country),
+            lambda: self._build_search_page(query, page, country)
+        )
+
+    def _build_search_page(self, query, page, country):
+        search_results = self.search_multi(query, page)
+        if search_results is None:
+            return None
+        items = _search_items(search_results)
+        all_providers = self.get_watch_providers_many(
+            ((item['media_type'], item['id']) for item in items), country
+        )
+        return self._search_page(items, all_providers, search_results.get('total_pages', 1))
+
+    def stream_search_rows(self, query, page=1, country='US'):
+        """Like search_rows(), but get (total_pages, rows) where rows yields
+        each SearchRow as soon as its providers resolve, in that order.
+
+        The page is built once per process: concurrent calls and prefetches
+        for it wait for the stream building it, which caches the page once
+        every row has resolved, even if it is closed early. Returns None if
+        TMDb can't be reached.
+        """
+        query = normalize_query(query)
+        key = cache_key('search_rows', query, page, country)
+        future, leader = (None, False) if cache.get(key) is not None else _claim_flight(key)
+        if not leader:
+            search_page = self.search_rows(query, page, country)
+            if search_page is None:
+                return None
+            return search_page.total_pages, iter(search_page.rows)
+
+        try:
+            search_results = self.search_multi(query, page)
+        except BaseException as e:
+            _end_flight(key, future, error=e)
+            raise
+        if search_results is None:
+            _end_flight(key, future)
+            return None
+        items = _search_items(search_results)
+        total_pages = search_results.get('total_pages', 1)
+
+        def build():
+            by_key = {(item['media_type'], item['id']): item for item in items}
+            resolved = {}
+            reading = True
+            try:
+                try:
+                    yield
+                except GeneratorExit:
+                    reading = False
+                for item_key, providers in self.iter_watch_providers_many(list(by_key), country):
+                    resolved[item_key] = self._search_row(by_key[item_key], providers)
+                    if reading:
+                        try:
+                            yield resolved[item_key]
+                        except GeneratorExit:
+                            reading = False
+                search_page = SearchPage(
+                    [resolved[(item['media_type'], item['id'])] for item in items],
+                    total_pages
+                )
+                self._store('search_rows', key, search_page)
+            except BaseException as e:
+                _end_flight(key, future, error=e)
+                raise
+            _end_flight(key, future, search_page)
+
+        rows = build()
+        # Run to the first yield, so closing the rows before reading any
+        # still finishes the page for the callers waiting on it
+        next(rows)
+        return total_pages, rows
+
+    def prefetch_search_rows(self, query, page, country='US'):
+        """Build and cache a page of search_rows() in a daemon thread,
+        unless it is cached or already being built"""
+        if not settings.TMDB_SEARCH_PREFETCH:
+            return
+        query = normalize_query(query)
+        key = cache_key('search_rows', query, page, country)
+        if key in _in_flight or cache.get(key) is not None:
+            return
+        lock_key = f"{key}_prefetching"
+        if not cache.add(lock_key, True, 60):
+            return
+
+        def prefetch():
+            _in_background.set(True)
+            try:
+                self.search_rows(query, page, country)
+            except Exception:
+                logger.exception(f"Prefetch of {key} failed")
+            finally:
+                cache.delete(lock_key)
+
+        threading.Thread(target=_closing_connections(prefetch), daemon=True).start()
+
     def get_movie_details(self, movie_id):
         """Get detailed information about a movie"""
-        cache_key = f"tmdb_movie_{movie_id}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request(f'/movie/{movie_id}', {
-            'append_to_response': 'watch/providers,credits,recommendations'
-        })
-        
-        if result:
-            cache.set(cache_key, result, 86400)  # Cache for 24 hours
-        return result
-    
+        return self._lookup(self._details_lookup('movie', movie_id))
+
     def get_tv_details(self, tv_id):
         """Get detailed information about a TV show"""
-        cache_key = f"tmdb_tv_{tv_id}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request(f'/tv/{tv_id}', {
-            'append_to_response': 'watch/providers,credits,recommendations'
-        })
-        
-        if result:
-            cache.set(cache_key, result, 86400)  # Cache for 24 hours
-        return result
-    
+        return self._lookup(self._details_lookup('tv', tv_id))
+
+    def get_credits(self, media_type, media_id):
+        """Get cast and crew for a movie or TV show"""
+        return self._lookup(self._credits_lookup(media_type, media_id))
+
+    def get_recommendations(self, media_type, media_id):
+        """Get recommended titles for a movie or TV show"""
+        return self._lookup(self._recommendations_lookup(media_type, media_id))
+
     def get_watch_providers(self, media_type, media_id, country='US'):
         """Get watch providers for a movie or TV show"""
-        cache_key = f"tmdb_providers_{media_type}_{media_id}_{country}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        endpoint = f'/{media_type}/{media_id}/watch/providers'
-        result = self._make_request(endpoint)
-        
-        if result and 'results' in result:
-            country_data = result['results'].get(country, {})
-            if country_data:
-                cache.set(cache_key, country_data, 86400)  # Cache for 24 hours
-                return country_data
-        return None
-    
+        providers = self.get_all_watch_providers(media_type, media_id)
+        return (providers or {}).get(country)
+
+    def get_all_watch_providers(self, media_type, media_id):
+        """Get watch providers for a movie or TV show in every region.
+
+        Returns a TitleProviders, whose get(region) gives that region's
+        entry of TMDb's results map, an empty dict if the title has no
+        providers anywhere, or None if the lookup failed.
+        """
+        return self._lookup(self._providers_lookup(media_type, media_id))
+
+    def _fetch_all_watch_providers(self, media_type, media_id, read_catalog=True):
+        return self._fetch(self._providers_lookup(media_type, media_id, read_catalog))
+
+    def get_watch_providers_many(self, items, country='US'):
+        """Get watch providers for many (media_type, media_id) pairs at once"""
+        return [
+            (providers or {}).get(country)
+            for providers in self.get_all_watch_providers_many(items)
+        ]
+
+    def get_cached_watch_providers_many(self, items, country='US'):
+        """Get {(media_type, media_id): providers} for the titles whose watch
+        providers are cached, without calling TMDb"""
+        cache_keys = {cache_key('providers', *item): item for item in items}
+        return {
+            cache_keys[key]: (_unwrap(entry[1], {}) or {}).get(country) or {}
+            for key, entry in cache.get_many(list(cache_keys)).items()
+        }
+
+    def get_all_watch_providers_many(self, items):
+        """Get watch providers in every region for many (media_type, media_id)
+        pairs at once, in the same order as ``items``"""
+        items = list(items)
+        found = dict(self.iter_all_watch_providers_many(items))
+        return [found.get(item) for item in items]
+
+    def iter_watch_providers_many(self, items, country='US'):
+        """Yield (item, providers) for many (media_type, media_id) pairs as
+        each lookup resolves"""
+        for item, providers in self.iter_all_watch_providers_many(items):
+            yield item, (providers or {}).get(country)
+
+    def iter_all_watch_providers_many(self, items):
+        """Yield (item, providers in every region) for many (media_type,
+        media_id) pairs as each lookup resolves.
+
+        Cached entries are read in a single round trip and yielded first,
+        then catalog entries from one query, then the remaining lookups as
+        they complete on a bounded worker pool.
+        """
+        items = list(items)
+        cached = cache.get_many([cache_key('providers', *item) for item in items])
+        found, missing = self._split_cached(items, cached, self._fetch_all_watch_providers)
+        yield from found
+
+        if missing and settings.TMDB_CATALOG_ENABLED:
+            try:
+                stored = catalog.read_providers_many(missing)
+            except DatabaseError:
+                logger.exception("TMDb catalog read failed")
+                stored = {}
+            for item, results in stored.items():
+                metrics.record_lookup('providers', 'miss')
+                yield item, self._store('providers', cache_key('providers', *item), results) or {}
+            missing = [item for item in missing if item not in stored]
+
+        if missing:
+            def lookup(item):
+                return self._lookup(self._providers_lookup(*item, read_catalog=False))
+
+            workers = max(1, min(self.max_workers, len(missing)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Run in copies of this context, to keep its request priority
+                futures = {
+                    executor.submit(contextvars.copy_context().run, _closing_connections(lookup), item): item
+                    for item in missing
+                }
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+
     def get_trending(self, media_type='all', time_window='week'):
         """Get trending content"""
-        cache_key = f"tmdb_trending_{media_type}_{time_window}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request(f'/trending/{media_type}/{time_window}')
-        
-        if result:
-            cache.set(cache_key, result, 3600)  # Cache for 1 hour
-        return result
-    
+        return self._lookup(self._trending_lookup(media_type, time_window))
+
     def get_providers_list(self, watch_region='US'):
         """Get list of all available streaming providers"""
-        cache_key = f"tmdb_providers_list_{watch_region}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request('/watch/providers/movie', {
-            'watch_region': watch_region
-        })
-        
-        if result:
-            cache.set(cache_key, result, 604800)  # Cache for 1 week
-        return result
-    
-    def get_image_url(self, path, size='w500'):
-        """Get full image URL from path"""
-        if not path:
-            return None
-        return f"{self.image_base_url}{size}{path}"
-    
+        return self._lookup(self._providers_list_lookup(watch_region))
+
     def search_person(self, query):
         """Search for people (actors, directors, etc.)"""
-        cache_key = f"tmdb_search_person_{query}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request('/search/person', {
-            'query': query
-        })
-        
-        if result:
-            cache.set(cache_key, result, 3600)  # Cache for 1 hour
-        return result
-    
+        return self._lookup(self._search_person_lookup(query))
+
     def get_person_credits(self, person_id):
         """Get movie and TV credits for a person"""
-        cache_key = f"tmdb_person_credits_{person_id}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request(f'/person/{person_id}/combined_credits')
-        
-        if result:
-            cache.set(cache_key, result, 86400)  # Cache for 24 hours
-        return result
-    
-    def discover_movies(self, with_cast=None, with_crew=None, page=1):
-        """Discover movies with specific cast or crew members"""
-        params = {'page': page}
-        
-        if with_cast:
-            params['with_cast'] = ','.join(map(str, with_cast)) if isinstance(with_cast, list) else str(with_cast)
-        
-        if with_crew:
-            params['with_crew'] = ','.join(map(str, with_crew)) if isinstance(with_crew, list) else str(with_crew)
-        
-        cache_key = f"tmdb_discover_movies_{with_cast}_{with_crew}_{page}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request('/discover/movie', params)
-        
-        if result:
-            cache.set(cache_key, result, 3600)  # Cache for 1 hour
-        return result
-    
-    def discover_tv(self, with_cast=None, with_crew=None, page=1):
+        return self._lookup(self._person_credits_lookup(person_id))
+
+    def estimate_credit_downloads(self, person_ids):
+        """Estimate how many credit records get_person_credits() would fetch
+        from TMDb for these people; cached and catalogued credits are free"""
+        person_ids = list(person_ids)
+        cached = cache.get_many([cache_key('person_credits', person_id) for person_id in person_ids])
+        counts = {}
+        if settings.TMDB_CATALOG_ENABLED:
+            try:
+                counts = catalog.count_person_credits(person_ids)
+            except DatabaseError:
+                logger.exception("TMDb catalog read failed")
+        return _credit_downloads(person_ids, cached, counts)
+
+    def discover_movies(self, with_cast=None, with_crew=None, page=1, sort_by='popularity.desc'):
+        """Discover movies with specific cast or crew members.
+
+        Comma-joined IDs match movies with ALL of the given people.
+        """
+        return self._lookup(self._discover_movies_lookup(with_cast, with_crew, page, sort_by))
+
+    def discover_tv(self, with_cast=None, with_crew=None, page=1, sort_by='popularity.desc'):
         """Discover TV shows with specific cast or crew members"""
-        params = {'page': page}
-        
-        if with_cast:
-            # TMDb uses 'with_people' for TV shows instead of 'with_cast'
-            params['with_people'] = ','.join(map(str, with_cast)) if isinstance(with_cast, list) else str(with_cast)
-        
-        cache_key = f"tmdb_discover_tv_{with_cast}_{with_crew}_{page}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        result = self._make_request('/discover/tv', params)
-        
-        if result:
-            cache.set(cache_key, result, 3600)  # Cache for 1 hour
-        return result
\ No newline at end of file
+        return self._lookup(self._discover_tv_lookup(with_cast, with_crew, page, sort_by))
@@ -0,0 +1,300 @@
+"""
+A local stand-in for the TMDb API, used by the tests and the view
+benchmark.
+
+Serves deterministic payloads for every endpoint TMDbClient calls, with an
+optional per-request latency and error rate, and counts the requests it
+receives per endpoint, the errors it returns and the most requests it
+served at once.
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+PROVIDERS = [
+    (8, 'Netflix', '/t2yyOv40HZeVlLjYsCsPHnWLk4W.jpg'),
+    (9, 'Amazon Prime Video', '/emthp39XA2YScoYL1p0sdbAH2WA.jpg'),
+    (15, 'Hulu', '/zxrVdFjIjLqkfnwyghnfywTn3Lh.jpg'),
+    (337, 'Disney Plus', '/7rwgEs15tFwyR9NPQ5vpzxTj19Q.jpg'),
+    (1899, 'Max', '/6Q3ZYUNA9Hsgj6iWnVsw2gR5V6z.jpg'),
+    (531, 'Paramount Plus', '/xbhHHa1YgtpwhC8lb1NQ3ACVcLd.jpg'),
+    (386, 'Peacock', '/8VCV78prwd9QzZnEm0ReO6bERDa.jpg'),
+    (350, 'Apple TV Plus', '/6uhKBfmtzFqOcLousHwZuzcrScK.jpg'),
+]
+
+
+def _number(text):
+    """A stable number for a string"""
+    return zlib.crc32(text.lower().encode())
+
+
+def _title(media_type, tmdb_id):
+    name = f"{'Movie' if media_type == 'movie' else 'Show'} {tmdb_id}"
+    title = {
+        'id': tmdb_id,
+        'media_type': media_type,
+        'poster_path': f'/poster{tmdb_id}.jpg',
+        'overview': f'Overview of {name}.',
+        'vote_average': round((tmdb_id * 37 % 100) / 10, 1),
+        'popularity': float(tmdb_id * 13 % 1000),
+    }
+    if media_type == 'movie':
+        title.update({'title': name, 'release_date': f'{1980 + tmdb_id % 45}-01-01'})
+    else:
+        title.update({'name': name, 'first_air_date': f'{1980 + tmdb_id % 45}-01-01'})
+    return title
+
+
+def _provider(provider, priority):
+    provider_id, name, logo_path = provider
+    return {
+        'provider_id': provider_id,
+        'provider_name': name,
+        'logo_path': logo_path,
+        'display_priority': priority,
+    }
+
+
+class FakeTMDbServer:
+    """A threaded HTTP server answering like the TMDb v3 API.
+
+    Titles whose ID is a multiple of 5 have no watch providers. People
+    share credits from a pool of 200 movies and 100 TV shows, so searches
+    for several people have overlapping filmographies. ``fixtures`` maps a
+    path (e.g. '/movie/550') to a payload served instead of the generated
+    one.
+    """
+
+    def __init__(self, latency=0, error_rate=0, fixtures=None,
+                 credits_per_person=40, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fixtures = fixtures or {}
+        self.credits_per_person = credits_per_person
+        self.calls = Counter()
+        self.errors = 0
+        self.active = 0
+        self.max_active = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                status, payload = server.handle(url.path, params)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors = 0
+            self.max_active = 0
+
+    def handle(self, path, params):
+        """Get the (status, payload) response for a request"""
+        endpoint = re.sub(r'/\d+', '/{id}', path)
+        with self._lock:
+            self.calls[endpoint] += 1
+            failed = self._random.random() < self.error_rate
+            self.errors += failed
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.active -= 1
+        if failed:
+            return 503, {'status_message': 'Service unavailable'}
+        if path in self.fixtures:
+            return 200, self.fixtures[path]
+
+        payload = self.payload(path, params)
+        if payload is None:
+            return 404, {'status_message': 'The resource you requested could not be found.'}
+        return 200, payload
+
+    def payload(self, path, params):
+        parts = path.strip('/').split('/')
+        page = int(params.get('page', 1))
+
+        if path == '/search/multi':
+            start = _number(params.get('query', '')) % 5000 + 1 + (page - 1) * 20
+            return self._page([
+                _title('movie' if i % 2 else 'tv', start + i) for i in range(20)
+            ], page)
+        if path == '/search/person':
+            person_id = _number(params.get('query', '')) % 100000 + 1
+            return self._page([{
+                'id': person_id,
+                'name': params.get('query', '').title(),
+                'profile_path': f'/person{person_id}.jpg',
+                'known_for_department': 'Directing' if person_id % 7 == 0 else 'Acting',
+            }], page)
+        if parts[:1] == ['person'] and parts[2:] == ['combined_credits']:
+            return self._person_credits(int(parts[1]))
+        if parts[:1] == ['trending']:
+            return self._page([
+                _title('movie' if i % 2 else 'tv', 100 + i) for i in range(20)
+            ], page)
+        if path == '/watch/providers/movie':
+            return {'results': [
+                _provider(provider, priority) for priority, provider in enumerate(PROVIDERS)
+            ]}
+        if parts[:1] == ['discover']:
+            return self._discover(parts[1], params, page)
+        if parts[0] in ('movie', 'tv') and len(parts) >= 2 and parts[1].isdigit():
+            media_type, tmdb_id = parts[0], int(parts[1])
+            if parts[2:] == ['watch', 'providers']:
+                return {'id': tmdb_id, 'results': self._providers(tmdb_id)}
+            if parts[2:] == ['credits']:
+                return self._credits(tmdb_id)
+            if parts[2:] == ['recommendations']:
+                return self._page([_title(media_type, tmdb_id + i) for i in range(1, 6)], 1)
+            if not parts[2:]:
+                return self._details(media_type, tmdb_id, params)
+        return None
+
+    def _page(self, results, page):
+        return {'page': page, 'results': results, 'total_pages': 5, 'total_results': 100}
+
+    def _discover(self, media_type, params, page):
+        """Like TMDb, with_cast and with_crew only filter movies, and
+        comma-separated IDs must all be credited"""
+        people = [
+            int(person_id)
+            for key in ('with_cast', 'with_crew')
+            for person_id in params.get(key, '').split(',') if person_id
+        ]
+        if media_type == 'movie' and people:
+            ids = set.intersection(*(set(self._person_titles(person_id)[0]) for person_id in people))
+        else:
+            ids = range(300, 400)
+
+        field = params.get('sort_by', 'popularity.desc').split('.')[0]
+        titles = sorted((_title(media_type, tmdb_id) for tmdb_id in ids),
+                        key=lambda title: title.get(field, 0), reverse=True)
+        for title in titles:
+            title.pop('media_type')
+        return {
+            'page': page,
+            'results': titles[(page - 1) * 20:page * 20],
+            'total_pages': max(1, -(-len(titles) // 20)),
+            'total_results': len(titles),
+        }
+
+    def _providers(self, tmdb_id):
+        if tmdb_id % 5 == 0:
+            return {}
+        streaming = list(dict.fromkeys([
+            PROVIDERS[tmdb_id % len(PROVIDERS)], PROVIDERS[(tmdb_id * 3) % len(PROVIDERS)]
+        ]))
+        return {
+            region: {
+                'link': f'https://www.themoviedb.org/movie/{tmdb_id}/watch?locale={region}',
+                'flatrate': [_provider(provider, i) for i, provider in enumerate(streaming)],
+                'rent': [_provider(PROVIDERS[1], 0)],
+            }
+            for region in ('US', 'GB', 'CA')
+        }
+
+    def _credits(self, tmdb_id):
+        return {
+            'id': tmdb_id,
+            'cast': [
+                {'id': tmdb_id * 10 + i, 'name': f'Actor {tmdb_id * 10 + i}',
+                 'character': f'Character {i}', 'order': i, 'known_for_department': 'Acting'}
+                for i in range(5)
+            ],
+            'crew': [
+                {'id': tmdb_id * 10 + 9, 'name': f'Director {tmdb_id}',
+                 'job': 'Director', 'known_for_department': 'Directing'}
+            ],
+        }
+
+    def _details(self, media_type, tmdb_id, params):
+        details = _title(media_type, tmdb_id)
+        details.pop('media_type')
+        appended = params.get('append_to_response', '').split(',')
+        if 'watch/providers' in appended:
+            details['watch/providers'] = {'results': self._providers(tmdb_id)}
+        if 'credits' in appended:
+            details['credits'] = self._credits(tmdb_id)
+        if 'recommendations' in appended:
+            details['recommendations'] = self._page(
+                [_title(media_type, tmdb_id + i) for i in range(1, 6)], 1
+            )
+        return details
+
+    def _person_titles(self, person_id):
+        """Get the (movie IDs, TV IDs) a person is credited on"""
+        count = self.credits_per_person
+        movies = sorted({(person_id * 7 + k * 3) % 200 + 1 for k in range(count)})
+        shows = sorted({(person_id * 11 + k * 5) % 100 + 1 for k in range(count // 2)})
+        return movies, shows
+
+    def _person_credits(self, person_id):
+        movies, shows = self._person_titles(person_id)
+        cast = [
+            dict(_title('movie', movie_id), character='Lead')
+            for movie_id in movies
+        ] + [
+            dict(_title('tv', tv_id), character='Guest')
+            for tv_id in shows
+        ]
+        crew = []
+        if person_id % 7 == 0:
+            crew = [dict(_title('movie', movie_id), job='Director') for movie_id in movies[:5]]
+        return {'id': person_id, 'cast': cast, 'crew': crew}
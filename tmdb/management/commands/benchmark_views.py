@@ -0,0 +1,113 @@
+import json
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from tmdb import benchmark
+from tmdb.fake_server import FakeTMDbServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the views against a local fake TMDb server, reporting latency '
+        'percentiles, throughput and TMDb calls per view and concurrency level as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--views', nargs='+', choices=benchmark.VIEWS, default=list(benchmark.VIEWS),
+            help='Views to benchmark'
+        )
+        parser.add_argument(
+            '--concurrency', nargs='+', type=int, default=[1, 4, 16],
+            help='Numbers of concurrent clients to run each view at'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=100,
+            help='Requests per view and concurrency level'
+        )
+        parser.add_argument(
+            '--latency', type=float, default=0.05,
+            help='Seconds the fake TMDb server takes to answer'
+        )
+        parser.add_argument(
+            '--error-rate', type=float, default=0,
+            help='Fraction of TMDb requests answered with a 503'
+        )
+        parser.add_argument(
+            '--fixtures',
+            help='JSON file mapping TMDb paths (e.g. /movie/550) to the payloads to serve'
+        )
+        parser.add_argument(
+            '--watchlist', type=int, default=100,
+            help="Number of items on the benchmark user's watchlist"
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write the JSON report to instead of stdout'
+        )
+
+    def handle(self, *args, **options):
+        fixtures = None
+        if options['fixtures']:
+            try:
+                with open(options['fixtures']) as f:
+                    fixtures = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read fixtures: {e}")
+
+        # Run against a throwaway database; SQLite's shared in-memory test
+        # database locks whole tables, so use a file instead
+        with tempfile.TemporaryDirectory() as temp_dir:
+            setup_test_environment()
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = f'{temp_dir}/benchmark.sqlite3'
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                with FakeTMDbServer(options['latency'], options['error_rate'], fixtures) as server, \
+                        override_settings(
+                            TMDB_API_KEY='benchmark',
+                            TMDB_API_BASE_URL=server.base_url,
+                            TMDB_RATE_LIMIT=0,
+                            METRICS_DIR=f'{temp_dir}/metrics',
+                        ):
+                    user = benchmark.seed_user(watchlist_size=options['watchlist'])
+                    results = benchmark.run(
+                        server, user, options['views'],
+                        [max(1, level) for level in options['concurrency']], options['requests'],
+                    )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        report = {
+            'commit': self._commit(),
+            'options': {
+                'requests': options['requests'],
+                'latency': options['latency'],
+                'error_rate': options['error_rate'],
+                'watchlist': options['watchlist'],
+            },
+            'results': [result._asdict() for result in results],
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def _commit(self):
+        """Get the checked out git commit, if any"""
+        try:
+            result = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, capture_output=True, text=True,
+            )
+        except OSError:
+            return None
+        return result.stdout.strip() or None
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tmdb.client import TMDbClient
+from tmdb.ratelimit import BACKGROUND
+from tmdb.records import reset_savings, savings_report
+
+
+class Command(BaseCommand):
+    help = 'Fetch TMDb titles through the cache and report the bytes saved per cached lookup'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--movie', type=int, action='append', default=[],
+            help='Movie ID to fetch; may be repeated. Defaults to the trending titles'
+        )
+        parser.add_argument(
+            '--tv', type=int, action='append', default=[],
+            help='TV show ID to fetch; may be repeated'
+        )
+
+    def handle(self, *args, **options):
+        client = TMDbClient(priority=BACKGROUND)
+        reset_savings()
+
+        titles = [('movie', movie_id) for movie_id in options['movie']]
+        titles += [('tv', tv_id) for tv_id in options['tv']]
+        if not titles:
+            trending = client.get_trending()
+            if trending is None:
+                raise CommandError('Could not fetch trending titles from TMDb')
+            titles = [
+                (item['media_type'], item['id']) for item in trending.get('results', [])
+                if item.get('media_type') in ('movie', 'tv')
+            ]
+
+        for media_type, media_id in titles:
+            if media_type == 'movie':
+                client.get_movie_details(media_id)
+            else:
+                client.get_tv_details(media_id)
+            client.get_all_watch_providers(media_type, media_id)
+
+        rows = savings_report()
+        if not rows:
+            self.stdout.write('Nothing was fetched from TMDb; clear the cache and run again')
+            return
+
+        self.stdout.write(f"{'lookup':<16}{'entries':>8}{'payload':>12}{'cached':>12}{'saved':>8}")
+        for name, entries, payload_bytes, cached_bytes in rows:
+            saved = 1 - cached_bytes / payload_bytes if payload_bytes else 0
+            self.stdout.write(
+                f"{name:<16}{entries:>8}{payload_bytes:>12,}{cached_bytes:>12,}{saved:>8.0%}"
+            )
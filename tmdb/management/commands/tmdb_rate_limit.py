@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from tmdb.ratelimit import get_limiter
+
+
+class Command(BaseCommand):
+    help = 'Show the TMDb rate limiter counters of every worker on this host'
+
+    def handle(self, *args, **options):
+        limiter = get_limiter()
+        if limiter is None:
+            self.stdout.write('TMDb requests are not rate limited (TMDB_RATE_LIMIT is 0)')
+            return
+
+        self.stdout.write(f"{'priority':<14}{'calls':>10}{'waited (s)':>12}{'rejected':>10}")
+        for priority, stats in limiter.stats().items():
+            self.stdout.write(
+                f"{priority:<14}{stats['calls']:>10}{stats['waited']:>12.1f}{stats['rejected']:>10}"
+            )
@@ -0,0 +1,139 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from accounts.models import User
+from tmdb import catalog
+from tmdb.cache import is_shared
+from tmdb.client import TMDbClient, _closing_connections
+from tmdb.ratelimit import BACKGROUND
+from watchlist.models import WatchlistItem
+
+
+class CountingClient(TMDbClient):
+    """A TMDbClient counting the TMDb requests made on each thread"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._local = threading.local()
+
+    def _make_request(self, endpoint, params=None):
+        self._local.requests = getattr(self._local, 'requests', 0) + 1
+        return super()._make_request(endpoint, params)
+
+    def run(self, lookups):
+        """Call each lookup, returning ('failed' | 'fetched' | 'cached'),
+        where 'cached' means read from the cache or catalog"""
+        self._local.requests = 0
+        results = [lookup() for lookup in lookups]
+        if any(result is None for result in results):
+            return 'failed'
+        return 'fetched' if self._local.requests else 'cached'
+
+
+class Command(BaseCommand):
+    help = (
+        'Warm the TMDb catalog with the details and providers of the top trending and '
+        'most watchlisted titles, and a shared cache with the trending and provider lists'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=settings.TMDB_WARM_TOP_TITLES,
+            help='Number of trending titles to warm'
+        )
+        parser.add_argument(
+            '--watchlisted', type=int, default=settings.TMDB_WARM_WATCHLISTED_TITLES,
+            help='Number of most watchlisted titles to warm'
+        )
+        parser.add_argument(
+            '--region', action='append', dest='regions',
+            help='Region whose provider list to warm; may be repeated. '
+                 "Defaults to TMDB_WARM_REGIONS and every user's region"
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.TMDB_MAX_WORKERS,
+            help='Maximum number of concurrent lookups'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        client = CountingClient(priority=BACKGROUND)
+        self.counts = {'cached': 0, 'fetched': 0, 'failed': 0}
+        workers = max(1, options['workers'])
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Lists are only cached, so warming them is no use to the web
+            # workers unless they share the cache
+            if is_shared(caches['default']):
+                self.run_tasks(executor, client, self.list_lookups(
+                    client, options['regions'] or self.regions()
+                ))
+            else:
+                self.stdout.write('The cache is per process; warming the catalog only')
+            titles = self.trending_titles(client, options['top'])
+            titles += self.watchlisted_titles(options['watchlisted'])
+            self.run_tasks(executor, client, self.title_lookups(client, titles))
+        catalog.flush_writes()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {sum(self.counts.values())} lists and titles: {self.counts['cached']} already warm, "
+            f"{self.counts['fetched']} fetched, {self.counts['failed']} failed, "
+            f"in {time.monotonic() - started:.1f}s"
+        ))
+
+    def run_tasks(self, executor, client, tasks):
+        """Run each task's lookups in order, tasks concurrently"""
+        futures = [
+            executor.submit(_closing_connections(client.run), lookups) for lookups in tasks
+        ]
+        for future in futures:
+            self.counts[future.result()] += 1
+
+    def list_lookups(self, client, regions):
+        """Get a task for the trending list the home page shows and one per
+        region's provider list"""
+        tasks = [[partial(client.get_trending, 'all', 'week')]]
+        tasks += [[partial(client.get_providers_list, region)] for region in regions]
+        return tasks
+
+    def title_lookups(self, client, titles):
+        """Get a task per title fetching its details, then its providers,
+        which the detail response usually seeds"""
+        return [
+            [
+                partial(client.get_movie_details if media_type == 'movie' else client.get_tv_details, media_id),
+                partial(client.get_all_watch_providers, media_type, media_id),
+            ]
+            for media_type, media_id in dict.fromkeys(titles)
+        ]
+
+    def regions(self):
+        """Get TMDB_WARM_REGIONS and the regions users have picked"""
+        regions = dict.fromkeys(settings.TMDB_WARM_REGIONS)
+        regions.update(dict.fromkeys(User.objects.values_list('region', flat=True).distinct()))
+        return list(regions)
+
+    def trending_titles(self, client, count):
+        """Get the top (media_type, tmdb_id) pairs trending this week"""
+        trending = client.get_trending('all', 'week') or {}
+        return [
+            (item['media_type'], item['id']) for item in trending.get('results', [])
+            if item.get('media_type') in ('movie', 'tv')
+        ][:count]
+
+    def watchlisted_titles(self, count):
+        """Get the (media_type, tmdb_id) pairs on the most watchlists"""
+        return list(
+            WatchlistItem.objects
+            .values('media_type', 'tmdb_id')
+            .annotate(watchers=Count('id'))
+            .order_by('-watchers')
+            .values_list('media_type', 'tmdb_id')[:count]
+        )
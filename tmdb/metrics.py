@@ -0,0 +1,262 @@
+"""
+Counters and histograms for TMDb calls, the TMDb cache and the views,
+exposed in the Prometheus text format.
+
+Each worker keeps its metrics in memory and writes them to its own file in
+METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds; the metrics
+endpoint adds up the files of every worker on the host. Files left by
+workers that have exited are merged into one file of their totals, so
+counters never go backwards. The rate limiter counters are read at scrape
+time.
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+
+from .ratelimit import fcntl, get_limiter
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'tmdb_request_duration_seconds': ('histogram', 'TMDb API request latency by endpoint'),
+    'tmdb_requests_total': ('counter', 'TMDb API requests by endpoint and outcome'),
+    'tmdb_cache_lookups_total': ('counter', 'TMDb cache lookups by key family and result (hit, stale, miss)'),
+    'tmdb_cache_payload_bytes_total': ('counter', 'Bytes of TMDb payloads cached, by lookup'),
+    'tmdb_cache_stored_bytes_total': ('counter', 'Bytes stored in the cache for those payloads, by lookup'),
+    'tmdb_rate_limit_calls_total': ('counter', 'TMDb requests let through by the rate limiter'),
+    'tmdb_rate_limit_wait_seconds_total': ('counter', 'Seconds spent waiting for the rate limiter'),
+    'tmdb_rate_limit_rejected_total': ('counter', 'TMDb requests rejected by the rate limiter'),
+    'view_duration_seconds': ('histogram', 'Request handling time by view'),
+    'view_requests_total': ('counter', 'Requests by view, method and status'),
+    'view_db_queries_total': ('counter', 'SQL queries run by view'),
+    'view_db_query_seconds_total': ('counter', 'Seconds spent in SQL queries by view'),
+}
+
+# (name, labels) -> value for counters, or [bucket counts..., sum, count]
+# for histograms; labels is a sorted tuple of (label, value) pairs
+_counters = defaultdict(float)
+_histograms = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+_flushed_at = 0
+
+# This worker's file in METRICS_DIR, named after its PID plus a token so a
+# later process reusing the PID doesn't overwrite it
+_filename = f'{_pid}-{uuid.uuid4().hex[:8]}.json'
+
+# The totals of the workers that have exited
+MERGED_FILENAME = 'merged.json'
+
+
+def endpoint_name(endpoint):
+    """Fold the IDs out of a TMDb endpoint, e.g. /movie/{id}/credits"""
+    return re.sub(r'/\d+', '/{id}', endpoint)
+
+
+def record_request(endpoint, seconds, ok):
+    """Record a TMDb API request's latency and outcome"""
+    endpoint = endpoint_name(endpoint)
+    observe('tmdb_request_duration_seconds', seconds, endpoint=endpoint)
+    inc('tmdb_requests_total', endpoint=endpoint, outcome='ok' if ok else 'error')
+
+
+def record_lookup(name, result):
+    """Count a 'hit', 'stale' or 'miss' for the cache key family of the
+    client lookup ``name``"""
+    inc('tmdb_cache_lookups_total', family=f'tmdb_{name}_', result=result)
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _check_fork()
+        _counters[key] += value
+
+
+def observe(name, value, **labels):
+    """Record a histogram observation"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _check_fork()
+        histogram = _histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def reset():
+    """Drop this worker's metrics"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _check_fork():
+    """Drop the metrics a forked worker inherited from its parent"""
+    global _pid, _filename
+    if os.getpid() != _pid:
+        _counters.clear()
+        _histograms.clear()
+        _pid = os.getpid()
+        _filename = f'{_pid}-{uuid.uuid4().hex[:8]}.json'
+
+
+def flush_due():
+    """Whether flush() would write this worker's file now"""
+    return time.monotonic() - _flushed_at >= settings.METRICS_FLUSH_INTERVAL
+
+
+def flush(force=False):
+    """Write this worker's metrics to its file, at most every
+    METRICS_FLUSH_INTERVAL seconds unless ``force``d"""
+    global _flushed_at
+    if not force and not flush_due():
+        return
+    with _lock:
+        _check_fork()
+        _flushed_at = time.monotonic()
+        filename = _filename
+        data = _dump(_counters, _histograms)
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    _write(os.path.join(settings.METRICS_DIR, filename), data)
+
+
+def _dump(counters, histograms):
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), values] for (name, labels), values in histograms.items()],
+    }
+
+
+def _write(path, data):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _add(counters, histograms, path):
+    """Add the metrics in a file to counters and histograms, returning
+    False if it can't be read"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False
+    for name, labels, value in data['counters']:
+        counters[(name, tuple(sorted(labels.items())))] += value
+    for name, labels, values in data['histograms']:
+        key = (name, tuple(sorted(labels.items())))
+        total = histograms.setdefault(key, [0] * len(values))
+        histograms[key] = [a + b for a, b in zip(total, values)]
+    return True
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:  # e.g. another user's process
+        return True
+    return True
+
+
+def _worker_pid(filename):
+    """Get the PID a worker's metrics file is named after, or None"""
+    pid = filename[:-len('.json')].split('-')[0]
+    return int(pid) if filename.endswith('.json') and pid.isdigit() else None
+
+
+def merge_dead_workers():
+    """Fold the files of workers that have exited into MERGED_FILENAME,
+    like prometheus_client's mark_process_dead(), but keeping their
+    counts so the totals don't drop"""
+    directory = settings.METRICS_DIR
+    lock_fd = os.open(os.path.join(directory, 'merge.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        dead = [
+            filename for filename in os.listdir(directory)
+            if (pid := _worker_pid(filename)) is not None and pid != os.getpid() and not _is_alive(pid)
+        ]
+        if not dead:
+            return
+        counters = defaultdict(float)
+        histograms = {}
+        merged_path = os.path.join(directory, MERGED_FILENAME)
+        _add(counters, histograms, merged_path)
+        dead = [filename for filename in dead if _add(counters, histograms, os.path.join(directory, filename))]
+        _write(merged_path, _dump(counters, histograms))
+        for filename in dead:
+            os.remove(os.path.join(directory, filename))
+    finally:
+        os.close(lock_fd)  # also releases the flock
+
+
+def collect():
+    """Add up the metrics of every worker, past and present, with the rate
+    limiter counters, as (counters, histograms) dicts"""
+    flush(force=True)
+    merge_dead_workers()
+    counters = defaultdict(float)
+    histograms = {}
+    for filename in os.listdir(settings.METRICS_DIR):
+        if filename == MERGED_FILENAME or _worker_pid(filename) is not None:
+            _add(counters, histograms, os.path.join(settings.METRICS_DIR, filename))
+
+    limiter = get_limiter()
+    if limiter:
+        for priority, stats in limiter.stats().items():
+            labels = (('priority', priority),)
+            counters[('tmdb_rate_limit_calls_total', labels)] = stats['calls']
+            counters[('tmdb_rate_limit_wait_seconds_total', labels)] = stats['waited']
+            counters[('tmdb_rate_limit_rejected_total', labels)] = stats['rejected']
+    return counters, histograms
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = ','.join(
+        f'{label}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for label, value in pairs
+    )
+    return f'{{{escaped}}}'
+
+
+def render():
+    """Render every worker's metrics in the Prometheus text format"""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, description) in HELP.items():
+        samples = []
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    samples.append(f'{name}{_labels(labels)} {value:g}')
+        else:
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(BUCKETS, values):
+                    samples.append(f'{name}_bucket{_labels(labels, le=f"{bound:g}")} {count}')
+                samples.append(f'{name}_bucket{_labels(labels, le="+Inf")} {values[-1]}')
+                samples.append(f'{name}_sum{_labels(labels)} {values[-2]:g}')
+                samples.append(f'{name}_count{_labels(labels)} {values[-1]}')
+        if samples:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}'] + samples
+    return '\n'.join(lines) + '\n'
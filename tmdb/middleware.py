@@ -0,0 +1,158 @@
+import hashlib
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import parse_etags
+
+from . import metrics
+from .client import TRENDING_VERSION_KEY
+
+# URL names of the pages served from the anonymous page cache
+CACHED_VIEWS = ('home', 'search')
+
+
+class AnonymousPageCacheMiddleware(MiddlewareMixin):
+    """Serve home and search to anonymous visitors from a full-page cache.
+
+    Sits above the session, auth and messages middleware so a hit skips
+    them as well as the view. Requests with a session or messages cookie
+    may belong to a signed-in user and always go through. Pages are keyed
+    by the full URL and the trending version, so they're dropped whenever
+    trending data is refreshed.
+    """
+
+    def process_request(self, request):
+        if not self._is_cacheable(request):
+            return None
+
+        request._page_cache_miss = True
+        page = cache.get(self._cache_key(request))
+        if page is None:
+            return None
+        request._page_cache_miss = False
+        return self._respond(request, page)
+
+    def process_response(self, request, response):
+        if not getattr(request, '_page_cache_miss', False):
+            return response
+        # Pages that set cookies (e.g. a CSRF token) are per visitor
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return response
+
+        content = response.content
+        headers = {
+            header: value for header, value in response.items()
+            if header.lower() not in ('content-length', 'vary')
+        }
+        page = (content, headers, f'"{hashlib.sha256(content).hexdigest()}"')
+        # Keyed after rendering, as the render may have refreshed trending
+        cache.set(self._cache_key(request), page, settings.TMDB_PAGE_CACHE_TTL)
+        return self._respond(request, page)
+
+    def _cache_key(self, request):
+        version = cache.get(TRENDING_VERSION_KEY, 0)
+        path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f"page_{version}_{path_hash}"
+
+    def _is_cacheable(self, request):
+        if request.method != 'GET':
+            return False
+        if settings.SESSION_COOKIE_NAME in request.COOKIES or CookieStorage.cookie_name in request.COOKIES:
+            return False
+        try:
+            return resolve(request.path_info).url_name in CACHED_VIEWS
+        except Resolver404:
+            return False
+
+    def _respond(self, request, page):
+        content, headers, etag = page
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content)
+            for header, value in headers.items():
+                response[header] = value
+        response['ETag'] = etag
+        response['Cache-Control'] = f'public, max-age={settings.TMDB_PAGE_CACHE_MAX_AGE}'
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and the seconds they take"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Record each request's handling time, status and SQL queries by view.
+
+    Sits above the page cache so cached pages are timed too. Like Django's
+    own middleware it runs in the mode of the handler below it, so ASGI
+    requests to the async views stay on the event loop. Queries run on this
+    thread's connection are counted; those run by sync_to_async code in the
+    async views use other threads and aren't.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        queries = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, queries)
+        metrics.flush()
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, queries)
+        if metrics.flush_due():
+            await sync_to_async(metrics.flush, thread_sensitive=False)()
+        return response
+
+    def _record(self, request, response, seconds, queries):
+        view = self._view_name(request)
+        metrics.observe('view_duration_seconds', seconds, view=view)
+        metrics.inc('view_requests_total', view=view, method=request.method, status=response.status_code)
+        metrics.inc('view_db_queries_total', queries.count, view=view)
+        metrics.inc('view_db_query_seconds_total', queries.seconds, view=view)
+
+    def _view_name(self, request):
+        match = request.resolver_match
+        if match is None:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                return 'not_found'
+        return match.view_name
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Person',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tmdb_id', models.IntegerField(unique=True)),
+                ('name', models.CharField(blank=True, max_length=200)),
+                ('profile_path', models.CharField(blank=True, max_length=200)),
+                ('known_for_department', models.CharField(blank=True, max_length=50)),
+                ('credits_updated', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'people',
+            },
+        ),
+        migrations.CreateModel(
+            name='Title',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tmdb_id', models.IntegerField()),
+                ('media_type', models.CharField(choices=[('movie', 'Movie'), ('tv', 'TV Show')], max_length=10)),
+                ('title', models.CharField(max_length=300)),
+                ('poster_path', models.CharField(blank=True, max_length=200)),
+                ('release_date', models.CharField(blank=True, max_length=20)),
+                ('overview', models.TextField(blank=True)),
+                ('vote_average', models.FloatField(default=0)),
+                ('popularity', models.FloatField(default=0)),
+                ('details_updated', models.DateTimeField(blank=True, null=True)),
+                ('credits_updated', models.DateTimeField(blank=True, null=True)),
+                ('providers_updated', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('tmdb_id', 'media_type')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Credit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('credit_type', models.CharField(choices=[('cast', 'Cast'), ('crew', 'Crew')], max_length=10)),
+                ('character', models.CharField(blank=True, max_length=500)),
+                ('job', models.CharField(blank=True, max_length=100)),
+                ('order', models.IntegerField(blank=True, null=True)),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credits', to='tmdb.person')),
+                ('title', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credits', to='tmdb.title')),
+            ],
+            options={
+                'ordering': ['order', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Availability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(max_length=2)),
+                ('offer_type', models.CharField(choices=[('flatrate', 'Stream'), ('free', 'Free'), ('ads', 'With Ads'), ('rent', 'Rent'), ('buy', 'Buy')], max_length=10)),
+                ('provider_id', models.IntegerField()),
+                ('provider_name', models.CharField(max_length=100)),
+                ('logo_path', models.CharField(blank=True, max_length=200)),
+                ('display_priority', models.IntegerField(default=0)),
+                ('link', models.URLField(blank=True, max_length=500)),
+                ('title', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='tmdb.title')),
+            ],
+            options={
+                'verbose_name_plural': 'availability',
+                'ordering': ['display_priority'],
+                'indexes': [models.Index(fields=['region', 'provider_id'], name='tmdb_availa_region_a59d22_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,97 @@
 from django.db import models
 
-# Create your models here.
+
+class Title(models.Model):
+    """A movie or TV show in the local TMDb catalog"""
+    MEDIA_TYPES = (
+        ('movie', 'Movie'),
+        ('tv', 'TV Show'),
+    )
+
+    tmdb_id = models.IntegerField()
+    media_type = models.CharField(max_length=10, choices=MEDIA_TYPES)
+    title = models.CharField(max_length=300)
+    poster_path = models.CharField(max_length=200, blank=True)
+    release_date = models.CharField(max_length=20, blank=True)
+    overview = models.TextField(blank=True)
+    vote_average = models.FloatField(default=0)
+    popularity = models.FloatField(default=0)
+
+    # When each part of the record was last written from TMDb
+    details_updated = models.DateTimeField(null=True, blank=True)
+    credits_updated = models.DateTimeField(null=True, blank=True)
+    providers_updated = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['tmdb_id', 'media_type']
+
+    def __str__(self):
+        return f"{self.title} ({self.get_media_type_display()})"
+
+
+class Person(models.Model):
+    """An actor, director or other crew member in the local TMDb catalog"""
+    tmdb_id = models.IntegerField(unique=True)
+    name = models.CharField(max_length=200, blank=True)
+    profile_path = models.CharField(max_length=200, blank=True)
+    known_for_department = models.CharField(max_length=50, blank=True)
+
+    # When the person's full combined credits were last written from TMDb
+    credits_updated = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'people'
+
+    def __str__(self):
+        return self.name or str(self.tmdb_id)
+
+
+class Credit(models.Model):
+    """A cast or crew credit linking a person to a title"""
+    CREDIT_TYPES = (
+        ('cast', 'Cast'),
+        ('crew', 'Crew'),
+    )
+
+    title = models.ForeignKey(Title, on_delete=models.CASCADE, related_name='credits')
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='credits')
+    credit_type = models.CharField(max_length=10, choices=CREDIT_TYPES)
+    character = models.CharField(max_length=500, blank=True)
+    job = models.CharField(max_length=100, blank=True)
+    order = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['order', 'id']
+
+    def __str__(self):
+        return f"{self.person} in {self.title}"
+
+
+class Availability(models.Model):
+    """A way to watch a title in one region (streaming, rental, purchase...)"""
+    OFFER_TYPES = (
+        ('flatrate', 'Stream'),
+        ('free', 'Free'),
+        ('ads', 'With Ads'),
+        ('rent', 'Rent'),
+        ('buy', 'Buy'),
+    )
+
+    title = models.ForeignKey(Title, on_delete=models.CASCADE, related_name='availability')
+    region = models.CharField(max_length=2)
+    offer_type = models.CharField(max_length=10, choices=OFFER_TYPES)
+    provider_id = models.IntegerField()  # TMDb provider ID
+    provider_name = models.CharField(max_length=100)
+    logo_path = models.CharField(max_length=200, blank=True)
+    display_priority = models.IntegerField(default=0)
+    link = models.URLField(max_length=500, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'availability'
+        ordering = ['display_priority']
+        indexes = [
+            models.Index(fields=['region', 'provider_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.title} on {self.provider_name} ({self.region})"
@@ -0,0 +1,148 @@
+"""
+A token-bucket rate limiter for TMDb requests, shared by every worker on
+the host through a locked state file.
+
+Interactive requests (the views) may drain the bucket; background
+requests (management commands and batch jobs) leave
+TMDB_RATE_LIMIT_RESERVE tokens for them, so live traffic goes first when
+both compete. Every attempt at a request, retries included, takes a
+token. Callers wait for a token up to the max wait of their priority and
+are rejected after that. Calls, seconds waited and rejections
+per priority are counted in the state file too, so the counters cover
+every worker.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limiter is per process
+    fcntl = None
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter:
+    """A token bucket of ``burst`` tokens refilled at ``rate`` per second,
+    stored in the file at ``path``"""
+
+    def __init__(self, path, rate, burst, reserve):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.reserve = min(reserve, burst - 1)
+        # flock() doesn't exclude threads of one process
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=INTERACTIVE):
+        """Wait for a token, returning False if none came in time"""
+        deadline = time.monotonic() + settings.TMDB_RATE_LIMIT_MAX_WAIT[priority]
+        started = time.monotonic()
+        while True:
+            delay = self._take(priority, time.monotonic() - started)
+            if not delay:
+                return True
+            if time.monotonic() + delay > deadline:
+                self._reject(priority)
+                return False
+            time.sleep(delay)
+
+    async def aacquire(self, priority=INTERACTIVE):
+        """Async version of acquire(); the locked state file is read and
+        written on a worker thread, off the event loop"""
+        deadline = time.monotonic() + settings.TMDB_RATE_LIMIT_MAX_WAIT[priority]
+        started = time.monotonic()
+        while True:
+            delay = await asyncio.to_thread(self._take, priority, time.monotonic() - started)
+            if not delay:
+                return True
+            if time.monotonic() + delay > deadline:
+                await asyncio.to_thread(self._reject, priority)
+                return False
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        """Get {priority: {'calls', 'waited', 'rejected'}} for every worker"""
+        with self._state() as state:
+            return state['stats']
+
+    def _take(self, priority, waited):
+        """Take a token, returning 0, or the seconds until one may be free"""
+        floor = self.reserve if priority == BACKGROUND else 0
+        with self._state() as state:
+            now = time.time()
+            tokens = min(self.burst, state['tokens'] + (now - state['updated']) * self.rate)
+            state['updated'] = now
+            state['tokens'] = tokens
+            if tokens - 1 < floor:
+                return (floor + 1 - tokens) / self.rate
+            state['tokens'] = tokens - 1
+            stats = state['stats'][priority]
+            stats['calls'] += 1
+            stats['waited'] += waited
+            return 0
+
+    def _reject(self, priority):
+        with self._state() as state:
+            state['stats'][priority]['rejected'] += 1
+
+    @contextmanager
+    def _state(self):
+        """Read the state under the locks, writing it back afterwards"""
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                data = b''
+                while chunk := os.read(fd, 4096):
+                    data += chunk
+                try:
+                    state = json.loads(data)
+                except ValueError:
+                    state = self._initial_state()
+                yield state
+                updated = json.dumps(state).encode()
+                if updated != data:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.ftruncate(fd, 0)
+                    os.write(fd, updated)
+            finally:
+                os.close(fd)  # also releases the flock
+
+    def _initial_state(self):
+        return {
+            'tokens': self.burst,
+            'updated': time.time(),
+            'stats': {
+                priority: {'calls': 0, 'waited': 0.0, 'rejected': 0}
+                for priority in PRIORITIES
+            },
+        }
+
+
+def get_limiter():
+    """Get the RateLimiter for the current settings, or None if TMDb
+    requests aren't rate limited"""
+    if not settings.TMDB_RATE_LIMIT:
+        return None
+    key = (
+        settings.TMDB_RATE_LIMIT_FILE, settings.TMDB_RATE_LIMIT,
+        settings.TMDB_RATE_LIMIT_BURST, settings.TMDB_RATE_LIMIT_RESERVE,
+    )
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(key, RateLimiter(*key))
+    return limiter
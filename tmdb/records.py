@@ -0,0 +1,153 @@
+"""
+Compact cache records for TMDb payloads.
+
+TMDb responses carry far more than the views read. Before a response is
+cached, the lookups in PROJECTIONS are cut down to typed records holding
+only the fields the app uses, and any entry that still pickles to
+TMDB_CACHE_COMPRESS_MIN_BYTES or more is stored zlib-compressed. The bytes
+saved are tallied per lookup name for savings_report() and the metrics
+endpoint.
+"""
+import pickle
+import threading
+import zlib
+from collections import namedtuple
+
+from django.conf import settings
+
+from . import metrics
+
+# The fields of a movie or TV show shown in result rows, with TV names and
+# air dates under the movie field names
+TitleRecord = namedtuple(
+    'TitleRecord', 'id media_type title release_date poster_path overview vote_average popularity'
+)
+
+
+class TitleProviders(namedtuple('TitleProviders', 'names regions')):
+    """A title's watch providers in every region, compacted.
+
+    ``names`` holds each provider's (name, logo_path) once for all regions,
+    and ``regions`` maps a region to its (link, ((offer type, provider IDs),
+    ...)), IDs in display order. get() rebuilds a region's entry of the TMDb
+    ``results`` map, so it reads like that map.
+    """
+    __slots__ = ()
+
+    def get(self, region, default=None):
+        entry = self.regions.get(region)
+        if entry is None:
+            return default
+        link, offers = entry
+        providers = {'link': link} if link else {}
+        for offer_type, provider_ids in offers:
+            providers[offer_type] = [
+                {
+                    'provider_id': provider_id,
+                    'provider_name': self.names[provider_id][0],
+                    'logo_path': self.names[provider_id][1],
+                    'display_priority': priority,
+                }
+                for priority, provider_id in enumerate(provider_ids)
+            ]
+        return providers
+
+
+# A pickled, zlib-compressed cache value
+Compressed = namedtuple('Compressed', 'data')
+
+# Lookup name: [entries, TMDb payload bytes, cached bytes]
+_savings = {}
+_savings_lock = threading.Lock()
+
+
+def project_title(media_type, item):
+    """Build a TitleRecord from a TMDb title, detail response or credit.
+
+    Fields missing from ``item`` are None.
+    """
+    if media_type == 'movie':
+        title, release_date = item.get('title'), item.get('release_date')
+    else:
+        title, release_date = item.get('name'), item.get('first_air_date')
+    return TitleRecord(
+        id=item['id'],
+        media_type=media_type,
+        title=title,
+        release_date=release_date,
+        poster_path=item.get('poster_path'),
+        overview=item.get('overview'),
+        vote_average=item.get('vote_average'),
+        popularity=item.get('popularity'),
+    )
+
+
+def compact_providers(results):
+    """Build TitleProviders from a TMDb watch/providers ``results`` map"""
+    names = {}
+    regions = {}
+    for region, data in results.items():
+        offers = []
+        for offer_type, providers in data.items():
+            if not isinstance(providers, list):
+                continue
+            providers = sorted(providers, key=lambda provider: provider.get('display_priority') or 0)
+            for provider in providers:
+                names.setdefault(provider['provider_id'], (provider.get('provider_name'), provider.get('logo_path')))
+            offers.append((offer_type, tuple(provider['provider_id'] for provider in providers)))
+        regions[region] = (data.get('link'), tuple(offers))
+    return TitleProviders(names, regions)
+
+
+# Projections applied to cached TMDb responses, by lookup name
+PROJECTIONS = {
+    'movie': lambda details: project_title('movie', details),
+    'tv': lambda details: project_title('tv', details),
+    'providers': compact_providers,
+}
+
+
+def pack(name, result):
+    """Get the (record, cache value) for a non-empty TMDb result.
+
+    The record is the projected result; the cache value is the record,
+    compressed if it is large.
+    """
+    project = PROJECTIONS.get(name)
+    record = project(result) if project else result
+    pickled = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    payload_bytes = len(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)) if project else len(pickled)
+
+    value = record
+    if len(pickled) >= settings.TMDB_CACHE_COMPRESS_MIN_BYTES:
+        value = Compressed(zlib.compress(pickled))
+    cached_bytes = len(value.data) if value is not record else len(pickled)
+
+    with _savings_lock:
+        totals = _savings.setdefault(name, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += payload_bytes
+        totals[2] += cached_bytes
+    metrics.inc('tmdb_cache_payload_bytes_total', payload_bytes, lookup=name)
+    metrics.inc('tmdb_cache_stored_bytes_total', cached_bytes, lookup=name)
+    return record, value
+
+
+def unpack(value):
+    """Get the record back from a cache value written by pack()"""
+    if isinstance(value, Compressed):
+        return pickle.loads(zlib.decompress(value.data))
+    return value
+
+
+def savings_report():
+    """Get (name, entries, payload bytes, cached bytes) for every lookup
+    cached by this process, most bytes saved first"""
+    with _savings_lock:
+        rows = [(name, *totals) for name, totals in _savings.items()]
+    return sorted(rows, key=lambda row: row[2] - row[3], reverse=True)
+
+
+def reset_savings():
+    with _savings_lock:
+        _savings.clear()
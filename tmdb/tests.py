@@ -1,3 +1,1079 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from accounts.context import invalidate_user_contexts
+from accounts.models import StreamingService, User
+from . import async_views, benchmark, catalog, metrics, views
+from .archive import get_archive
+from .cache import BoundedLocMemCache
+from .client import NO_DATA, TMDbClient, _in_flight, _single_flight
+from .fake_server import FakeTMDbServer, _number
+from .middleware import MetricsMiddleware
+from .models import Availability, Person, Title
+from .ratelimit import BACKGROUND, get_limiter
+from .records import Compressed, TitleProviders, TitleRecord, reset_savings, savings_report
+from .transport import retry_delay
+
+
+# Routes the TMDb views to their async versions for AsyncViewTests
+urlpatterns = [
+    path('', async_views.home, name='home'),
+    path('search/', async_views.search, name='search'),
+    path('advanced-search/', async_views.advanced_search, name='advanced_search'),
+    path('api/search/', views.search_api, name='search_api'),
+    path('accounts/', include('accounts.urls')),
+    path('watchlist/', include('watchlist.urls')),
+]
+
+
+class FakeTMDbMixin:
+    """Run each test against a local FakeTMDbServer"""
+    server_options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeTMDbServer(**cls.server_options).start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        cache.clear()
+        self.server.reset()
+        self.settings_override = override_settings(
+            TMDB_API_KEY='test-key',
+            TMDB_API_BASE_URL=self.server.base_url,
+            TMDB_CATALOG_ENABLED=False,
+            TMDB_SEARCH_PREFETCH=False,
+            TMDB_RATE_LIMIT=0,
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+
+class FakeTMDbTestCase(FakeTMDbMixin, TestCase):
+    pass
+
+
+class FakeClock:
+    """Stands in for time.time(), which the client and the in-memory cache
+    both read, so tests can move past TTLs without waiting"""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@override_settings(ROOT_URLCONF='tmdb.tests')
+class AsyncViewTests(FakeTMDbTestCase):
+    server_options = {'latency': 0.1}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='secret')
+        netflix = StreamingService.objects.create(name='Netflix', provider_id=8)
+        cls.user.streaming_services.add(netflix)
+
+    async def test_search_looks_up_providers_concurrently(self):
+        started = time.monotonic()
+        response = await self.async_client.get('/search/', {'q': 'matrix'})
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['results']), 20)
+        self.assertEqual(self.server.calls['/search/multi'], 1)
+        self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 10)
+        self.assertEqual(self.server.calls['/tv/{id}/watch/providers'], 10)
+        # 21 sequential round trips would take over two seconds
+        self.assertLess(elapsed, 1.5)
+
+    async def test_search_is_served_from_cache_the_second_time(self):
+        await self.async_client.get('/search/', {'q': 'matrix'})
+        calls = self.server.total_calls
+
+        response = await self.async_client.get('/search/', {'q': 'matrix'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.total_calls, calls)
+
+    async def test_search_flags_watchlist_and_subscribed_services(self):
+        await self.async_client.aforce_login(self.user)
+        first = (await self.async_client.get('/search/', {'q': 'matrix'})).context['results'][0]
+        await self.user.watchlist_items.acreate(
+            tmdb_id=first['id'], media_type=first['media_type'], title=first['title']
+        )
+        invalidate_user_contexts(self.user)
+
+        results = (await self.async_client.get('/search/', {'q': 'matrix'})).context['results']
+
+        self.assertTrue(results[0]['in_watchlist'])
+        self.assertFalse(any(result['in_watchlist'] for result in results[1:]))
+        for result in results:
+            providers = result['providers'] or {}
+            streams_on_netflix = any(
+                provider['provider_id'] == 8 for provider in providers.get('flatrate', [])
+            )
+            self.assertEqual(result['available_on_user_services'] == ['Netflix'], streams_on_netflix)
+
+    async def test_home_shows_trending_titles(self):
+        response = await self.async_client.get('/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['trending_items']), 12)
+        self.assertEqual(self.server.calls['/trending/all/week'], 1)
+
+    async def test_advanced_search_intersects_credits(self):
+        response = await self.async_client.get('/advanced-search/', {'people': 'ann and bob'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['people_found']), 2)
+        results = response.context['results']
+        self.assertTrue(results)
+        ratings = [result['vote_average'] for result in results]
+        self.assertEqual(ratings, sorted(ratings, reverse=True))
+        # Rows come from the credit records, with no detail fetches
+        self.assertEqual(self.server.calls['/movie/{id}'], 0)
+        self.assertEqual(self.server.calls['/tv/{id}'], 0)
+        self.assertEqual(
+            self.server.calls['/movie/{id}/watch/providers'] + self.server.calls['/tv/{id}/watch/providers'],
+            len(results)
+        )
+
+    async def test_advanced_search_discovers_movies(self):
+        response = await self.async_client.get(
+            '/advanced-search/', {'people': 'ann and bob', 'type': 'movie'}
+        )
+
+        results = response.context['results']
+        self.assertTrue(results)
+        self.assertEqual({result['media_type'] for result in results}, {'movie'})
+        self.assertEqual(self.server.calls['/discover/movie'], 1)
+        self.assertEqual(self.server.calls['/person/{id}/combined_credits'], 0)
+
+    async def test_advanced_search_checks_discovered_movies_against_directing_credits(self):
+        response = await self.async_client.get(
+            '/advanced-search/', {'people': 'cat and bob', 'type': 'movie'}
+        )
+
+        self.assertEqual(len(response.context['results']), 5)
+        self.assertEqual(self.server.calls['/discover/movie'], 1)
+        # Only the director's filmography is downloaded
+        self.assertEqual(self.server.calls['/person/{id}/combined_credits'], 1)
+
+
+class SearchTests(FakeTMDbTestCase):
+
+    def test_result_set_is_shared_between_users(self):
+        viewer = User.objects.create_user('viewer', password='secret')
+        first = self.client.get('/search/', {'q': 'Matrix'}).context['results'][0]
+        viewer.watchlist_items.create(
+            tmdb_id=first['id'], media_type=first['media_type'], title=first['title']
+        )
+        calls = self.server.total_calls
+
+        self.client.force_login(viewer)
+        results = self.client.get('/search/', {'q': '  matrix '}).context['results']
+
+        self.assertEqual(self.server.total_calls, calls)
+        self.assertTrue(results[0]['in_watchlist'])
+        self.assertFalse(first['in_watchlist'])
+
+
+class SearchApiTests(FakeTMDbTestCase):
+
+    def search(self, **params):
+        response = self.client.get('/api/search/', {'q': 'matrix', **params})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        return lines[0], lines[1:]
+
+    def test_streams_page_metadata_then_results(self):
+        page, results = self.search(cursor=2)
+
+        self.assertEqual(page, {'page': 2, 'total_pages': 5, 'next_cursor': 3})
+        self.assertEqual(len(results), 20)
+        self.assertEqual(self.server.calls['/search/multi'], 1)
+        self.assertEqual(
+            {result['id'] for result in results},
+            {result['id'] for result in self.search(cursor=2)[1]},
+        )
+
+    def test_last_page_has_no_next_cursor(self):
+        page, _ = self.search(cursor=5)
+
+        self.assertIsNone(page['next_cursor'])
+
+    @override_settings(TMDB_SEARCH_PREFETCH=True)
+    def test_next_page_is_prefetched_once_the_user_scrolls(self):
+        self.search(cursor=2)
+        deadline = time.monotonic() + 5
+        while cache.get('tmdb_search_rows_matrix_3_US') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        calls = self.server.total_calls
+
+        # Page 3 comes from the cache; page 4 is not prefetched so the count holds
+        with override_settings(TMDB_SEARCH_PREFETCH=False):
+            _, results = self.search(cursor=3)
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(self.server.total_calls, calls)
+
+    @override_settings(TMDB_SEARCH_PREFETCH=True)
+    def test_first_page_is_not_prefetched_past(self):
+        self.search()
+        self.client.get('/search/', {'q': 'matrix'})
+
+        self.assertIsNone(cache.get('tmdb_search_rows_matrix_2_US_prefetching'))
+        self.assertIsNone(cache.get('tmdb_search_rows_matrix_2_US'))
+        self.assertEqual(self.server.calls['/search/multi'], 1)
+
+    def test_concurrent_cold_streams_build_the_page_once(self):
+        self.server.latency = 0.1
+        self.addCleanup(setattr, self.server, 'latency', 0)
+
+        def stream(_):
+            total_pages, rows = TMDbClient().stream_search_rows('matrix', 2)
+            return [row.id for row in rows]
+
+        with mock.patch.object(TMDbClient, 'search_multi', autospec=True,
+                               side_effect=TMDbClient.search_multi) as search_multi:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                first, second = executor.map(stream, range(2))
+
+        search_multi.assert_called_once()
+        self.assertEqual(len(first), 20)
+        self.assertEqual(sorted(first), sorted(second))
+        self.assertEqual(self.server.calls['/search/multi'], 1)
+        self.assertEqual(
+            self.server.calls['/movie/{id}/watch/providers'] + self.server.calls['/tv/{id}/watch/providers'], 20
+        )
+
+    def test_closed_streams_still_cache_the_page(self):
+        _, rows = TMDbClient().stream_search_rows('matrix', 2)
+        next(rows)
+        rows.close()
+
+        self.assertEqual(len(TMDbClient().search_rows('matrix', 2).rows), 20)
+        self.assertEqual(self.server.calls['/search/multi'], 1)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get('/api/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'matrix', 'cursor': 'x'}).status_code, 400)
+
+
+class PageCacheTests(FakeTMDbTestCase):
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        first = self.client.get('/search/', {'q': 'matrix'})
+        calls = self.server.total_calls
+
+        with self.assertNumQueries(0):
+            second = self.client.get('/search/', {'q': 'matrix'})
+
+        self.assertEqual(self.server.total_calls, calls)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second['X-Frame-Options'], first['X-Frame-Options'])
+        self.assertIn('public', second['Cache-Control'])
+        self.assertIn('Cookie', second['Vary'])
+
+    def test_matching_etag_gets_not_modified(self):
+        etag = self.client.get('/')['ETag']
+
+        response = self.client.get('/', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_trending_refresh_drops_cached_pages(self):
+        first = self.client.get('/')
+        self.server.fixtures['/trending/all/week'] = {'page': 1, 'results': []}
+        self.addCleanup(self.server.fixtures.clear)
+        cache.delete('tmdb_trending_all_week')
+        TMDbClient().get_trending()  # as a background refresh would
+        self.server.reset()
+
+        second = self.client.get('/')
+        third = self.client.get('/')
+
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(third['ETag'], second['ETag'])
+        self.assertEqual(self.server.total_calls, 0)
+
+    def test_signed_in_users_bypass_the_cache(self):
+        self.client.get('/')
+        self.client.force_login(User.objects.create_user('viewer', password='secret'))
+
+        response = self.client.get('/')
+
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, 'Logout (viewer)')
+
+
+class AdvancedSearchTests(FakeTMDbTestCase):
+
+    def search(self, **params):
+        return self.client.get('/advanced-search/', {'people': 'ann and bob', **params})
+
+    def test_movie_search_is_pushed_down_to_discover(self):
+        response = self.search(type='movie', sort='popularity')
+
+        results = response.context['results']
+        popularity = [result['popularity'] for result in results]
+        self.assertTrue(results)
+        self.assertEqual(popularity, sorted(popularity, reverse=True))
+        self.assertEqual(self.server.calls['/discover/movie'], 1)
+        self.assertEqual(self.server.calls['/person/{id}/combined_credits'], 0)
+
+    def assert_paths_match(self, people, count):
+        discovered = self.search(people=people, type='movie').context['results']
+        self.assertEqual(self.server.calls['/discover/movie'], 1)
+        cache.clear()
+        # With every filmography cached, the credits are intersected instead
+        for name in people.split(' and '):
+            TMDbClient().get_person_credits(_number(name) % 100000 + 1)
+        self.server.reset()
+
+        intersected = self.search(people=people, type='movie').context['results']
+
+        self.assertEqual(self.server.calls['/discover/movie'], 0)
+        self.assertEqual(len(discovered), count)
+        self.assertEqual({result['id'] for result in discovered}, {result['id'] for result in intersected})
+
+    def test_discover_matches_credit_intersection(self):
+        self.assert_paths_match('ann and bob', 7)
+
+    def test_discover_keeps_only_directing_credits(self):
+        # Cat is a director who, like everyone on the fake server, also has
+        # cast credits; only the five movies they directed count
+        self.assert_paths_match('cat and bob', 5)
+
+    def test_movies_of_both_types_are_discovered(self):
+        results = self.search(type='both').context['results']
+
+        self.assertIn('movie', {result['media_type'] for result in results})
+        self.assertEqual(self.server.calls['/discover/movie'], 1)
+        # TMDb can't discover TV shows by person, so those still come from
+        # the credits
+        self.assertEqual(self.server.calls['/person/{id}/combined_credits'], 2)
+
+    def test_incomplete_credit_records_fall_back_to_details(self):
+        person_id = _number('ann') % 100000 + 1
+        self.server.fixtures[f'/person/{person_id}/combined_credits'] = {
+            'id': person_id,
+            'cast': [{'id': 7, 'media_type': 'movie', 'character': 'Lead'}],
+            'crew': [],
+        }
+        self.addCleanup(self.server.fixtures.clear)
+        # Cached credits are intersected rather than discovered
+        TMDbClient().get_person_credits(person_id)
+
+        results = self.client.get('/advanced-search/', {'people': 'ann'}).context['results']
+
+        self.assertEqual([result['title'] for result in results], ['Movie 7'])
+        self.assertEqual(self.server.calls['/movie/{id}'], 1)
+
+    def test_cached_credits_are_intersected_instead_of_discovered(self):
+        self.search(type='both')
+        self.server.reset()
+
+        response = self.search(type='movie')
+
+        self.assertTrue(response.context['results'])
+        self.assertEqual(self.server.calls['/discover/movie'], 0)
+        self.assertEqual(self.server.calls['/person/{id}/combined_credits'], 0)
+
+
+class CatalogTests(FakeTMDbMixin, TransactionTestCase):
+    """Catalog tests commit their rows so the writer thread sees them.
+
+    The shared in-memory test database locks whole tables, so writes are
+    flushed before the test touches the catalog itself.
+    """
+
+    def forget(self):
+        """Drop the cache and the TMDb call counts, leaving the catalog"""
+        catalog.flush_writes()
+        cache.clear()
+        self.server.reset()
+
+    def setUp(self):
+        super().setUp()
+        self.catalog_override = override_settings(TMDB_CATALOG_ENABLED=True)
+        self.catalog_override.enable()
+        self.addCleanup(self.catalog_override.disable)
+
+    def test_details_are_read_back_without_tmdb(self):
+        details = TMDbClient().get_movie_details(7)
+        self.forget()
+
+        client = TMDbClient()
+        self.assertEqual(client.get_movie_details(7), details)
+        self.assertEqual(len(client.get_credits('movie', 7)['cast']), 5)
+        providers = client.get_watch_providers('movie', 7)
+        self.assertEqual(self.server.total_calls, 0)
+        self.assertEqual(
+            {provider['provider_id'] for provider in providers['flatrate']},
+            {provider['provider_id'] for provider in self.server.payload('/movie/7/watch/providers', {})['results']['US']['flatrate']},
+        )
+
+    def test_search_writes_every_title_off_the_request_path(self):
+        with self.assertNoLogs('tmdb', level='ERROR'):
+            self.client.get('/search/', {'q': 'matrix'})
+            catalog.flush_writes()
+
+        self.assertEqual(Title.objects.filter(providers_updated__isnull=False).count(), 20)
+        self.forget()
+        search_page = TMDbClient().search_rows('matrix')
+        self.assertEqual(self.server.calls['/search/multi'], 1)
+        self.assertEqual(self.server.total_calls, 1)
+        self.assertEqual(len(search_page.rows), 20)
+
+    def test_person_credits_are_counted_and_read_back(self):
+        credits = TMDbClient().get_person_credits(3)
+        self.forget()
+
+        count = len(credits['cast']) + len(credits['crew'])
+        self.assertEqual(catalog.count_person_credits([3, 4]), {3: (count, True)})
+        self.assertEqual(TMDbClient().estimate_credit_downloads([3]), 0)
+        stored = TMDbClient().get_person_credits(3)
+        self.assertEqual(self.server.total_calls, 0)
+        self.assertEqual(
+            sorted(record['id'] for record in stored['cast']),
+            sorted(record['id'] for record in credits['cast']),
+        )
+
+    @override_settings(TMDB_CATALOG_MAX_AGE={'details': 60, 'credits': 60, 'providers': 60})
+    def test_rows_expire_after_their_max_age(self):
+        TMDbClient().get_movie_details(7)
+        self.forget()
+        past = timezone.now() - timedelta(seconds=61)
+        Title.objects.filter(tmdb_id=7).update(providers_updated=past)
+
+        self.assertIsNotNone(catalog.read_title('movie', 7))
+        self.assertIsNone(catalog.read_providers('movie', 7))
+        self.assertEqual(catalog.read_providers_many([('movie', 7)]), {})
+        TMDbClient().get_all_watch_providers('movie', 7)
+        self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 1)
+        catalog.flush_writes()
+
+        Title.objects.filter(tmdb_id=7).update(details_updated=past)
+        TMDbClient().get_movie_details(7)
+        self.assertEqual(self.server.calls['/movie/{id}'], 1)
+        catalog.flush_writes()
+        self.assertGreater(Title.objects.get(tmdb_id=7).providers_updated, past)
+
+    def test_fresh_rows_are_not_rewritten(self):
+        TMDbClient().get_watch_providers('movie', 7)
+        catalog.flush_writes()
+        rows = Availability.objects.filter(title__tmdb_id=7).count()
+
+        catalog.queue_write('test', catalog.write_providers, 'movie', 7, {})
+        catalog.flush_writes()
+
+        self.assertEqual(Availability.objects.filter(title__tmdb_id=7).count(), rows)
+        self.assertFalse(Person.objects.exists())
+
+
+class AsyncClientErrorTests(FakeTMDbTestCase):
+    server_options = {'error_rate': 1}
+
+    async def test_failed_lookups_are_retried_then_not_cached(self):
+        from .async_client import AsyncTMDbClient
+
+        with override_settings(TMDB_HTTP_RETRIES=2, TMDB_HTTP_BACKOFF=0):
+            self.assertIsNone(await AsyncTMDbClient().aget_trending())
+
+        self.assertEqual(self.server.calls['/trending/all/week'], 3)
+        self.assertIsNone(await cache.aget('tmdb_trending_all_week'))
+
+
+class SingleFlightTests(FakeTMDbTestCase):
+
+    def test_concurrent_misses_share_one_request(self):
+        self.server.latency = 0.2
+        self.addCleanup(setattr, self.server, 'latency', 0)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: TMDbClient().get_movie_details(7), range(8)))
+
+        self.assertEqual(self.server.calls['/movie/{id}'], 1)
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(results[0].title, 'Movie 7')
+
+    def test_leader_exception_reaches_followers_without_poisoning_the_key(self):
+        started = threading.Event()
+        follower_calls = []
+
+        def fail():
+            started.set()
+            time.sleep(0.2)
+            raise ValueError('upstream broke')
+
+        def follow():
+            started.wait()
+            try:
+                _single_flight('key', lambda: follower_calls.append(1))
+            except ValueError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            followers = [executor.submit(follow) for _ in range(2)]
+            with self.assertRaisesMessage(ValueError, 'upstream broke'):
+                _single_flight('key', fail)
+            errors = [follower.result() for follower in followers]
+
+        self.assertEqual([str(error) for error in errors], ['upstream broke'] * 2)
+        self.assertEqual(follower_calls, [])
+        self.assertNotIn('key', _in_flight)
+        # The next caller leads a new fetch
+        self.assertEqual(_single_flight('key', lambda: 'ok'), 'ok')
+
+    @override_settings(TMDB_NEGATIVE_CACHE_TTL=60)
+    def test_empty_answers_are_cached_for_the_negative_ttl(self):
+        clock = FakeClock()
+        with mock.patch('time.time', clock):
+            # Titles with IDs divisible by 5 have no providers
+            self.assertEqual(TMDbClient().get_all_watch_providers('movie', 10), {})
+            fresh_until, value = cache.get('tmdb_providers_movie_10')
+            self.assertEqual((fresh_until, value), (clock.now + 60, NO_DATA))
+
+            clock.advance(59)
+            self.assertEqual(TMDbClient().get_all_watch_providers('movie', 10), {})
+            self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 1)
+
+            clock.advance(2)
+            self.assertEqual(TMDbClient().get_all_watch_providers('movie', 10), {})
+            self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 2)
+
+
+@override_settings(TMDB_CACHE_TTLS={'trending': (10, 100)})
+class StaleWhileRevalidateTests(FakeTMDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch('time.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.serve_trending(1)
+        self.addCleanup(self.server.fixtures.pop, '/trending/all/week', None)
+
+    def serve_trending(self, tmdb_id):
+        self.server.fixtures['/trending/all/week'] = {
+            'page': 1, 'total_pages': 1, 'total_results': 1,
+            'results': [{'id': tmdb_id, 'media_type': 'movie', 'title': f'Movie {tmdb_id}'}],
+        }
+
+    def trending_id(self):
+        return TMDbClient().get_trending()['results'][0]['id']
+
+    def wait_for_refresh(self, fresh_until):
+        deadline = time.monotonic() + 5
+        while cache.get('tmdb_trending_all_week')[0] == fresh_until and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_fresh_entries_are_served_without_refreshing(self):
+        self.trending_id()
+        self.serve_trending(2)
+
+        self.clock.advance(9)
+
+        self.assertEqual(self.trending_id(), 1)
+        self.assertEqual(self.server.calls['/trending/all/week'], 1)
+
+    def test_stale_entries_are_served_while_one_refresh_runs(self):
+        self.trending_id()
+        fresh_until = cache.get('tmdb_trending_all_week')[0]
+        self.serve_trending(2)
+        self.server.latency = 0.2
+        self.addCleanup(setattr, self.server, 'latency', 0)
+
+        self.clock.advance(11)
+        started = time.monotonic()
+        stale = [self.trending_id() for _ in range(5)]
+
+        # Served at once, without waiting for TMDb
+        self.assertLess(time.monotonic() - started, 0.2)
+        self.assertEqual(stale, [1] * 5)
+        self.wait_for_refresh(fresh_until)
+        self.assertEqual(self.server.calls['/trending/all/week'], 2)
+        self.assertEqual(cache.get('tmdb_trending_all_week')[0], self.clock.now + 10)
+        self.assertEqual(self.trending_id(), 2)
+
+    def test_entries_past_the_hard_ttl_are_fetched_again(self):
+        self.trending_id()
+        self.serve_trending(2)
+
+        self.clock.advance(101)
+
+        self.assertEqual(self.trending_id(), 2)
+        self.assertEqual(self.server.calls['/trending/all/week'], 2)
+
+
+class CacheRecordTests(FakeTMDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reset_savings()
+
+    def test_details_are_cached_as_records(self):
+        details = TMDbClient().get_tv_details(42)
+
+        self.assertEqual(details, TMDbClient().get_tv_details(42))
+        self.assertEqual(self.server.calls['/tv/{id}'], 1)
+        self.assertIsInstance(details, TitleRecord)
+        self.assertEqual((details.title, details.release_date), ('Show 42', '2022-01-01'))
+        # The appended sub-resources are still cached on their own
+        self.assertEqual(len(TMDbClient().get_credits('tv', 42)['cast']), 5)
+        self.assertEqual(self.server.total_calls, 1)
+
+        name, entries, payload_bytes, cached_bytes = next(
+            row for row in savings_report() if row[0] == 'tv'
+        )
+        self.assertEqual(entries, 1)
+        self.assertLess(cached_bytes, payload_bytes)
+
+    def test_details_seed_their_sub_resources(self):
+        TMDbClient().get_movie_details(7)
+
+        client = TMDbClient()
+        payload = self.server.payload('/movie/7', {
+            'append_to_response': 'watch/providers,credits,recommendations'
+        })
+        self.assertEqual(client.get_all_watch_providers('movie', 7).get('GB'),
+                         payload['watch/providers']['results']['GB'])
+        self.assertEqual(client.get_credits('movie', 7)['cast'], payload['credits']['cast'])
+        self.assertEqual(client.get_recommendations('movie', 7)['results'],
+                         payload['recommendations']['results'])
+        self.assertEqual(self.server.total_calls, 1)
+
+    async def test_async_details_seed_their_sub_resources(self):
+        from .async_client import AsyncTMDbClient
+
+        await AsyncTMDbClient().aget_tv_details(9)
+
+        self.assertIsNotNone(await AsyncTMDbClient().aget_all_watch_providers('tv', 9))
+        self.assertIsNotNone(TMDbClient().get_credits('tv', 9))
+        self.assertEqual(self.server.total_calls, 1)
+
+    @override_settings(TMDB_CACHE_COMPRESS_MIN_BYTES=100)
+    def test_large_entries_are_compressed(self):
+        credits = TMDbClient().get_credits('movie', 7)
+
+        self.assertIsInstance(cache.get('tmdb_credits_movie_7')[1], Compressed)
+        self.assertEqual(TMDbClient().get_credits('movie', 7), credits)
+        self.assertEqual(self.server.total_calls, 1)
+
+    def test_report_command(self):
+        out = StringIO()
+        call_command('tmdb_cache_report', movie=[7, 8], stdout=out)
+
+        report = out.getvalue()
+        self.assertIn('movie', report)
+        self.assertIn('providers', report)
+
+
+@override_settings(TMDB_HTTP_BACKOFF=0.5, TMDB_HTTP_BACKOFF_MAX=2)
+class RetryDelayTests(SimpleTestCase):
+
+    def test_retry_after_is_capped(self):
+        self.assertEqual(retry_delay(0, httpx.Response(429, headers={'Retry-After': '120'})), 2)
+        self.assertEqual(retry_delay(0, httpx.Response(503, headers={'Retry-After': '1'})), 1)
+
+    def test_backoff_is_capped(self):
+        self.assertEqual([retry_delay(attempt) for attempt in range(4)], [0.5, 1, 2, 2])
+
+
+class BoundedLocMemCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = BoundedLocMemCache('bounded-test', {'OPTIONS': {'MAX_BYTES': 1000}})
+        self.addCleanup(self.cache.clear)
+
+    def test_least_recently_used_entries_are_evicted_by_size(self):
+        for key in 'abc':
+            self.cache.set(key, 'x' * 300)
+        self.cache.get('a')
+
+        self.cache.set('d', 'x' * 300)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual([key for key in 'acd' if self.cache.get(key)], ['a', 'c', 'd'])
+        self.assertLessEqual(self.cache.used_bytes, 1000)
+
+    def test_oversized_values_are_not_cached(self):
+        self.cache.set('a', 'x' * 300)
+        self.cache.set('a', 'x' * 2000)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.used_bytes, 0)
+
+
+class RateLimiterTests(FakeTMDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.limit = override_settings(
+            TMDB_RATE_LIMIT_FILE=os.path.join(directory, 'ratelimit'),
+            TMDB_RATE_LIMIT=0.01,
+            TMDB_RATE_LIMIT_BURST=5,
+            TMDB_RATE_LIMIT_RESERVE=2,
+            TMDB_RATE_LIMIT_MAX_WAIT={'interactive': 0, 'background': 0},
+        )
+        self.limit.enable()
+        self.addCleanup(self.limit.disable)
+
+    def test_background_requests_leave_a_reserve_for_interactive_ones(self):
+        background = [TMDbClient(priority=BACKGROUND).get_movie_details(movie_id) for movie_id in range(1, 6)]
+        interactive = [TMDbClient().get_movie_details(movie_id) for movie_id in range(6, 9)]
+
+        self.assertEqual([details is not None for details in background], [True] * 3 + [False] * 2)
+        self.assertEqual([details is not None for details in interactive], [True, True, False])
+        self.assertEqual(self.server.total_calls, 5)
+        stats = get_limiter().stats()
+        self.assertEqual((stats['background']['calls'], stats['background']['rejected']), (3, 2))
+        self.assertEqual((stats['interactive']['calls'], stats['interactive']['rejected']), (2, 1))
+
+    @override_settings(TMDB_HTTP_RETRIES=2, TMDB_HTTP_BACKOFF=0)
+    def test_every_retry_takes_a_token(self):
+        self.server.error_rate = 1
+        self.addCleanup(setattr, self.server, 'error_rate', 0)
+
+        self.assertIsNone(TMDbClient().get_movie_details(1))
+
+        self.assertEqual(self.server.calls['/movie/{id}'], 3)
+        self.assertEqual(get_limiter().stats()['interactive']['calls'], 3)
+
+    def test_background_refreshes_take_background_tokens(self):
+        cache.set('tmdb_trending_all_week', (0, {'results': []}), 3600)
+
+        self.assertEqual(TMDbClient().get_trending(), {'results': []})
+        deadline = time.monotonic() + 5
+        while cache.get('tmdb_trending_all_week')[0] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        stats = get_limiter().stats()
+        self.assertEqual((stats['background']['calls'], stats['interactive']['calls']), (1, 0))
+
+    async def test_async_requests_take_tokens(self):
+        from .async_client import AsyncTMDbClient
+
+        self.assertIsNotNone(await AsyncTMDbClient().aget_movie_details(1))
+
+        stats = await sync_to_async(get_limiter().stats)()
+        self.assertEqual(stats['interactive']['calls'], 1)
+
+    @override_settings(TMDB_RATE_LIMIT=20, TMDB_RATE_LIMIT_BURST=1, TMDB_RATE_LIMIT_RESERVE=0,
+                       TMDB_RATE_LIMIT_MAX_WAIT={'interactive': 1, 'background': 1})
+    def test_callers_wait_for_a_token(self):
+        started = time.monotonic()
+        for movie_id in range(1, 4):
+            self.assertIsNotNone(TMDbClient().get_movie_details(movie_id))
+
+        # Two refills at 20 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+        self.assertGreater(get_limiter().stats()['interactive']['waited'], 0)
+
+
+class WarmCacheTests(FakeTMDbTestCase):
+
+    def warm(self):
+        out = StringIO()
+        call_command('warm_tmdb_cache', top=3, watchlisted=2, stdout=out)
+        return out.getvalue()
+
+    def watchlist(self):
+        viewers = [User.objects.create_user(f'viewer{i}', password='secret') for i in range(3)]
+        for viewer in viewers:
+            viewer.watchlist_items.create(tmdb_id=7, media_type='movie', title='Movie 7')
+        for viewer in viewers[:2]:
+            viewer.watchlist_items.create(tmdb_id=101, media_type='movie', title='Movie 101')
+        viewers[0].watchlist_items.create(tmdb_id=9, media_type='tv', title='Show 9')
+
+    def test_warms_hot_titles(self):
+        self.watchlist()
+
+        report = self.warm()
+
+        self.assertIn('warming the catalog only', report)
+        self.assertIn('Warmed 4 lists and titles: 0 already warm, 4 fetched, 0 failed', report)
+        # Only the trending list the titles are picked from
+        self.assertEqual(self.server.calls['/trending/all/week'], 1)
+        self.assertEqual(self.server.calls['/trending/all/day'], 0)
+        self.assertEqual(self.server.calls['/watch/providers/movie'], 0)
+        # Trending 100-102 and watchlisted 7 and 101; providers come with
+        # the details
+        self.assertEqual(self.server.calls['/movie/{id}'] + self.server.calls['/tv/{id}'], 4)
+        self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 0)
+        self.assertIsNotNone(cache.get('tmdb_providers_movie_7'))
+        self.assertIsNone(cache.get('tmdb_tv_9'))
+
+        self.assertIn('4 already warm, 0 fetched', self.warm())
+
+    def test_warms_lists_in_a_shared_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory,
+        }}):
+            self.watchlist()
+            report = self.warm()
+            self.assertIsNotNone(cache.get('tmdb_providers_list_US'))
+
+        self.assertIn('Warmed 6 lists and titles: 0 already warm, 6 fetched, 0 failed', report)
+        self.assertEqual(self.server.calls['/trending/all/week'], 1)
+        self.assertEqual(self.server.calls['/trending/all/day'], 0)
+        self.assertEqual(self.server.calls['/watch/providers/movie'], 1)
+
+
+class RegionTests(FakeTMDbTestCase):
+
+    def test_providers_of_every_region_are_cached_once(self):
+        client = TMDbClient()
+        us = client.get_watch_providers('movie', 7)
+        gb = client.get_watch_providers('movie', 7, country='GB')
+
+        self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 1)
+        results = self.server.payload('/movie/7/watch/providers', {})['results']
+        self.assertEqual(us, results['US'])
+        self.assertEqual(gb, results['GB'])
+        self.assertIsNone(client.get_watch_providers('movie', 7, country='JP'))
+        self.assertIsInstance(cache.get('tmdb_providers_movie_7')[1], TitleProviders)
+
+    def test_switching_region_needs_no_upstream_calls(self):
+        viewer = User.objects.create_user('viewer', password='secret', region='GB')
+        self.client.force_login(viewer)
+        self.client.get('/search/', {'q': 'matrix'})
+        calls = self.server.total_calls
+
+        self.client.post('/accounts/profile/', {'region': 'CA'})
+        response = self.client.get('/search/', {'q': 'matrix'})
+
+        self.assertEqual(len(response.context['results']), 20)
+        self.assertEqual(self.server.total_calls, calls)
+        self.assertIsNotNone(cache.get('tmdb_search_rows_matrix_1_CA'))
+
+
+class BatchProviderTests(FakeTMDbTestCase):
+
+    @override_settings(TMDB_MAX_WORKERS=4)
+    def test_cached_entries_are_read_at_once_and_misses_fetched_on_a_bounded_pool(self):
+        items = [('movie', movie_id) for movie_id in range(1, 17)]
+        client = TMDbClient()
+        for item in items[:4]:
+            client.get_all_watch_providers(*item)
+        self.server.reset()
+        self.server.latency = 0.1
+        self.addCleanup(setattr, self.server, 'latency', 0)
+
+        with mock.patch.object(BoundedLocMemCache, 'get_many', autospec=True,
+                               side_effect=BoundedLocMemCache.get_many) as get_many:
+            providers = TMDbClient().get_watch_providers_many(items)
+
+        get_many.assert_called_once()
+        self.assertEqual(get_many.call_args.args[1], [f'tmdb_providers_movie_{i}' for i in range(1, 17)])
+        self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 12)
+        self.assertLessEqual(self.server.max_active, 4)
+        self.assertGreater(self.server.max_active, 1)
+        results = [self.server.payload(f'/movie/{i}/watch/providers', {})['results'] for i in range(1, 17)]
+        self.assertEqual(providers, [result.get('US') for result in results])
+
+
+class MetricsTests(FakeTMDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.metrics_dir = override_settings(METRICS_DIR=directory)
+        self.metrics_dir.enable()
+        self.addCleanup(self.metrics_dir.disable)
+        metrics.reset()
+        reset_savings()
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+
+    def scrape(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_records_tmdb_calls_and_cache_lookups(self):
+        client = TMDbClient()
+        client.get_movie_details(1)
+        client.get_movie_details(1)
+
+        text = self.scrape()
+        self.assertIn('tmdb_cache_lookups_total{family="tmdb_movie_",result="miss"} 1', text)
+        self.assertIn('tmdb_cache_lookups_total{family="tmdb_movie_",result="hit"} 1', text)
+        self.assertIn('tmdb_request_duration_seconds_count{endpoint="/movie/{id}"} 1', text)
+        self.assertIn('tmdb_requests_total{endpoint="/movie/{id}",outcome="ok"} 1', text)
+
+    def test_records_views(self):
+        self.client.get(reverse('search'), {'q': 'matrix'})
+
+        text = self.scrape()
+        self.assertIn('view_requests_total{method="GET",status="200",view="search"} 1', text)
+        self.assertIn('view_duration_seconds_count{view="search"} 1', text)
+        self.assertIn('view_db_queries_total{view="search"}', text)
+
+    def test_adds_up_every_worker(self):
+        TMDbClient().get_movie_details(1)
+        with open(os.path.join(settings.METRICS_DIR, '1.json'), 'w') as f:
+            json.dump({
+                'counters': [['tmdb_cache_lookups_total', {'family': 'tmdb_movie_', 'result': 'miss'}, 2]],
+                'histograms': [],
+            }, f)
+
+        self.assertIn('tmdb_cache_lookups_total{family="tmdb_movie_",result="miss"} 3', self.scrape())
+
+    def test_merges_workers_that_have_exited(self):
+        dead_pid = subprocess.Popen(['true'])
+        dead_pid.wait()
+        path = os.path.join(settings.METRICS_DIR, f'{dead_pid.pid}-0.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'counters': [['tmdb_cache_payload_bytes_total', {'lookup': 'movie'}, 1000]],
+                'histograms': [],
+            }, f)
+        TMDbClient().get_movie_details(1)
+        payload_bytes = next(row[2] for row in savings_report() if row[0] == 'movie')
+
+        for _ in range(2):
+            self.assertIn(f'tmdb_cache_payload_bytes_total{{lookup="movie"}} {payload_bytes + 1000}', self.scrape())
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(settings.METRICS_DIR, metrics.MERGED_FILENAME)))
+
+    async def test_async_requests_stay_on_the_event_loop(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = MetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get('/nowhere/'))
+
+        self.assertEqual(response.status_code, 200)
+        text = await sync_to_async(metrics.render)()
+        self.assertIn('view_requests_total{method="GET",status="200",view="not_found"} 1', text)
+
+    def test_is_staff_only(self):
+        self.client.force_login(User.objects.create_user('viewer', password='secret'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+
+class BenchmarkTests(TransactionTestCase):
+
+    def test_reports_every_view_and_concurrency_level(self):
+        with FakeTMDbServer() as server, override_settings(
+            TMDB_API_KEY='test-key', TMDB_API_BASE_URL=server.base_url,
+            TMDB_CATALOG_ENABLED=False, TMDB_RATE_LIMIT=0,
+        ):
+            user = benchmark.seed_user(watchlist_size=10)
+            results = benchmark.run(server, user, ('home', 'profile'), (1, 2), count=4)
+
+        self.assertEqual([(result.view, result.concurrency) for result in results],
+                         [('home', 1), ('home', 2), ('profile', 1), ('profile', 2)])
+        for result in results:
+            self.assertEqual((result.requests, result.errors), (4, 0))
+            self.assertLessEqual(result.p50, result.p95)
+            self.assertLessEqual(result.p95, result.p99)
+        # Each run starts from a cold cache
+        self.assertEqual([result.tmdb_calls for result in results], [1, 1, 0, 0])
+
+    def test_runs_start_from_an_empty_catalog(self):
+        title = Title.objects.create(tmdb_id=7, media_type='movie', title='Movie 7')
+        Availability.objects.create(title=title, region='US', offer_type='flatrate',
+                                    provider_id=8, provider_name='Netflix')
+        Person.objects.create(tmdb_id=3)
+
+        with FakeTMDbServer() as server, override_settings(
+            TMDB_API_KEY='test-key', TMDB_API_BASE_URL=server.base_url, TMDB_RATE_LIMIT=0,
+        ):
+            user = benchmark.seed_user(watchlist_size=0)
+            benchmark.measure(server, user, 'profile', 1, 1)
+
+        self.assertFalse(Title.objects.exists())
+        self.assertFalse(Availability.objects.exists())
+        self.assertFalse(Person.objects.exists())
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(
+            [benchmark.percentile(values, fraction) for fraction in (0.5, 0.95, 0.99)], [50, 95, 99]
+        )
+        self.assertIsNone(benchmark.percentile([], 0.5))
+
+
+class RecordReplayTests(FakeTMDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+    def transport(self, mode, **kwargs):
+        return override_settings(TMDB_TRANSPORT_MODE=mode, TMDB_TRANSPORT_ARCHIVE=self.archive_dir, **kwargs)
+
+    def test_replays_recorded_responses_offline(self):
+        with self.transport('record'):
+            recorded = TMDbClient().search_multi('matrix')
+        for filename in os.listdir(self.archive_dir):
+            with gzip.open(os.path.join(self.archive_dir, filename), 'rt') as f:
+                self.assertNotIn('test-key', f.read())
+
+        cache.clear()
+        self.server.reset()
+        with self.transport('replay', TMDB_API_KEY=''):
+            self.assertEqual(TMDbClient().search_multi('matrix'), recorded)
+            # Recorded errors are replayed too, and unrecorded requests fail
+            get_archive().record('/trending/all/day', {}, 404, None, 0)
+            self.assertIsNone(TMDbClient().get_trending(time_window='day'))
+            self.assertIsNone(TMDbClient().search_multi('alien'))
+        self.assertEqual(self.server.total_calls, 0)
+
+    async def test_async_client_shares_the_archive(self):
+        from .async_client import AsyncTMDbClient
+
+        with self.transport('record'):
+            recorded = await AsyncTMDbClient().aget_trending()
+
+        await cache.aclear()
+        self.server.reset()
+        with self.transport('replay'):
+            self.assertEqual(TMDbClient().get_trending(), recorded)
+        self.assertEqual(self.server.total_calls, 0)
+
+    def test_replays_recorded_latency(self):
+        with self.transport('replay', TMDB_REPLAY_LATENCY=True):
+            get_archive().record('/trending/all/week', {}, 200, {'results': []}, 0.1)
+            started = time.monotonic()
+            TMDbClient().get_trending()
+            self.assertGreaterEqual(time.monotonic() - started, 0.1)
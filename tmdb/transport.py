@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+# Responses worth retrying; Retry-After is honoured on all of them, up to
+# TMDB_HTTP_BACKOFF_MAX seconds
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# One async client per event loop, since connections can't cross loops
+_async_sessions = weakref.WeakKeyDictionary()
+
+
+def build_session():
+    """Build a keep-alive session with pooled connections.
+
+    Retries are made by TMDbClient rather than urllib3, so each attempt
+    goes through the rate limiter (see retry_delay()).
+    """
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.TMDB_HTTP_POOL_SIZE,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept': 'application/json'})
+    return session
+
+
+def get_session():
+    """Get the process-wide TMDb session.
+
+    The session is created lazily and rebuilt after a fork, so every
+    gunicorn worker owns its own connection pool.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = build_session()
+                _session_pid = pid
+    return _session
+
+
+def get_timeout():
+    """Get the (connect, read) timeout for TMDb requests"""
+    return (settings.TMDB_HTTP_CONNECT_TIMEOUT, settings.TMDB_HTTP_READ_TIMEOUT)
+
+
+def get_async_session():
+    """Get the httpx.AsyncClient for the running event loop.
+
+    Under ASGI there is one loop per worker, so every async TMDb call in
+    the worker shares the same keep-alive connection pool.
+    """
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None:
+        session = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                settings.TMDB_HTTP_READ_TIMEOUT,
+                connect=settings.TMDB_HTTP_CONNECT_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.TMDB_HTTP_POOL_SIZE,
+                max_keepalive_connections=settings.TMDB_HTTP_POOL_SIZE
+            ),
+            headers={'Accept': 'application/json'},
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+def retry_delay(attempt, response=None):
+    """Get the seconds to wait before retry number ``attempt`` (from 0),
+    preferring the server's Retry-After header, at most
+    TMDB_HTTP_BACKOFF_MAX"""
+    delay = settings.TMDB_HTTP_BACKOFF * (2 ** attempt)
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            delay = int(retry_after)
+    return min(delay, settings.TMDB_HTTP_BACKOFF_MAX)
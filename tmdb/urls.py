@@ -1,8 +1,14 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# The async views only pay off under an ASGI server (whatsplaying/asgi.py)
+search_views = async_views if settings.TMDB_ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('', views.home, name='home'),
-    path('search/', views.search, name='search'),
-    path('advanced-search/', views.advanced_search, name='advanced_search'),
-]
\ No newline at end of file
+    path('', search_views.home, name='home'),
+    path('search/', search_views.search, name='search'),
+    path('advanced-search/', search_views.advanced_search, name='advanced_search'),
+    path('api/search/', views.search_api, name='search_api'),
+    path('metrics/', views.metrics, name='metrics'),
+]
@@ -1,67 +1,47 @@
+import json
+
 from django.shortcuts import render, redirect
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from .client import TMDbClient
+from .metrics import render as render_metrics
+from .records import project_title
+from accounts.context import get_user_context
 from watchlist.models import WatchlistItem
 
 
-def search(request):
-    query = request.GET.get('q', '')
-    results = []
-    user_watchlist_ids = []
-    
-    if request.user.is_authenticated:
-        user_watchlist_ids = list(
-            request.user.watchlist_items.values_list('tmdb_id', flat=True)
-        )
-    
-    if query:
-        client = TMDbClient()
-        search_results = client.search_multi(query)
-        
-        if search_results and 'results' in search_results:
-            for item in search_results['results']:
-                if item.get('media_type') in ['movie', 'tv']:
-                    # Get watch providers
-                    providers = client.get_watch_providers(
-                        item['media_type'],
-                        item['id']
-                    )
-                    
-                    # Check if available on user's services
-                    available_on_user_services = []
-                    if request.user.is_authenticated and providers:
-                        user_service_ids = list(
-                            request.user.streaming_services.values_list('provider_id', flat=True)
-                        )
-                        
-                        if 'flatrate' in providers:
-                            for provider in providers['flatrate']:
-                                if provider['provider_id'] in user_service_ids:
-                                    available_on_user_services.append(provider['provider_name'])
-                    
-                    results.append({
-                        'id': item['id'],
-                        'title': item.get('title') or item.get('name'),
-                        'media_type': item['media_type'],
-                        'poster_path': client.get_image_url(item.get('poster_path')),
-                        'release_date': item.get('release_date') or item.get('first_air_date'),
-                        'overview': item.get('overview'),
-                        'in_watchlist': item['id'] in user_watchlist_ids,
-                        'providers': providers,
-                        'available_on_user_services': available_on_user_services,
-                    })
-    
-    return render(request, 'tmdb/search.html', {
-        'query': query,
-        'results': results,
-    })
+# Advanced search sort options: (TMDb discover sort_by, result field)
+SORT_OPTIONS = {
+    'rating': ('vote_average.desc', 'vote_average'),
+    'popularity': ('popularity.desc', 'popularity'),
+}
 
+# TMDb serves at most this many pages of any search
+MAX_SEARCH_PAGE = 500
 
-def home(request):
-    client = TMDbClient()
-    trending = client.get_trending('all', 'week')
-    
+# A discover page holds 20 titles, about the size of 20 credit records
+DISCOVER_PAGE_SIZE = 20
+
+
+def _search_result(row, user_context, registry=None):
+    """Overlay the user's watchlist and services on a shared SearchRow"""
+    result = row._asdict()
+    result['in_watchlist'] = user_context.in_watchlist(row.media_type, row.id)
+    result['available_on_user_services'] = user_context.available_services(row.providers, registry)
+    return result
+
+
+def _next_page(page, total_pages):
+    """Get the cursor for the page after this one, or None on the last page"""
+    if page < min(total_pages, MAX_SEARCH_PAGE):
+        return page + 1
+    return None
+
+
+def _trending_items(client, trending):
+    """Build the home page rows from a /trending response"""
     trending_items = []
     if trending and 'results' in trending:
         for item in trending['results'][:12]:  # Show top 12
@@ -73,9 +53,207 @@ def home(request):
                     'poster_path': client.get_image_url(item.get('poster_path')),
                     'release_date': item.get('release_date') or item.get('first_air_date'),
                 })
-    
+    return trending_items
+
+
+def _parse_people(people_query):
+    """Split the advanced search input by comma or "and" """
+    names = [name.strip() for name in people_query.replace(' and ', ',').split(',')]
+    return [name for name in names if name]
+
+
+def _found_person(client, person_result):
+    """Pick the most relevant /search/person match, or None"""
+    if person_result and 'results' in person_result and person_result['results']:
+        # Take the first result (most relevant)
+        person = person_result['results'][0]
+        return {
+            'id': person['id'],
+            'name': person['name'],
+            'profile_path': client.get_image_url(person.get('profile_path'), 'w185'),
+            'known_for_department': person.get('known_for_department', 'Acting')
+        }
+    return None
+
+
+def _is_actor(person):
+    return person['known_for_department'] == 'Acting'
+
+
+def _credited_titles(person, credits):
+    """Get the sets of movie and TV IDs a person is credited on in the role
+    they are searched by: cast credits for actors, directing credits for
+    everyone else"""
+    if _is_actor(person):
+        credited = credits.get('cast', [])
+    else:
+        credited = [item for item in credits.get('crew', []) if item.get('job') == 'Director']
+    movies = {item['id'] for item in credited if 'id' in item and item.get('media_type') == 'movie'}
+    tv_shows = {item['id'] for item in credited if 'id' in item and item.get('media_type') == 'tv'}
+    return movies, tv_shows
+
+
+def _discover_people(people_found):
+    """Split people into with_cast and with_crew IDs by their department.
+
+    with_crew matches any crew job, so discovered movies still have to be
+    checked against the directing credits (see _discovered_movies()).
+    """
+    cast = [person['id'] for person in people_found if _is_actor(person)]
+    crew = [person['id'] for person in people_found if not _is_actor(person)]
+    return cast or None, crew or None
+
+
+def _credits_needed(search_type, discover, people_found):
+    """Get the people whose combined credits a search reads: everyone when
+    intersecting credits, only the directors when discovering movies"""
+    if search_type != 'movie' or not discover:
+        return people_found
+    return [person for person in people_found if not _is_actor(person)]
+
+
+def _prefer_discover(search_type, credit_downloads):
+    """Pick /discover/movie over intersecting credits for the movies of a
+    search when it's cheaper.
+
+    TMDb can't discover TV shows by person, so TV titles always come from
+    the credits. For movies, one discover page beats downloading more than
+    a page's worth of credits.
+    """
+    return search_type in ['movie', 'both'] and credit_downloads > DISCOVER_PAGE_SIZE
+
+
+def _discovered_movies(discovered, people_found, all_credits):
+    """Get up to 20 movies of a discover page, keeping those every director
+    searched for directed, like the credit intersection does"""
+    movies = (discovered or {}).get('results', [])
+    for person in people_found:
+        if not _is_actor(person):
+            directed, _ = _credited_titles(person, all_credits.get(person['id']) or {})
+            movies = [movie for movie in movies if movie['id'] in directed]
+    return movies[:20]
+
+
+def _intersect_credits(people_found, all_credits):
+    """Get the movie and TV IDs every person is credited on in the role they
+    are searched by (see _credited_titles()). ``all_credits`` maps person
+    IDs to their combined credits; failed lookups are left out."""
+    all_movies = all_tv_shows = None
+    for person in people_found:
+        credits = all_credits.get(person['id'])
+        if not credits:
+            continue
+        person_movies, person_tv = _credited_titles(person, credits)
+        if all_movies is None:
+            all_movies, all_tv_shows = person_movies, person_tv
+        else:
+            all_movies &= person_movies
+            all_tv_shows &= person_tv
+    return all_movies or set(), all_tv_shows or set()
+
+
+def _credit_records(all_credits):
+    """Map (media_type, id) to a TitleRecord of the first credit naming
+    each title"""
+    records = {}
+    for credits in all_credits:
+        for credit_type in ('cast', 'crew'):
+            for item in (credits or {}).get(credit_type, []):
+                media_type = item.get('media_type')
+                if 'id' in item and media_type in ('movie', 'tv'):
+                    if (media_type, item['id']) not in records:
+                        records[(media_type, item['id'])] = project_title(media_type, item)
+    return records
+
+
+def _needs_details(record):
+    """Whether a credit record lacks fields the result rows show"""
+    return (
+        record is None
+        or not record.title
+        or record.overview is None
+        or record.vote_average is None
+    )
+
+
+def _detail_result(client, record, providers, user_context, registry=None):
+    """Build an advanced search result row from a TitleRecord"""
+    return {
+        'id': record.id,
+        'title': record.title,
+        'media_type': record.media_type,
+        'poster_path': client.get_image_url(record.poster_path),
+        'release_date': record.release_date,
+        'overview': record.overview,
+        'in_watchlist': user_context.in_watchlist(record.media_type, record.id),
+        'available_on_user_services': user_context.available_services(providers, registry),
+        'vote_average': record.vote_average or 0,
+        'popularity': record.popularity or 0,
+    }
+
+
+def search(request):
+    query = request.GET.get('q', '')
+    results = []
+    user_context = get_user_context(request)
+
+    next_cursor = None
+
+    if query:
+        # The result set is shared by every user; only the overlay is per user
+        search_page = TMDbClient().search_rows(query, country=user_context.region)
+        if search_page:
+            results = [_search_result(row, user_context) for row in search_page.rows]
+            next_cursor = _next_page(1, search_page.total_pages)
+
+    return render(request, 'tmdb/search.html', {
+        'query': query,
+        'results': results,
+        'next_cursor': next_cursor,
+    })
+
+
+def search_api(request):
+    """Stream a page of search results as newline-delimited JSON.
+
+    The first line holds the page number, total pages and the cursor of the
+    next page; each following line is a result, sent as soon as its watch
+    providers resolve. Once the user scrolls past page 1, the next page is
+    prefetched in the background.
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'success': False, 'message': 'Missing query'}, status=400)
+    try:
+        page = min(max(int(request.GET.get('cursor', 1)), 1), MAX_SEARCH_PAGE)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid cursor'}, status=400)
+
+    user_context = get_user_context(request)
+    client = TMDbClient()
+    streamed = client.stream_search_rows(query, page, user_context.region)
+    if streamed is None:
+        return JsonResponse({'success': False, 'message': 'Search is unavailable'}, status=502)
+    total_pages, rows = streamed
+
+    next_cursor = _next_page(page, total_pages)
+    if next_cursor and page >= 2:
+        client.prefetch_search_rows(query, next_cursor, user_context.region)
+
+    def lines():
+        yield json.dumps({'page': page, 'total_pages': total_pages, 'next_cursor': next_cursor}) + '\n'
+        for row in rows:
+            yield json.dumps(_search_result(row, user_context)) + '\n'
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+def home(request):
+    client = TMDbClient()
+    trending = client.get_trending('all', 'week')
+
     return render(request, 'tmdb/home.html', {
-        'trending_items': trending_items,
+        'trending_items': _trending_items(client, trending),
     })
 
 
@@ -83,138 +261,79 @@ def advanced_search(request):
     """Search for movies/TV shows by actors or directors"""
     people_query = request.GET.get('people', '')
     search_type = request.GET.get('type', 'both')  # movie, tv, or both
+    sort = request.GET.get('sort', 'rating')
+    if sort not in SORT_OPTIONS:
+        sort = 'rating'
+    sort_by, sort_field = SORT_OPTIONS[sort]
     results = []
     people_found = []
-    
+
     if people_query:
         client = TMDbClient()
-        
-        # Parse the input - split by comma or "and"
-        people_names = [name.strip() for name in people_query.replace(' and ', ',').split(',')]
-        person_ids = []
-        
+
         # Search for each person and get their ID
-        for name in people_names:
-            if name:
-                person_result = client.search_person(name)
-                if person_result and 'results' in person_result and person_result['results']:
-                    # Take the first result (most relevant)
-                    person = person_result['results'][0]
-                    person_ids.append(person['id'])
-                    people_found.append({
-                        'id': person['id'],
-                        'name': person['name'],
-                        'profile_path': client.get_image_url(person.get('profile_path'), 'w185'),
-                        'known_for_department': person.get('known_for_department', 'Acting')
-                    })
-        
+        for name in _parse_people(people_query):
+            person = _found_person(client, client.search_person(name))
+            if person:
+                people_found.append(person)
+        person_ids = [person['id'] for person in people_found]
+
         # Get movies/TV shows with ALL specified people
         if person_ids:
-            all_movies = set()
-            all_tv_shows = set()
-            
-            # For each person, get their credits
-            for i, person_id in enumerate(person_ids):
-                credits = client.get_person_credits(person_id)
-                if credits:
-                    # Get movies this person is in
-                    person_movies = set()
-                    if 'cast' in credits:
-                        for item in credits['cast']:
-                            if 'id' in item and item.get('media_type') == 'movie':
-                                person_movies.add(item['id'])
-                    if 'crew' in credits:
-                        for item in credits['crew']:
-                            if 'id' in item and item.get('media_type') == 'movie' and item.get('job') == 'Director':
-                                person_movies.add(item['id'])
-                    
-                    # Get TV shows this person is in
-                    person_tv = set()
-                    if 'cast' in credits:
-                        for item in credits['cast']:
-                            if 'id' in item and item.get('media_type') == 'tv':
-                                person_tv.add(item['id'])
-                    
-                    # For the first person, initialize the sets
-                    if i == 0:
-                        all_movies = person_movies
-                        all_tv_shows = person_tv
-                    else:
-                        # Find intersection with previous results
-                        all_movies = all_movies.intersection(person_movies)
-                        all_tv_shows = all_tv_shows.intersection(person_tv)
-            
-            # Get details for the matching content
-            user_watchlist_ids = []
-            if request.user.is_authenticated:
-                user_watchlist_ids = list(
-                    request.user.watchlist_items.values_list('tmdb_id', flat=True)
-                )
-            
-            # Process movies
-            if search_type in ['movie', 'both'] and all_movies:
-                for movie_id in list(all_movies)[:20]:  # Limit to 20 results
-                    movie = client.get_movie_details(movie_id)
-                    if movie:
-                        providers = client.get_watch_providers('movie', movie_id)
-                        available_on_user_services = []
-                        
-                        if request.user.is_authenticated and providers:
-                            user_service_ids = list(
-                                request.user.streaming_services.values_list('provider_id', flat=True)
-                            )
-                            if 'flatrate' in providers:
-                                for provider in providers['flatrate']:
-                                    if provider['provider_id'] in user_service_ids:
-                                        available_on_user_services.append(provider['provider_name'])
-                        
-                        results.append({
-                            'id': movie['id'],
-                            'title': movie.get('title'),
-                            'media_type': 'movie',
-                            'poster_path': client.get_image_url(movie.get('poster_path')),
-                            'release_date': movie.get('release_date'),
-                            'overview': movie.get('overview'),
-                            'in_watchlist': movie['id'] in user_watchlist_ids,
-                            'available_on_user_services': available_on_user_services,
-                            'vote_average': movie.get('vote_average', 0)
-                        })
-            
-            # Process TV shows
-            if search_type in ['tv', 'both'] and all_tv_shows:
-                for tv_id in list(all_tv_shows)[:20]:  # Limit to 20 results
-                    tv = client.get_tv_details(tv_id)
-                    if tv:
-                        providers = client.get_watch_providers('tv', tv_id)
-                        available_on_user_services = []
-                        
-                        if request.user.is_authenticated and providers:
-                            user_service_ids = list(
-                                request.user.streaming_services.values_list('provider_id', flat=True)
-                            )
-                            if 'flatrate' in providers:
-                                for provider in providers['flatrate']:
-                                    if provider['provider_id'] in user_service_ids:
-                                        available_on_user_services.append(provider['provider_name'])
-                        
-                        results.append({
-                            'id': tv['id'],
-                            'title': tv.get('name'),
-                            'media_type': 'tv',
-                            'poster_path': client.get_image_url(tv.get('poster_path')),
-                            'release_date': tv.get('first_air_date'),
-                            'overview': tv.get('overview'),
-                            'in_watchlist': tv['id'] in user_watchlist_ids,
-                            'available_on_user_services': available_on_user_services,
-                            'vote_average': tv.get('vote_average', 0)
-                        })
-            
-            # Sort by rating
-            results.sort(key=lambda x: x.get('vote_average', 0), reverse=True)
-    
+            user_context = get_user_context(request)
+            discover = _prefer_discover(search_type, client.estimate_credit_downloads(person_ids))
+            all_credits = {
+                person['id']: client.get_person_credits(person['id'])
+                for person in _credits_needed(search_type, discover, people_found)
+            }
+            records = {}
+            titles = []
+
+            if discover:
+                # TMDb intersects and sorts; one page is the 20 movies we show
+                with_cast, with_crew = _discover_people(people_found)
+                discovered = client.discover_movies(with_cast, with_crew, sort_by=sort_by)
+                for movie in _discovered_movies(discovered, people_found, all_credits):
+                    records[('movie', movie['id'])] = project_title('movie', movie)
+                    titles.append(('movie', movie['id']))
+
+            if search_type != 'movie' or not discover:
+                all_movies, all_tv_shows = _intersect_credits(people_found, all_credits)
+                credit_titles = []
+                if search_type in ['movie', 'both'] and not discover:
+                    credit_titles += [('movie', movie_id) for movie_id in list(all_movies)[:20]]  # Limit to 20 results
+                if search_type in ['tv', 'both']:
+                    credit_titles += [('tv', tv_id) for tv_id in list(all_tv_shows)[:20]]
+
+                # The credit records already carry what the rows show; only
+                # fetch details for titles whose records are incomplete
+                records.update(_credit_records(all_credits.values()))
+                for title in credit_titles:
+                    if _needs_details(records.get(title)):
+                        media_type, media_id = title
+                        if media_type == 'movie':
+                            records[title] = client.get_movie_details(media_id)
+                        else:
+                            records[title] = client.get_tv_details(media_id)
+                titles += credit_titles
+
+            all_providers = client.get_watch_providers_many(titles, user_context.region)
+            for title, providers in zip(titles, all_providers):
+                if records.get(title):
+                    results.append(_detail_result(client, records[title], providers, user_context))
+
+            results.sort(key=lambda x: x.get(sort_field) or 0, reverse=True)
+
     return render(request, 'tmdb/advanced_search.html', {
         'people_query': people_query,
         'search_type': search_type,
+        'sort': sort,
         'results': results,
         'people_found': people_found,
     })
+
+
+@staff_member_required
+def metrics(request):
+    """Serve the metrics of every worker in the Prometheus text format"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,127 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from tmdb import catalog
+from tmdb.client import TMDbClient
+from tmdb.ratelimit import BACKGROUND
+from watchlist.models import WatchlistItem
+
+
+class Command(BaseCommand):
+    help = 'Refresh cached streaming availability for watchlist items, stalest first'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--budget', type=int, default=settings.WATCHLIST_PROVIDER_REFRESH_BUDGET,
+            help='Maximum number of titles to look up per run (one TMDb request each at most)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Number of titles to look up and write back at a time'
+        )
+        parser.add_argument(
+            '--max-age', type=int, default=settings.WATCHLIST_PROVIDER_MAX_AGE,
+            help='Only refresh items last checked more than this many seconds ago'
+        )
+        parser.add_argument(
+            '--region',
+            help="Region whose providers are stored on every item, instead of each owner's region"
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, refreshing every --interval seconds'
+        )
+        parser.add_argument(
+            '--interval', type=int, default=900,
+            help='Seconds to sleep between runs with --loop'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # A long-running loop outlives its connection's CONN_MAX_AGE and
+            # any connection the database dropped while it slept
+            close_old_connections()
+            self.refresh(options)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def refresh(self, options):
+        started = time.monotonic()
+        titles = self.stale_titles(options['budget'], options['max_age'])
+        if not titles:
+            self.stdout.write('All watchlist items are up to date')
+            return
+
+        client = TMDbClient(priority=BACKGROUND)
+        updated = failed = 0
+        batch_size = max(1, options['batch_size'])
+        for start in range(0, len(titles), batch_size):
+            batch = titles[start:start + batch_size]
+            all_providers = client.get_all_watch_providers_many(batch)
+
+            # None means the lookup failed; leave those items stale so the
+            # next run picks them up first
+            providers_by_title = {}
+            for title, providers in zip(batch, all_providers):
+                if providers is None:
+                    failed += 1
+                else:
+                    providers_by_title[title] = providers
+
+            updated += self.write_back(providers_by_title, options['region'])
+        catalog.flush_writes()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed {len(titles) - failed} titles ({updated} watchlist items), '
+            f'{failed} failed, in {time.monotonic() - started:.1f}s'
+        ))
+
+    def stale_titles(self, budget, max_age):
+        """Get up to ``budget`` distinct (media_type, tmdb_id) pairs, stalest first"""
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+        rows = (
+            WatchlistItem.objects
+            .filter(Q(last_provider_check__isnull=True) | Q(last_provider_check__lt=cutoff))
+            .order_by(F('last_provider_check').asc(nulls_first=True))
+            .values_list('media_type', 'tmdb_id')
+        )
+
+        titles = {}
+        for title in rows.iterator():
+            titles.setdefault(title, None)
+            if len(titles) >= budget:
+                break
+        return list(titles)
+
+    def write_back(self, providers_by_title, region=None):
+        """Store providers on every user's watchlist item for each title, in
+        ``region`` or else the user's region"""
+        if not providers_by_title:
+            return 0
+
+        by_type = {}
+        for media_type, tmdb_id in providers_by_title:
+            by_type.setdefault(media_type, []).append(tmdb_id)
+        match = Q()
+        for media_type, ids in by_type.items():
+            match |= Q(media_type=media_type, tmdb_id__in=ids)
+
+        now = timezone.now()
+        items = list(
+            WatchlistItem.objects.filter(match)
+            .select_related('user')
+            .only('id', 'media_type', 'tmdb_id', 'user__region')
+        )
+        for item in items:
+            providers = providers_by_title[(item.media_type, item.tmdb_id)]
+            item.available_providers = providers.get(region or item.user.region, {})
+            item.last_provider_check = now
+        WatchlistItem.objects.bulk_update(items, ['available_providers', 'last_provider_check'])
+        return len(items)
@@ -33,6 +33,7 @@ class WatchlistItem(models.Model):
     rating = models.IntegerField(null=True, blank=True)  # User's personal rating (1-10)
     notes = models.TextField(blank=True)
     added_date = models.DateTimeField(auto_now_add=True)
+    position = models.IntegerField(default=0)  # Manual order within a status; new items come first
     watched_date = models.DateTimeField(null=True, blank=True)
     
     # Cache provider information
@@ -42,6 +43,9 @@ class WatchlistItem(models.Model):
     class Meta:
         unique_together = ['user', 'tmdb_id', 'media_type']
         ordering = ['-added_date']
+        indexes = [
+            models.Index(fields=['user', 'status', 'position'], name='watchlist_section_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} ({self.get_media_type_display()})"
@@ -1,3 +1,269 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import StreamingService, User
+from accounts.registry import get_registry
+from tmdb.client import TMDbClient
+from tmdb.tests import FakeTMDbMixin
+from .models import WatchlistItem
+
+
+class WatchlistTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='secret')
+        cls.items = [
+            WatchlistItem.objects.create(
+                user=cls.user, tmdb_id=tmdb_id, media_type='movie', title=f'Movie {tmdb_id}',
+                status='watching' if tmdb_id % 3 == 0 else 'want_to_watch',
+            )
+            for tmdb_id in range(1, 11)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+
+class WatchlistPageTests(WatchlistTestCase):
+
+    def test_page_query_count_does_not_grow_with_the_watchlist(self):
+        # Session, user, one page of every section, and the section counts
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('watchlist'))
+
+        self.assertEqual(response.context['want_to_watch']['count'], 7)
+        self.assertEqual(response.context['watching']['count'], 3)
+        self.assertEqual(response.context['watched']['count'], 0)
+
+    @override_settings(WATCHLIST_PAGE_SIZE=3)
+    def test_sections_are_paged_by_cursor(self):
+        seen = []
+        params = {}
+        while True:
+            section = self.client.get(reverse('watchlist'), params).context['want_to_watch']
+            seen += [item.tmdb_id for item in section['entries']]
+            if not section['next_cursor']:
+                break
+            params = {'want_to_watch_after': section['next_cursor']}
+
+        # Newest first, each item exactly once
+        self.assertEqual(seen, [10, 8, 7, 5, 4, 2, 1])
+
+    def test_invalid_cursor_shows_the_first_page(self):
+        response = self.client.get(reverse('watchlist'), {'watching_after': 'nope'})
+
+        self.assertEqual([item.tmdb_id for item in response.context['watching']['entries']], [9, 6, 3])
+
+
+class BulkUpdateTests(WatchlistTestCase):
+
+    def bulk(self, **data):
+        return self.client.post(
+            reverse('bulk_update_watchlist'), json.dumps(data), content_type='application/json'
+        )
+
+    def test_status_change(self):
+        ids = [item.id for item in self.items[:4]]
+
+        with self.assertNumQueries(3):
+            response = self.bulk(action='status', ids=ids, status='watched')
+
+        self.assertEqual(response.json(), {'success': True, 'count': 4})
+        watched = WatchlistItem.objects.filter(status='watched')
+        self.assertEqual(sorted(watched.values_list('id', flat=True)), ids)
+        self.assertFalse(watched.filter(watched_date__isnull=True).exists())
+
+    def test_remove(self):
+        response = self.bulk(action='remove', ids=[self.items[0].id, self.items[1].id])
+
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(self.user.watchlist_items.count(), 8)
+
+    def want_to_watch(self):
+        response = self.client.get(reverse('watchlist'))
+        return [item.tmdb_id for item in response.context['want_to_watch']['entries']]
+
+    def test_reorder_puts_listed_items_first(self):
+        response = self.bulk(action='reorder', ids=[self.items[0].id, self.items[3].id, self.items[1].id])
+
+        self.assertEqual(response.json()['count'], 3)
+        # The rest keep their order, newest first
+        self.assertEqual(self.want_to_watch(), [1, 4, 2, 10, 8, 7, 5])
+
+    def test_partial_reorder_keeps_the_earlier_order(self):
+        ids = {item.tmdb_id: item.id for item in self.items}
+        self.bulk(action='reorder', ids=[ids[tmdb_id] for tmdb_id in (1, 2, 4, 5, 7, 8, 10)])
+
+        self.bulk(action='reorder', ids=[ids[8], ids[2]])
+
+        self.assertEqual(self.want_to_watch(), [8, 2, 1, 4, 5, 7, 10])
+        # Other sections are untouched
+        self.assertFalse(WatchlistItem.objects.filter(status='watching').exclude(position=0).exists())
+
+    def test_other_users_items_are_untouched(self):
+        other = User.objects.create_user('other', password='secret')
+        item = WatchlistItem.objects.create(user=other, tmdb_id=1, media_type='movie', title='Movie 1')
+
+        response = self.bulk(action='remove', ids=[item.id])
+
+        self.assertEqual(response.json()['count'], 0)
+        self.assertTrue(WatchlistItem.objects.filter(id=item.id).exists())
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.bulk(action='status', ids=[1], status='lost').status_code, 400)
+        self.assertEqual(self.bulk(action='shuffle', ids=[1]).status_code, 400)
+        self.assertEqual(self.bulk(action='remove', ids='all').status_code, 400)
+
+
+class AvailabilityTests(WatchlistTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        services = StreamingService.objects.bulk_create([
+            StreamingService(provider_id=provider_id, name=name)
+            for provider_id, name in ((8, 'Netflix'), (15, 'Hulu'), (1899, 'Max'))
+        ])
+        cls.user.streaming_services.set(services[:2])
+
+        def providers(**offers):
+            return {
+                offer_type: [{'provider_id': provider_id, 'provider_name': str(provider_id)} for provider_id in ids]
+                for offer_type, ids in offers.items()
+            }
+
+        stored = {
+            1: providers(flatrate=[8]),
+            2: providers(flatrate=[8], free=[15]),
+            3: providers(rent=[8]),
+            4: providers(flatrate=[337]),
+        }
+        for item in cls.items:
+            if item.tmdb_id in stored:
+                item.available_providers = stored[item.tmdb_id]
+                item.last_provider_check = timezone.now()
+        WatchlistItem.objects.bulk_update(cls.items, ['available_providers', 'last_provider_check'])
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        get_registry()
+        # Not refreshed yet, but its providers are cached
+        TMDbClient()._store('providers', 'tmdb_providers_movie_9', {
+            'US': {'flatrate': [{'provider_id': 15, 'provider_name': 'Hulu', 'display_priority': 0}]},
+        })
+
+    def matrix(self, **params):
+        response = self.client.get(reverse('watchlist_availability'), params)
+        return {row.id: row.available for row in response.context['rows']}, response
+
+    def test_matrix_of_items_by_service(self):
+        # Session, user, the user's services and watchlist keys, the items,
+        # and saving the session's user context version in a savepoint
+        with self.assertNumQueries(8):
+            rows, response = self.matrix()
+
+        self.assertEqual(response.context['services'], [(15, 'Hulu'), (8, 'Netflix')])
+        by_tmdb_id = {item.tmdb_id: rows[item.id] for item in self.items}
+        self.assertEqual(by_tmdb_id[1], [False, True])
+        self.assertEqual(by_tmdb_id[2], [True, True])
+        self.assertEqual(by_tmdb_id[3], [False, False])
+        self.assertEqual(by_tmdb_id[4], [False, False])
+        self.assertEqual(by_tmdb_id[9], [True, False])
+        self.assertIsNone(by_tmdb_id[5])
+        self.assertEqual(response.context['available_count'], 3)
+
+    def test_filter_and_sort(self):
+        ids = {item.tmdb_id: item.id for item in self.items}
+        _, response = self.matrix(available=1, sort='available')
+        self.assertEqual([row.id for row in response.context['rows']], [ids[2], ids[1], ids[9]])
+
+        rows, _ = self.matrix(service=15)
+        self.assertEqual(set(rows), {ids[2], ids[9]})
+
+
+class RefreshProvidersTests(FakeTMDbMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='secret', region='GB')
+        cls.other = User.objects.create_user('other', password='secret')
+        now = timezone.now()
+        checked = {
+            1: now - timedelta(days=3),
+            2: now - timedelta(days=2),
+            3: now - timedelta(hours=1),
+            4: None,
+        }
+        for tmdb_id, last_check in checked.items():
+            WatchlistItem.objects.create(
+                user=cls.user, tmdb_id=tmdb_id, media_type='movie', title=f'Movie {tmdb_id}',
+                available_providers={'flatrate': []}, last_provider_check=last_check,
+            )
+        WatchlistItem.objects.create(user=cls.other, tmdb_id=1, media_type='movie', title='Movie 1')
+
+    def refresh(self, **options):
+        out = StringIO()
+        call_command('refresh_watchlist_providers', max_age=86400, stdout=out, **options)
+        return out.getvalue()
+
+    def item(self, tmdb_id, user=None):
+        return WatchlistItem.objects.get(user=user or self.user, tmdb_id=tmdb_id)
+
+    def test_budget_limits_the_stalest_titles_looked_up(self):
+        report = self.refresh(budget=2)
+
+        # Never checked first: movie 4, then movie 1 for the other user,
+        # which also refreshes the first user's movie 1
+        self.assertIn('Refreshed 2 titles (3 watchlist items), 0 failed', report)
+        self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 2)
+        self.assertIn('locale=GB', self.item(4).available_providers['link'])
+        self.assertGreater(self.item(1).last_provider_check, timezone.now() - timedelta(minutes=1))
+        self.assertLess(self.item(2).last_provider_check, timezone.now() - timedelta(days=1))
+
+    def test_items_checked_within_max_age_are_skipped(self):
+        self.assertIn('Refreshed 3 titles (4 watchlist items)', self.refresh(budget=10))
+
+        self.assertEqual(self.server.calls['/movie/{id}/watch/providers'], 3)
+        self.assertEqual(self.item(3).available_providers, {'flatrate': []})
+        self.assertIn('All watchlist items are up to date', self.refresh(budget=10))
+
+    def test_providers_are_written_in_each_owners_region(self):
+        self.refresh(budget=10)
+
+        self.assertIn('locale=GB', self.item(1).available_providers['link'])
+        self.assertIn('locale=US', self.item(1, self.other).available_providers['link'])
+        self.assertEqual(
+            [provider['provider_id'] for provider in self.item(2).available_providers['flatrate']],
+            [15, 386]
+        )
+
+        WatchlistItem.objects.update(last_provider_check=None)
+        self.refresh(budget=10, region='CA')
+        self.assertIn('locale=CA', self.item(1, self.other).available_providers['link'])
+
+    @override_settings(TMDB_HTTP_RETRIES=0)
+    def test_failed_lookups_stay_stale(self):
+        self.server.error_rate = 1
+        self.addCleanup(setattr, self.server, 'error_rate', 0)
+
+        self.assertIn('Refreshed 0 titles (0 watchlist items), 3 failed', self.refresh(budget=10))
+        self.assertIsNone(self.item(4).last_provider_check)
+
+    def test_loop_closes_stale_connections_before_each_pass(self):
+        command = 'watchlist.management.commands.refresh_watchlist_providers'
+        with mock.patch(f'{command}.close_old_connections') as close_old_connections, \
+                mock.patch(f'{command}.time.sleep', side_effect=[None, StopIteration]):
+            with self.assertRaises(StopIteration):
+                self.refresh(budget=10, loop=True, interval=0)
+
+        self.assertEqual(close_old_connections.call_count, 2)
@@ -3,7 +3,9 @@ from . import views
 
 urlpatterns = [
     path('', views.watchlist, name='watchlist'),
+    path('availability/', views.watchlist_availability, name='watchlist_availability'),
     path('add/', views.add_to_watchlist, name='add_to_watchlist'),
     path('remove/<int:item_id>/', views.remove_from_watchlist, name='remove_from_watchlist'),
     path('update/<int:item_id>/', views.update_watchlist_status, name='update_watchlist_status'),
+    path('bulk/', views.bulk_update_watchlist, name='bulk_update_watchlist'),
 ]
\ No newline at end of file
@@ -1,26 +1,157 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
 from django.http import JsonResponse
+from django.utils import timezone
 from django.views.decorators.http import require_POST
 from .models import WatchlistItem
+from accounts.context import get_user_context, invalidate_user_context
+from accounts.registry import get_registry
 from tmdb.client import TMDbClient
+from collections import namedtuple
 import json
 
 
+SECTIONS = [status for status, _ in WatchlistItem.STATUS_CHOICES]
+
+# Offer types that let a subscriber stream a title right away
+STREAMING_OFFERS = ('flatrate', 'free', 'ads')
+
+STATUS_LABELS = dict(WatchlistItem.STATUS_CHOICES)
+MEDIA_TYPE_LABELS = dict(WatchlistItem.MEDIA_TYPES)
+
+# A watchlist item in the availability matrix, with display labels for its
+# media type and status; ``available`` has a flag per service column, and
+# is None when the item's providers aren't known
+AvailabilityRow = namedtuple('AvailabilityRow', 'id title media_type status mask available')
+
+
+def _parse_cursor(value):
+    """Parse a '<position>.<id>' keyset cursor, or None if missing or invalid"""
+    try:
+        position, item_id = value.split('.')
+        return int(position), int(item_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _cursor(item):
+    return f"{item.position}.{item.id}"
+
+
+def _streaming_mask(providers, bits):
+    """OR together the bits of the services streaming a title"""
+    mask = 0
+    for offer_type in STREAMING_OFFERS:
+        for provider in providers.get(offer_type, ()):
+            mask |= bits.get(provider['provider_id'], 0)
+    return mask
+
+
 @login_required
 def watchlist(request):
-    items = request.user.watchlist_items.all()
-    
-    # Group items by status
-    want_to_watch = items.filter(status='want_to_watch')
-    watching = items.filter(status='watching')
-    watched = items.filter(status='watched')
-    
-    return render(request, 'watchlist/watchlist.html', {
-        'want_to_watch': want_to_watch,
-        'watching': watching,
-        'watched': watched,
+    page_size = settings.WATCHLIST_PAGE_SIZE
+
+    # Sections are ordered by (position, newest first); each one resumes
+    # after its own ?<status>_after= cursor
+    sections = Q()
+    for status in SECTIONS:
+        section = Q(status=status)
+        cursor = _parse_cursor(request.GET.get(f'{status}_after'))
+        if cursor:
+            position, item_id = cursor
+            section &= Q(position__gt=position) | Q(position=position, id__lt=item_id)
+        sections |= section
+
+    # One query for a page of every section, with one extra row per
+    # section to tell whether there is a next page
+    items = (
+        request.user.watchlist_items.filter(sections)
+        .annotate(rank=Window(
+            RowNumber(),
+            partition_by=F('status'),
+            order_by=[F('position').asc(), F('id').desc()],
+        ))
+        .filter(rank__lte=page_size + 1)
+        .order_by('rank')
+    )
+    grouped = {status: [] for status in SECTIONS}
+    for item in items:
+        grouped[item.status].append(item)
+
+    counts = request.user.watchlist_items.aggregate(**{
+        status: Count('id', filter=Q(status=status)) for status in SECTIONS
+    })
+
+    context = {}
+    for status in SECTIONS:
+        entries = grouped[status]
+        context[status] = {
+            'entries': entries[:page_size],
+            'count': counts[status],
+            'next_cursor': _cursor(entries[page_size - 1]) if len(entries) > page_size else None,
+        }
+    return render(request, 'watchlist/watchlist.html', context)
+
+
+@login_required
+def watchlist_availability(request):
+    """Show which of the user's services stream each item on their watchlist.
+
+    Each service is given a bit and each item a mask of the services
+    streaming it, in one pass over the providers stored on the items by
+    refresh_watchlist_providers, or cached for items not refreshed yet.
+    TMDb is never called. ?available=1 keeps the items streaming on any of
+    the services, ?service=<provider ID> those on one, and ?sort= orders by
+    'added' (the default), 'title' or 'available' (most services first).
+    """
+    user_context = get_user_context(request)
+    registry = get_registry()
+    services = sorted(
+        ((provider_id, registry.name(provider_id, str(provider_id))) for provider_id in user_context.service_ids),
+        key=lambda service: service[1].lower()
+    )
+    bits = {provider_id: 1 << index for index, (provider_id, _) in enumerate(services)}
+
+    items = list(request.user.watchlist_items.values_list(
+        'id', 'title', 'media_type', 'tmdb_id', 'status', 'available_providers', 'last_provider_check'
+    ))
+    unchecked = [(media_type, tmdb_id) for _, _, media_type, tmdb_id, _, _, checked in items if checked is None]
+    cached = TMDbClient().get_cached_watch_providers_many(unchecked, user_context.region) if unchecked else {}
+
+    rows = []
+    for item_id, title, media_type, tmdb_id, status, providers, checked in items:
+        if checked is None:
+            providers = cached.get((media_type, tmdb_id))
+        mask = _streaming_mask(providers, bits) if providers is not None else 0
+        rows.append(AvailabilityRow(
+            item_id, title, MEDIA_TYPE_LABELS.get(media_type, media_type), STATUS_LABELS.get(status, status), mask,
+            [bool(mask & bit) for bit in bits.values()] if providers is not None else None
+        ))
+    available_count = sum(1 for row in rows if row.mask)
+
+    service = request.GET.get('service', '')
+    if service.isdigit() and int(service) in bits:
+        service_bit = bits[int(service)]
+        rows = [row for row in rows if row.mask & service_bit]
+    elif request.GET.get('available'):
+        rows = [row for row in rows if row.mask]
+
+    sort = request.GET.get('sort', 'added')
+    if sort == 'title':
+        rows.sort(key=lambda row: row.title.lower())
+    elif sort == 'available':
+        rows.sort(key=lambda row: (-row.mask.bit_count(), row.title.lower()))
+
+    return render(request, 'watchlist/availability.html', {
+        'services': services,
+        'rows': rows,
+        'total_count': len(items),
+        'available_count': available_count,
+        'sort': sort,
     })
 
 
@@ -42,6 +173,7 @@ def add_to_watchlist(request):
     )
     
     if created:
+        invalidate_user_context(request)
         messages.success(request, f'{item.title} added to your watchlist!')
         return JsonResponse({'success': True, 'message': 'Added to watchlist'})
     else:
@@ -54,6 +186,7 @@ def remove_from_watchlist(request, item_id):
     item = get_object_or_404(WatchlistItem, id=item_id, user=request.user)
     title = item.title
     item.delete()
+    invalidate_user_context(request)
     messages.success(request, f'{title} removed from your watchlist!')
     return redirect('watchlist')
 
@@ -73,3 +206,61 @@ def update_watchlist_status(request, item_id):
         messages.success(request, f'Status updated for {item.title}')
     
     return redirect('watchlist')
+
+
+@login_required
+@require_POST
+def bulk_update_watchlist(request):
+    """Change the status of, remove or reorder many watchlist items at once.
+
+    Takes a JSON body of {"action": "status" | "remove" | "reorder",
+    "ids": [...]}, plus "status" for status changes. Reordering puts the
+    items first in their sections, in the order of "ids", followed by the
+    rest of each section in its current order.
+    """
+    try:
+        data = json.loads(request.body)
+        action = data['action']
+        ids = [int(item_id) for item_id in data['ids']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
+
+    items = request.user.watchlist_items.filter(id__in=ids)
+
+    if action == 'status':
+        status = data.get('status')
+        if status not in SECTIONS:
+            return JsonResponse({'success': False, 'message': 'Invalid status'}, status=400)
+        changes = {'status': status}
+        if status == 'watched':
+            changes['watched_date'] = timezone.now()
+        count = items.update(**changes)
+    elif action == 'remove':
+        count, _ = items.delete()
+        if count:
+            invalidate_user_context(request)
+    elif action == 'reorder':
+        # Renumber each section holding a listed item: the listed items
+        # first, in the order given, then the rest in their current order
+        order = {item_id: index for index, item_id in enumerate(ids)}
+        sections = {}
+        for item in (
+            request.user.watchlist_items
+            .filter(status__in=items.values('status'))
+            .order_by(F('position').asc(), F('id').desc())
+            .only('id', 'status', 'position')
+        ):
+            sections.setdefault(item.status, []).append(item)
+        renumbered = []
+        for section in sections.values():
+            section.sort(key=lambda item: order.get(item.id, len(ids)))
+            for position, item in enumerate(section, start=1):
+                if item.position != position:
+                    item.position = position
+                    renumbered.append(item)
+        WatchlistItem.objects.bulk_update(renumbered, ['position'])
+        count = sum(item.id in order for section in sections.values() for item in section)
+    else:
+        return JsonResponse({'success': False, 'message': 'Unknown action'}, status=400)
+
+    return JsonResponse({'success': True, 'count': count})
@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,6 +49,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'tmdb.middleware.MetricsMiddleware',
+    'tmdb.middleware.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,6 +86,27 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock when a transaction begins, so concurrent
+        # writers (e.g. the catalog writer thread and session saves) wait
+        # for each other instead of failing with "database is locked"
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+
+# Cache
+# Each worker keeps its own in-memory cache, capped in bytes and evicting
+# the least recently used entries first (see tmdb/cache.py)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'tmdb.cache.BoundedLocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=100000, cast=int),
+            'MAX_BYTES': config('CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int),
+        },
     }
 }
 
@@ -135,9 +160,94 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # TMDb API Configuration
 TMDB_API_KEY = config('TMDB_API_KEY', default='')
 TMDB_API_BASE_URL = config('TMDB_API_BASE_URL', default='https://api.themoviedb.org/3')
+# Serve home, search and advanced search from tmdb/async_views.py. Enable
+# when running under an ASGI server (whatsplaying.asgi:application).
+TMDB_ASYNC_VIEWS = config('TMDB_ASYNC_VIEWS', default=False, cast=bool)
+# Upper bound on concurrent TMDb lookups issued by a single request
+TMDB_MAX_WORKERS = config('TMDB_MAX_WORKERS', default=8, cast=int)
+# How long "no data" answers (e.g. no providers in a region) stay cached
+TMDB_NEGATIVE_CACHE_TTL = config('TMDB_NEGATIVE_CACHE_TTL', default=900, cast=int)
+# Per-lookup (soft, hard) cache TTLs in seconds, overriding the defaults in
+# tmdb/client.py. Between the two the stale value is served immediately
+# while a single background refresh fetches a new one.
+TMDB_CACHE_TTLS = {
+    'trending': (3600, 86400),
+    'providers_list': (604800, 2419200),
+}
+# TMDb responses are cached as compact records (tmdb/records.py); records
+# still pickling to this many bytes or more are stored zlib-compressed
+TMDB_CACHE_COMPRESS_MIN_BYTES = config('TMDB_CACHE_COMPRESS_MIN_BYTES', default=2048, cast=int)
+# Build the next page of search results in the background while the
+# current one is read, once the user has scrolled past the first page
+TMDB_SEARCH_PREFETCH = config('TMDB_SEARCH_PREFETCH', default=True, cast=bool)
+# Anonymous home and search pages are cached whole until trending data
+# refreshes or this many seconds pass, and browsers/CDNs may reuse them for
+# TMDB_PAGE_CACHE_MAX_AGE seconds before revalidating
+TMDB_PAGE_CACHE_TTL = config('TMDB_PAGE_CACHE_TTL', default=900, cast=int)
+TMDB_PAGE_CACHE_MAX_AGE = config('TMDB_PAGE_CACHE_MAX_AGE', default=60, cast=int)
+# Local title catalog (tmdb/models.py) read before TMDb and written through
+# on every fetch by a single writer thread, off the request path. Rows
+# older than these ages (seconds) are refetched.
+TMDB_CATALOG_ENABLED = config('TMDB_CATALOG_ENABLED', default=True, cast=bool)
+TMDB_CATALOG_MAX_AGE = {
+    'details': 604800,  # 1 week
+    'credits': 604800,
+    'providers': 86400,  # 1 day
+}
+# Token-bucket limit on TMDb requests, shared by the workers on a host
+# through TMDB_RATE_LIMIT_FILE (see tmdb/ratelimit.py). Background jobs
+# leave TMDB_RATE_LIMIT_RESERVE tokens for the views, and callers give up
+# after waiting TMDB_RATE_LIMIT_MAX_WAIT seconds. A rate of 0 disables it.
+TMDB_RATE_LIMIT = config('TMDB_RATE_LIMIT', default=40, cast=float)
+TMDB_RATE_LIMIT_BURST = config('TMDB_RATE_LIMIT_BURST', default=40, cast=int)
+TMDB_RATE_LIMIT_RESERVE = config('TMDB_RATE_LIMIT_RESERVE', default=10, cast=int)
+TMDB_RATE_LIMIT_MAX_WAIT = {
+    'interactive': 2,
+    'background': 60,
+}
+TMDB_RATE_LIMIT_FILE = config(
+    'TMDB_RATE_LIMIT_FILE', default=os.path.join(tempfile.gettempdir(), 'whatsplaying-tmdb-ratelimit')
+)
+# Shared keep-alive HTTP transport (see tmdb/transport.py)
+TMDB_HTTP_POOL_SIZE = config('TMDB_HTTP_POOL_SIZE', default=16, cast=int)
+TMDB_HTTP_CONNECT_TIMEOUT = config('TMDB_HTTP_CONNECT_TIMEOUT', default=3.05, cast=float)
+TMDB_HTTP_READ_TIMEOUT = config('TMDB_HTTP_READ_TIMEOUT', default=10, cast=float)
+TMDB_HTTP_RETRIES = config('TMDB_HTTP_RETRIES', default=3, cast=int)
+TMDB_HTTP_BACKOFF = config('TMDB_HTTP_BACKOFF', default=0.5, cast=float)
+# Longest wait before a retry, whatever the server's Retry-After says
+TMDB_HTTP_BACKOFF_MAX = config('TMDB_HTTP_BACKOFF_MAX', default=2, cast=float)
+# 'live', 'record' (save every TMDb response to TMDB_TRANSPORT_ARCHIVE) or
+# 'replay' (answer from the archive offline; see tmdb/archive.py)
+TMDB_TRANSPORT_MODE = config('TMDB_TRANSPORT_MODE', default='live')
+TMDB_TRANSPORT_ARCHIVE = config('TMDB_TRANSPORT_ARCHIVE', default=str(BASE_DIR / 'tmdb_archive'))
+TMDB_REPLAY_LATENCY = config('TMDB_REPLAY_LATENCY', default=False, cast=bool)
 
 # Authentication
 AUTH_USER_MODEL = 'accounts.User'
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
+# How long a user's streaming services and watchlist keys stay cached
+USER_CONTEXT_CACHE_TTL = config('USER_CONTEXT_CACHE_TTL', default=3600, cast=int)
+# Workers reload their streaming service registry (accounts/registry.py)
+# when the table changes, and at least this often in seconds
+PROVIDER_REGISTRY_TTL = config('PROVIDER_REGISTRY_TTL', default=300, cast=int)
+
+# Items shown per watchlist section before "Show more"
+WATCHLIST_PAGE_SIZE = config('WATCHLIST_PAGE_SIZE', default=48, cast=int)
+
+# Watchlist availability refresh (manage.py refresh_watchlist_providers)
+WATCHLIST_PROVIDER_REFRESH_BUDGET = config('WATCHLIST_PROVIDER_REFRESH_BUDGET', default=500, cast=int)
+WATCHLIST_PROVIDER_MAX_AGE = config('WATCHLIST_PROVIDER_MAX_AGE', default=86400, cast=int)
+
+# Cache warming (manage.py warm_tmdb_cache): trending titles, most
+# watchlisted titles and provider list regions to prefetch
+TMDB_WARM_TOP_TITLES = config('TMDB_WARM_TOP_TITLES', default=20, cast=int)
+TMDB_WARM_WATCHLISTED_TITLES = config('TMDB_WARM_WATCHLISTED_TITLES', default=100, cast=int)
+TMDB_WARM_REGIONS = config('TMDB_WARM_REGIONS', default='US', cast=Csv())
+
+# Metrics served to staff at /metrics/ (see tmdb/metrics.py). Each worker
+# writes its metrics to a file in METRICS_DIR at most every
+# METRICS_FLUSH_INTERVAL seconds, and the endpoint adds the files up.
+METRICS_DIR = config('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'whatsplaying-metrics'))
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5, cast=float)
@@ -0,0 +1,165 @@
+"""
+Query-count, TMDb call and latency budgets for every view.
+
+Each view is driven against FakeTMDbServer with a cold cache for users with
+0, 10 and 1,000 watchlist items. A test fails when a view goes over its
+query or TMDb call budget, or when its query count grows with the size of
+the watchlist. Wall-clock time depends on the machine, so the latency
+budgets are only checked with VIEW_LATENCY_BUDGETS=1 in the environment.
+"""
+import json
+import os
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+
+from accounts.models import StreamingService, User
+from accounts.registry import get_registry
+from tmdb.fake_server import PROVIDERS
+from tmdb.tests import FakeTMDbTestCase
+from watchlist.models import WatchlistItem
+
+
+Budget = namedtuple('Budget', 'queries tmdb_calls seconds')
+
+WATCHLIST_SIZES = (0, 10, 1000)
+
+CHECK_LATENCY = os.environ.get('VIEW_LATENCY_BUDGETS') == '1'
+
+# Upper bounds per request, keyed by (URL name, method). Session and user
+# lookups count towards the queries of signed-in requests, and the first
+# request to build a user context also saves its session. A cold search
+# makes one TMDb search and one provider lookup per result, with no
+# prefetch of the next page. A cold advanced search for movies and TV
+# discovers the movies and intersects credits for the TV shows.
+BUDGETS = {
+    ('home', 'get'): Budget(queries=2, tmdb_calls=1, seconds=1),
+    ('search', 'get'): Budget(queries=7, tmdb_calls=21, seconds=2),
+    ('search_api', 'get'): Budget(queries=4, tmdb_calls=21, seconds=2),
+    ('advanced_search', 'get'): Budget(queries=4, tmdb_calls=12, seconds=3),
+    ('watchlist', 'get'): Budget(queries=4, tmdb_calls=0, seconds=1),
+    ('watchlist_availability', 'get'): Budget(queries=6, tmdb_calls=0, seconds=1),
+    ('add_to_watchlist', 'post'): Budget(queries=9, tmdb_calls=0, seconds=1),
+    ('update_watchlist_status', 'post'): Budget(queries=4, tmdb_calls=0, seconds=1),
+    ('bulk_update_watchlist', 'post'): Budget(queries=3, tmdb_calls=0, seconds=1),
+    ('remove_from_watchlist', 'post'): Budget(queries=7, tmdb_calls=0, seconds=1),
+    ('profile', 'get'): Budget(queries=3, tmdb_calls=0, seconds=1),
+    ('profile', 'post'): Budget(queries=9, tmdb_calls=0, seconds=1),
+    ('login', 'get'): Budget(queries=0, tmdb_calls=0, seconds=1),
+    ('signup', 'get'): Budget(queries=0, tmdb_calls=0, seconds=1),
+    ('logout', 'post'): Budget(queries=4, tmdb_calls=0, seconds=1),
+    ('metrics', 'get'): Budget(queries=2, tmdb_calls=0, seconds=1),
+}
+
+
+def _url_names(resolver):
+    """Get the URL names routed by a resolver, leaving out the admin"""
+    names = set()
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace != 'admin':
+                names |= _url_names(pattern)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class ViewBudgetTests(FakeTMDbTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        services = StreamingService.objects.bulk_create([
+            StreamingService(provider_id=provider_id, name=name, logo_path=logo_path)
+            for provider_id, name, logo_path in PROVIDERS
+        ])
+        cls.users = {}
+        for size in WATCHLIST_SIZES:
+            # Staff, so the metrics endpoint is measured rather than redirected
+            user = User.objects.create_user(f'viewer{size}', password='secret', is_staff=True)
+            user.streaming_services.set(services[:3])
+            WatchlistItem.objects.bulk_create([
+                WatchlistItem(
+                    user=user, tmdb_id=tmdb_id, media_type='movie' if tmdb_id % 2 else 'tv',
+                    title=f'Title {tmdb_id}', status=WatchlistItem.STATUS_CHOICES[tmdb_id % 3][0],
+                )
+                for tmdb_id in range(1, size + 1)
+            ])
+            cls.users[size] = user
+
+    def measure(self, method, path, data=None, **extra):
+        """Make a request on a cold cache, returning (response, queries,
+        TMDb calls, seconds)"""
+        cache.clear()
+        # The provider registry is loaded once per worker, not per request
+        get_registry()
+        self.server.reset()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.monotonic()
+            response = getattr(self.client, method)(path, data, **extra)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.monotonic() - started
+        self.assertLess(response.status_code, 400, f'{method.upper()} {path}')
+        return response, len(queries), self.server.total_calls, elapsed
+
+    def requests(self):
+        """Yield (URL name, method, path, data, extra) for every view, as a
+        signed-in user would make them"""
+        json_body = {'content_type': 'application/json'}
+        yield 'home', 'get', reverse('home'), None, {}
+        yield 'search', 'get', reverse('search'), {'q': 'matrix'}, {}
+        yield 'search_api', 'get', reverse('search_api'), {'q': 'matrix', 'cursor': 2}, {}
+        yield 'advanced_search', 'get', reverse('advanced_search'), {'people': 'ann and bob'}, {}
+        yield 'watchlist', 'get', reverse('watchlist'), None, {}
+        yield ('watchlist_availability', 'get', reverse('watchlist_availability'),
+               {'available': 1, 'sort': 'available'}, {})
+        yield 'add_to_watchlist', 'post', reverse('add_to_watchlist'), json.dumps({
+            'tmdb_id': 999999, 'media_type': 'movie', 'title': 'Added',
+        }), json_body
+        item = WatchlistItem.objects.get(user=self.user, tmdb_id=999999)
+        yield ('update_watchlist_status', 'post', reverse('update_watchlist_status', args=[item.id]),
+               {'status': 'watched'}, {})
+        yield 'bulk_update_watchlist', 'post', reverse('bulk_update_watchlist'), json.dumps({
+            'action': 'status', 'ids': [item.id], 'status': 'watching',
+        }), json_body
+        yield 'remove_from_watchlist', 'post', reverse('remove_from_watchlist', args=[item.id]), None, {}
+        yield 'profile', 'get', reverse('profile'), None, {}
+        yield 'profile', 'post', reverse('profile'), {
+            'services': [provider_id for provider_id, _, _ in PROVIDERS],
+        }, {}
+        yield 'metrics', 'get', reverse('metrics'), None, {}
+        yield 'logout', 'post', reverse('logout'), None, {}
+        yield 'login', 'get', reverse('login'), None, {}
+        yield 'signup', 'get', reverse('signup'), None, {}
+
+    def test_every_view_has_a_budget(self):
+        self.assertEqual(_url_names(get_resolver()), {name for name, _ in BUDGETS})
+
+    def test_views_stay_within_budget(self):
+        query_counts = {}
+        for size, user in self.users.items():
+            self.user = user
+            self.client.force_login(user)
+            for name, method, path, data, extra in self.requests():
+                with self.subTest(view=name, method=method, watchlist_size=size):
+                    _, queries, tmdb_calls, seconds = self.measure(method, path, data, **extra)
+                    budget = BUDGETS[(name, method)]
+                    self.assertLessEqual(queries, budget.queries, 'SQL queries')
+                    self.assertLessEqual(tmdb_calls, budget.tmdb_calls, 'TMDb calls')
+                    if CHECK_LATENCY:
+                        self.assertLessEqual(seconds, budget.seconds, 'seconds')
+                    query_counts.setdefault((name, method), {})[size] = queries
+
+        # An empty watchlist may skip queries, so compare against the
+        # smallest non-empty one
+        smallest, largest = WATCHLIST_SIZES[1], WATCHLIST_SIZES[-1]
+        for (name, method), counts in query_counts.items():
+            with self.subTest(view=name, method=method):
+                self.assertLessEqual(
+                    counts[largest], counts[smallest],
+                    f'query count grows with the watchlist: {counts}'
+                )